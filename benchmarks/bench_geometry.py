@@ -0,0 +1,59 @@
+# benchmarks/bench_geometry.py
+
+"""
+Бенчмарк построения карты из границ: время по этапам process_geojson_file
+для наборов уровня субъектов (~88) и муниципалитетов (~2500).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_geometry.py [--workers N] [--sizes 88 2500]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geopandas as gpd
+from map_builder import prepare_regions, build_map_pyramid, timed_stage
+from config import MAP_LEVELS, GEOMETRY_WORKERS
+from benchmarks.synthetic import make_boundaries, REGION_LEVEL_COUNT, MUNICIPAL_LEVEL_COUNT
+
+
+def run(count, workers):
+    """Строит пирамиду карт для count синтетических регионов, возвращает время этапов"""
+    geojson_data = make_boundaries(count)
+
+    timings = {}
+    started = time.perf_counter()
+    with timed_stage(timings, 'from_features'):
+        gdf = gpd.GeoDataFrame.from_features(geojson_data['features'], crs='EPSG:4326')
+    gdf = gdf.rename(columns={'name': 'region'})
+    with timed_stage(timings, 'to_crs'):
+        gdf = gdf.to_crs('EPSG:32646')
+    regions = prepare_regions(gdf, simplify_tol=min(MAP_LEVELS.values()), workers=workers, timings=timings)
+    build_map_pyramid(regions, timings=timings)
+    timings['total'] = time.perf_counter() - started
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=GEOMETRY_WORKERS, help='число процессов для объединения границ')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[REGION_LEVEL_COUNT, MUNICIPAL_LEVEL_COUNT])
+    args = parser.parse_args()
+
+    # Логи (в том числе прогресс) не должны искажать замеры
+    logging.disable(logging.INFO)
+
+    for count in args.sizes:
+        timings = run(count, args.workers)
+        print(f"\n{count} регионов (workers={args.workers}):")
+        for stage, seconds in timings.items():
+            print(f"  {stage:<16} {seconds:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
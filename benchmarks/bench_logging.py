@@ -0,0 +1,122 @@
+# benchmarks/bench_logging.py
+
+"""
+Стоимость одной записи в лог: отключенные и включенные уровни, f-строки и
+ленивое %-форматирование, текст и JSON, print, прореживание и прогресс.
+Затем расчет метрик на синтетических данных с логированием в INFO и без него.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_logging.py [--calls 100000] [--flights 20000] [--regions 88]
+"""
+
+import os
+import io
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logging_config import JsonFormatter, SamplingFilter, ProgressLogger, TEXT_FORMAT
+from storage import get_storage
+from flight_data_processor import RegionFinder, write_flight_records, update_takeoff_regions_geojson
+from metrics_calculator import calculate_metrics
+from map_builder import regions_from_geojson
+from benchmarks.synthetic import make_boundaries, make_flights, REGION_LEVEL_COUNT
+from benchmarks.scratch import redirect_app_caches
+
+
+def per_call(func, calls):
+    """Среднее время вызова func (наносекунды)"""
+    started = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def make_logger(name, formatter=None, sampled=False):
+    """Логгер с обработчиком в память (вывод не зависит от терминала)"""
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(formatter or logging.Formatter(TEXT_FORMAT))
+    if sampled:
+        handler.addFilter(SamplingFilter())
+    logger.addHandler(handler)
+    return logger
+
+
+def bench_calls(calls):
+    text_logger = make_logger("text")
+    json_logger = make_logger("json", JsonFormatter())
+    sampled_logger = make_logger("sampled", sampled=True)
+    progress = ProgressLogger(text_logger, "bench", total=calls)
+    coords = "5545N03725E"
+    devnull = open(os.devnull, "w")
+
+    cases = [
+        ("debug f-строка (уровень отключен)", lambda i: text_logger.debug(f"Регион не найден для координат {coords} ({i})")),
+        ("debug %-форматирование (отключен)", lambda i: text_logger.debug("Регион не найден для координат %s (%d)", coords, i)),
+        ("info в текстовом формате", lambda i: text_logger.info("Обработка региона: %s (ID: %d)", coords, i)),
+        ("info в формате JSON", lambda i: json_logger.info("Обработка региона: %s (ID: %d)", coords, i)),
+        ("print f-строки", lambda i: print(f"🔍 Обработка региона: {coords} (ID: {i})", file=devnull)),
+        ("warning с прореживанием", lambda i: sampled_logger.warning(
+            "Неподдерживаемый формат координат: %s", coords, extra={"sampled": True}
+        )),
+        ("ProgressLogger.update", lambda i: progress.update()),
+    ]
+    print(f"\nСтоимость вызова ({calls} вызовов)")
+    for label, func in cases:
+        print(f"  {label:<38} {per_call(func, calls):8.0f} ns")
+
+
+def bench_metrics(flights_count, regions_count):
+    """Расчет метрик на SQLite с логированием в INFO (в /dev/null) и с отключенным логированием"""
+    # Индекс регионов строится во временной папке, кэши приложения не затрагиваются
+    with tempfile.TemporaryDirectory() as workdir, redirect_app_caches(workdir):
+        db_url = "sqlite:///" + os.path.join(workdir, "bench.sqlite")
+        storage = get_storage(db_url)
+        regions = regions_from_geojson(make_boundaries(regions_count))
+
+        logging.disable(logging.CRITICAL)
+        storage.load_regions(regions["region"].tolist(), regions.geometry.values)
+        write_flight_records(storage, make_flights(flights_count), "synthetic.xlsx")
+        update_takeoff_regions_geojson(storage.engine, RegionFinder(db_url))
+        logging.disable(logging.NOTSET)
+
+        root = logging.getLogger()
+        handler = logging.StreamHandler(open(os.devnull, "w"))
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+
+        print(f"\nРасчет метрик: {flights_count} полетов, {regions_count} регионов")
+        for label, level in (("логирование INFO", logging.NOTSET), ("логирование отключено", logging.CRITICAL)):
+            logging.disable(level)
+            timings = []
+            for _ in range(3):
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(open(os.devnull, "w")):
+                    calculate_metrics(db_url)
+                timings.append(time.perf_counter() - started)
+            print(f"  {label:<38} {min(timings):8.3f} s")
+        root.removeHandler(handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--flights", type=int, default=20000)
+    parser.add_argument("--regions", type=int, default=REGION_LEVEL_COUNT)
+    args = parser.parse_args()
+
+    bench_calls(args.calls)
+    bench_metrics(args.flights, args.regions)
+
+
+if __name__ == "__main__":
+    main()
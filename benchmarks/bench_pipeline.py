@@ -0,0 +1,205 @@
+# benchmarks/bench_pipeline.py
+
+"""
+Сквозной бенчмарк обработки: синтетический Excel SHR/DEP/ARR и границы из N регионов
+проходят все этапы (чтение Excel, разбор, запись, определение регионов вылета,
+расчет метрик, построение карты). Результат - JSON со временем этапов.
+
+С --check результат сравнивается с сохраненным базовым замером
+(benchmarks/baselines.json) и скрипт завершается с кодом 1 при регрессии.
+--update-baseline сохраняет текущий замер как базовый.
+
+По умолчанию используется временная база SQLite. Данные в базе --url заменяются
+(регионы и все полеты), поэтому PostgreSQL и база приложения (DB_URL) принимаются
+только с --overwrite.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_pipeline.py [--rows 10000] [--regions 88] [--invalid-share 0.05]
+        [--url sqlite:///... | --url postgresql://... --overwrite] [--output result.json]
+        [--check] [--update-baseline]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from map_builder import timed_stage, process_geojson_file, regions_from_geojson
+from storage import get_storage
+from flight_data_processor import (
+    RegionFinder, parse_flight_records, write_flight_records, update_takeoff_regions_geojson
+)
+from metrics_calculator import calculate_metrics
+from benchmarks.synthetic import make_boundaries, make_flight_messages, REGION_LEVEL_COUNT
+from benchmarks.scratch import redirect_app_caches, is_scratch_url
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# Этапы, по которым проверяется регрессия
+CHECKED_STAGES = (
+    "read_excel", "parse", "insert", "assign_regions", "calculate_metrics", "process_geojson_file"
+)
+
+
+def get_profile(args, backend):
+    """Ключ базового замера: хранилище и размер набора"""
+    return f"{backend}:{args.rows}x{args.regions}"
+
+
+def run(args, workdir):
+    """Выполняет этапы на синтетических данных, возвращает время этапов (с)"""
+    db_url = args.url or "sqlite:///" + os.path.join(workdir, "bench.sqlite")
+    storage = get_storage(db_url)
+    excel_file = os.path.join(workdir, "flights.xlsx")
+
+    # Подготовка данных в замер не входит
+    geojson_data = make_boundaries(args.regions, seed=args.seed)
+    make_flight_messages(args.rows, seed=args.seed, invalid_share=args.invalid_share).to_excel(excel_file, index=False)
+
+    timings = {}
+    storage.ensure_flights_schema()
+    storage.load_regions(*_regions_columns(geojson_data))
+    with storage.engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM flights")
+
+    with timed_stage(timings, "read_excel"):
+        df = pd.read_excel(excel_file)
+    region_finder = RegionFinder(db_url)
+    with timed_stage(timings, "parse"):
+        records, stats = parse_flight_records(df, region_finder.parse_compact_coords_to_decimal)
+    with timed_stage(timings, "insert"):
+        inserted = write_flight_records(storage, records, "synthetic.xlsx")
+    with timed_stage(timings, "assign_regions"):
+        update_takeoff_regions_geojson(storage.engine, region_finder)
+    with timed_stage(timings, "calculate_metrics"):
+        metrics_result = calculate_metrics(db_url)
+    with timed_stage(timings, "process_geojson_file"):
+        process_geojson_file(geojson_data, force_refresh=True)
+
+    with storage.engine.connect() as conn:
+        assigned = conn.exec_driver_sql("SELECT COUNT(takeoff_region_id) FROM flights").scalar()
+
+    return timings, {
+        "inserted": inserted,
+        "assigned": assigned,
+        "valid_dep_coords": stats["valid_dep_coords"],
+        "metrics_regions": metrics_result.get("regions_count", 0),
+    }
+
+
+def _regions_columns(geojson_data):
+    """Названия и геометрия регионов для загрузки в хранилище"""
+    gdf = regions_from_geojson(geojson_data)
+    return gdf["region"].tolist(), gdf.geometry.values
+
+
+def find_regressions(result, baseline, tolerance, min_delta):
+    """Этапы, ставшие медленнее базового замера больше чем на tolerance (и на min_delta секунд)"""
+    regressions = {}
+    for stage in CHECKED_STAGES:
+        current = result["stages"].get(stage)
+        expected = baseline["stages"].get(stage)
+        if current is None or expected is None:
+            continue
+        if current > expected * (1 + tolerance) and current - expected > min_delta:
+            regressions[stage] = {"baseline": expected, "current": current, "ratio": round(current / expected, 2)}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="число строк Excel")
+    parser.add_argument("--regions", type=int, default=REGION_LEVEL_COUNT, help="число регионов")
+    parser.add_argument("--invalid-share", type=float, default=0.05, help="доля некорректных координат в SHR")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="URL хранилища (по умолчанию временная база SQLite)")
+    parser.add_argument("--overwrite", action="store_true", help="разрешить замену данных в PostgreSQL и базе DB_URL")
+    parser.add_argument("--output", help="файл для JSON результата (по умолчанию stdout)")
+    parser.add_argument("--check", action="store_true", help="сравнить с базовым замером")
+    parser.add_argument("--update-baseline", action="store_true", help="сохранить замер как базовый")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="допустимое замедление этапа (доля)")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="игнорировать замедления меньше (с)")
+    args = parser.parse_args()
+
+    if args.url and not is_scratch_url(args.url) and not args.overwrite:
+        print(f"❌ {args.url.split('@')[-1]}: регионы и полеты будут заменены, укажите --overwrite", file=sys.stderr)
+        sys.exit(1)
+
+    # Логи (в том числе прогресс) и print не должны искажать замеры
+    logging.disable(logging.INFO)
+
+    # Карта и индекс регионов строятся во временной папке, кэши приложения не затрагиваются
+    with tempfile.TemporaryDirectory() as workdir, redirect_app_caches(workdir):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            timings, counts = run(args, workdir)
+        wall = time.perf_counter() - started
+
+    backend = get_storage(args.url).name if args.url else "sqlite"
+    result = {
+        "benchmark": "pipeline",
+        "profile": get_profile(args, backend),
+        "params": {
+            "rows": args.rows,
+            "regions": args.regions,
+            "invalid_share": args.invalid_share,
+            "seed": args.seed,
+            "backend": backend,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "stages": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        "total": round(sum(timings.values()), 4),
+        "wall": round(wall, 4),
+        "rows_per_second": round(args.rows / sum(timings.values()), 1),
+        "counts": counts,
+    }
+
+    exit_code = 0
+    baselines = {}
+    if os.path.exists(BASELINES_FILE):
+        with open(BASELINES_FILE, "r", encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    if args.check:
+        baseline = baselines.get(result["profile"])
+        if baseline is None:
+            print(f"⚠️ Нет базового замера для {result['profile']}", file=sys.stderr)
+        else:
+            result["regressions"] = find_regressions(result, baseline, args.tolerance, args.min_delta)
+            if result["regressions"]:
+                exit_code = 1
+                for stage, item in result["regressions"].items():
+                    print(f"❌ Регрессия {stage}: {item['baseline']:.3f} s -> {item['current']:.3f} s", file=sys.stderr)
+
+    if args.update_baseline:
+        baselines[result["profile"]] = {
+            "stages": result["stages"],
+            "environment": result["environment"],
+        }
+        with open(BASELINES_FILE, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/bench_startup.py
+
+"""
+Холодный запуск воркера: каждый замер - новый процесс Python, в котором
+импортируется main, выполняются обработчики запуска и первый запрос на чтение.
+Дополнительно проверяется, что импорт main не подгружает тяжелые библиотеки
+(geopandas, pandas, plotly, shapely, ...).
+
+С --check скрипт завершается с кодом 1, если медиана импорта превышает
+--budget секунд или импорт main подгружает тяжелые библиотеки.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_startup.py [--runs 5] [--path /metrics/overall]
+        [--check] [--budget 0.8]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Библиотеки, которые нужны только для загрузки файлов и построения карт
+HEAVY_MODULES = ("geopandas", "pandas", "plotly", "shapely", "pyproj", "numpy", "fiona", "pyogrio", "openpyxl")
+
+# Выполняется в отдельном процессе: время импорта, запуска и первого запроса
+CHILD_SCRIPT = """
+import sys, json, time, logging
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+logging.disable(logging.CRITICAL)
+from fastapi.testclient import TestClient
+client_ready = time.perf_counter()
+with TestClient(main.app) as client:
+    started_up = time.perf_counter()
+    status = client.get(PATH).status_code
+    first_request = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "startup": started_up - client_ready,
+    "first_request": first_request - started_up,
+    "status": status,
+    "heavy_modules": heavy,
+}))
+"""
+
+
+def run_once(path):
+    """Один холодный запуск в новом процессе"""
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\nPATH = {path!r}\n" + CHILD_SCRIPT
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    # Последняя строка - результат, выше может быть вывод приложения
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="число холодных запусков")
+    parser.add_argument("--path", default="/metrics/overall", help="первый запрос после запуска")
+    parser.add_argument("--check", action="store_true", help="проверить бюджет времени импорта")
+    parser.add_argument("--budget", type=float, default=0.8, help="бюджет медианы импорта main (с)")
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    result = {
+        "benchmark": "startup",
+        "runs": args.runs,
+        "path": args.path,
+        "median": {
+            stage: round(statistics.median(run[stage] for run in runs), 4)
+            for stage in ("import", "startup", "first_request")
+        },
+        "min_import": round(min(run["import"] for run in runs), 4),
+        "status": runs[-1]["status"],
+        "heavy_modules": runs[-1]["heavy_modules"],
+    }
+
+    exit_code = 0
+    if args.check:
+        if result["median"]["import"] > args.budget:
+            exit_code = 1
+            print(f"❌ Импорт main {result['median']['import']:.3f} s, бюджет {args.budget:.3f} s", file=sys.stderr)
+        if result["heavy_modules"]:
+            exit_code = 1
+            print(f"❌ Импорт main подгружает: {', '.join(result['heavy_modules'])}", file=sys.stderr)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
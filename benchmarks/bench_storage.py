@@ -0,0 +1,98 @@
+# benchmarks/bench_storage.py
+
+"""
+Сравнение хранилищ на одном синтетическом наборе: загрузка регионов и полетов,
+определение регионов вылета, расчет метрик и общей аналитики.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_storage.py [--flights 100000] [--regions 88]
+        [--url sqlite:////tmp/bench.sqlite] [--url postgresql://... --overwrite]
+
+По умолчанию сравнивается только встроенное хранилище SQLite во временной папке.
+Внимание: данные в указанных базах заменяются (и переключается версия границ),
+поэтому PostgreSQL и база приложения (DB_URL) принимаются только с --overwrite.
+Кэши карт, индекс регионов и тайлы пишутся во временную папку.
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geopandas as gpd
+from sqlalchemy import text
+from storage import get_storage
+from flight_data_processor import RegionFinder, write_flight_records, update_takeoff_regions_geojson
+from metrics_calculator import calculate_metrics
+from overview_metrics import get_overview_metrics
+from map_builder import timed_stage
+from benchmarks.synthetic import make_boundaries, make_flights, REGION_LEVEL_COUNT
+from benchmarks.scratch import redirect_app_caches, is_scratch_url
+
+
+def run(db_url, regions, flights):
+    """Выполняет этапы на хранилище db_url, возвращает время этапов"""
+    storage = get_storage(db_url)
+    timings = {}
+
+    with timed_stage(timings, "schema"):
+        storage.ensure_flights_schema()
+        with storage.engine.begin() as conn:
+            conn.execute(text("DELETE FROM flights"))
+    with timed_stage(timings, "load_regions"):
+        storage.load_regions(regions["region"].tolist(), regions.geometry.values)
+    with timed_stage(timings, "write_flights"):
+        # write_flight_records заменяет справочные значения id, набор копируется
+        write_flight_records(storage, [dict(record) for record in flights], "synthetic.xlsx")
+    with timed_stage(timings, "assign_regions"):
+        update_takeoff_regions_geojson(storage.engine, RegionFinder(db_url))
+    with timed_stage(timings, "calculate_metrics"):
+        result = calculate_metrics(db_url)
+    with timed_stage(timings, "overview"):
+        get_overview_metrics(db_url)
+
+    timings["total"] = sum(timings.values())
+    timings["metrics_regions"] = result.get("regions_count", 0)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flights", type=int, default=100000)
+    parser.add_argument("--regions", type=int, default=REGION_LEVEL_COUNT)
+    parser.add_argument("--url", action="append", help="URL хранилища (можно несколько)")
+    parser.add_argument("--overwrite", action="store_true", help="разрешить замену данных в PostgreSQL и базе DB_URL")
+    args = parser.parse_args()
+
+    protected = [db_url for db_url in args.url or [] if not is_scratch_url(db_url)]
+    if protected and not args.overwrite:
+        for db_url in protected:
+            print(f"❌ {db_url.split('@')[-1]}: данные будут заменены, укажите --overwrite", file=sys.stderr)
+        sys.exit(1)
+
+    geojson_data = make_boundaries(args.regions)
+    regions = gpd.GeoDataFrame.from_features(geojson_data["features"], crs="EPSG:4326")
+    regions = regions.rename(columns={"name": "region"})
+    flights = make_flights(args.flights)
+
+    # Логи и print расчета метрик не должны искажать замеры
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as workdir, redirect_app_caches(workdir):
+        for db_url in args.url or ["sqlite:///" + os.path.join(workdir, "bench.sqlite")]:
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                timings = run(db_url, regions, flights)
+            print(f"\n{db_url.split('@')[-1]}: {args.flights} полетов, {args.regions} регионов")
+            for stage, value in timings.items():
+                if stage == "metrics_regions":
+                    print(f"  {'metrics_regions':<18} {value:8d}")
+                else:
+                    print(f"  {stage:<18} {value:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# benchmarks/loadtest.py
+
+"""
+Нагрузочный тест эндпоинтов чтения дашборда. Каждый виртуальный пользователь
+в цикле повторяет загрузку страницы так же, как static/js/main.js:
+
+    GET /last_map                 проверка доступности сервера
+    GET /metrics/overall          общая статистика
+    GET /map                      карта грубого уровня
+    GET /debug/regions            сопоставление регионов карты и базы
+    GET /metrics/region/{id}      выбор регионов на карте (--clicks)
+
+Часть сессий (--overview-share) открывает раздел общей аналитики:
+GET /metrics/overall и дважды GET /metrics/regions (топ и таблица), с --calculate
+перед ними выполняется POST /calculate_metrics, как в браузере.
+
+Результат - пропускная способность и задержки p50/p95/p99 по эндпоинтам.
+Сервер запускается отдельно, например:
+    DB_URL=postgresql://... uvicorn main:app --port 8000
+
+С --seed база DB_URL (или --db-url) и кэш карт заполняются синтетическими
+регионами и полетами перед тестом. Внимание: данные в базе заменяются.
+
+Запуск из корня репозитория:
+    python benchmarks/loadtest.py [--base-url http://127.0.0.1:8000] [--users 10]
+        [--duration 30] [--warmup 3] [--clicks 3] [--overview-share 0.3] [--calculate]
+        [--seed] [--db-url postgresql://...] [--flights 100000] [--regions 88]
+        [--output result.json]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import platform
+import threading
+import contextlib
+import http.client
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Client:
+    """HTTP-клиент одного пользователя: одно keep-alive соединение, как у браузера"""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path):
+        """Выполняет запрос и читает тело ответа, возвращает (статус, тело)"""
+        if self.connection is None:
+            self.connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        try:
+            self.connection.request(method, path)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            # Соединение пересоздается при следующем запросе
+            self.close()
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Recorder:
+    """Задержки и ошибки по эндпоинтам (шаблонам путей)"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        self.recording = False
+
+    def add(self, endpoint, seconds, ok):
+        if not self.recording:
+            return
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def percentile(sorted_values, share):
+    """Процентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(share * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def page_load(client, recorder, region_ids, rng, args):
+    """Одна загрузка страницы в порядке запросов main.js"""
+
+    def call(endpoint, path, method="GET"):
+        started = time.perf_counter()
+        try:
+            status, _ = client.request(method, path)
+            ok = status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+        recorder.add(endpoint, time.perf_counter() - started, ok)
+
+    call("/last_map", "/last_map")
+    call("/metrics/overall", "/metrics/overall")
+    call("/map", "/map")
+    call("/debug/regions", "/debug/regions")
+    for _ in range(args.clicks if region_ids else 0):
+        call("/metrics/region/{region_id}", f"/metrics/region/{rng.choice(region_ids)}")
+
+    if rng.random() < args.overview_share:
+        if args.calculate:
+            call("/calculate_metrics", "/calculate_metrics", method="POST")
+        call("/metrics/overall", "/metrics/overall")
+        call("/metrics/regions", "/metrics/regions")
+        call("/metrics/regions", "/metrics/regions")
+
+
+def user_loop(user_index, recorder, region_ids, stop, args):
+    client = Client(args.base_url, args.timeout)
+    rng = random.Random(args.random_seed + user_index)
+    try:
+        while not stop.is_set():
+            page_load(client, recorder, region_ids, rng, args)
+            if args.think:
+                stop.wait(rng.expovariate(1 / args.think))
+    finally:
+        client.close()
+
+
+def get_region_ids(args):
+    """id регионов, по которым пользователи кликают на карте"""
+    client = Client(args.base_url, args.timeout)
+    try:
+        status, body = client.request("GET", "/debug/regions")
+    finally:
+        client.close()
+    if status != 200:
+        return []
+    return [region["id"] for region in json.loads(body).get("database_regions", [])]
+
+
+def seed(db_url, flights_count, regions_count):
+    """Заполняет базу и кэш карт синтетическими регионами и полетами"""
+    # Импорт здесь: без --seed скрипту не нужны зависимости приложения
+    from storage import get_storage
+    from flight_data_processor import RegionFinder, write_flight_records, update_takeoff_regions_geojson
+    from metrics_calculator import calculate_metrics
+    from map_builder import process_geojson_file, regions_from_geojson
+    from sqlalchemy import text
+    from benchmarks.synthetic import make_boundaries, make_flights
+
+    geojson_data = make_boundaries(regions_count)
+    regions = regions_from_geojson(geojson_data)
+    storage = get_storage(db_url)
+    storage.ensure_flights_schema()
+    with storage.engine.begin() as conn:
+        conn.execute(text("DELETE FROM flights"))
+    storage.load_regions(regions["region"].tolist(), regions.geometry.values)
+    write_flight_records(storage, make_flights(flights_count), "synthetic.xlsx")
+    update_takeoff_regions_geojson(storage.engine, RegionFinder(db_url))
+    calculate_metrics(db_url)
+    # Карта строится в кэш приложения и становится последней картой для /map и /last_map
+    process_geojson_file(geojson_data)
+
+
+def summarize(recorder, elapsed):
+    """Пропускная способность и процентили задержек по эндпоинтам (мс)"""
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        values = sorted(latencies)
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": recorder.errors[endpoint],
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            "max_ms": round(values[-1] * 1000, 1),
+        }
+    total = sum(item["requests"] for item in endpoints.values())
+    return endpoints, {
+        "requests": total,
+        "errors": sum(item["errors"] for item in endpoints.values()),
+        "rps": round(total / elapsed, 1),
+    }
+
+
+def print_report(result):
+    print(f"\n{result['params']['base_url']}: {result['params']['users']} пользователей, "
+          f"{result['elapsed']:.1f} с", file=sys.stderr)
+    print(f"  {'эндпоинт':<30} {'запросов':>8} {'ошибок':>7} {'rps':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}", file=sys.stderr)
+    for endpoint, item in result["endpoints"].items():
+        print(f"  {endpoint:<30} {item['requests']:>8} {item['errors']:>7} {item['rps']:>8.1f} "
+              f"{item['p50_ms']:>8.1f} {item['p95_ms']:>8.1f} {item['p99_ms']:>8.1f} {item['max_ms']:>8.1f}",
+              file=sys.stderr)
+    total = result["total"]
+    print(f"  {'всего':<30} {total['requests']:>8} {total['errors']:>7} {total['rps']:>8.1f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="адрес запущенного сервера")
+    parser.add_argument("--users", type=int, default=10, help="число одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=30, help="длительность замера (с)")
+    parser.add_argument("--warmup", type=float, default=3, help="прогрев без учета в результате (с)")
+    parser.add_argument("--think", type=float, default=0, help="средняя пауза между загрузками страницы (с)")
+    parser.add_argument("--clicks", type=int, default=3, help="выбранных регионов за загрузку страницы")
+    parser.add_argument("--overview-share", type=float, default=0.3, help="доля сессий с общей аналитикой")
+    parser.add_argument("--calculate", action="store_true", help="POST /calculate_metrics в общей аналитике")
+    parser.add_argument("--timeout", type=float, default=60, help="таймаут запроса (с)")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--seed", action="store_true", help="заполнить базу синтетическими данными перед тестом")
+    parser.add_argument("--db-url", help="база для --seed (по умолчанию DB_URL из config)")
+    parser.add_argument("--flights", type=int, default=100000, help="число полетов для --seed")
+    parser.add_argument("--regions", type=int, default=88, help="число регионов для --seed")
+    parser.add_argument("--output", help="файл для JSON результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    if args.seed:
+        from config import DB_URL
+        logging.disable(logging.INFO)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stderr):
+            seed(args.db_url or DB_URL, args.flights, args.regions)
+        logging.disable(logging.NOTSET)
+        print(f"🌱 База заполнена за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+    try:
+        region_ids = get_region_ids(args)
+    except (OSError, http.client.HTTPException) as e:
+        print(f"❌ Сервер {args.base_url} недоступен: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not region_ids:
+        print("⚠️ В базе нет регионов, запросы /metrics/region/{id} не выполняются", file=sys.stderr)
+
+    recorder = Recorder()
+    stop = threading.Event()
+    users = [
+        threading.Thread(target=user_loop, args=(i, recorder, region_ids, stop, args), daemon=True)
+        for i in range(args.users)
+    ]
+    for user in users:
+        user.start()
+
+    # Прогрев: соединения установлены, кэши сервера заполнены
+    time.sleep(args.warmup)
+    recorder.recording = True
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    recorder.recording = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for user in users:
+        user.join()
+
+    endpoints, total = summarize(recorder, elapsed)
+    result = {
+        "benchmark": "loadtest",
+        "params": {
+            "base_url": args.base_url,
+            "users": args.users,
+            "duration": args.duration,
+            "think": args.think,
+            "clicks": args.clicks,
+            "overview_share": args.overview_share,
+            "calculate": args.calculate,
+            "regions_in_db": len(region_ids),
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "elapsed": round(elapsed, 2),
+        "endpoints": endpoints,
+        "total": total,
+    }
+    print_report(result)
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# benchmarks/scratch.py
+
+"""Изоляция бенчмарков от данных приложения: кэши во временной папке, проверка URL базы"""
+
+import os
+import contextlib
+from sqlalchemy.engine import make_url
+
+import map_cache
+import region_index
+import tile_builder
+from config import DB_URL
+
+
+@contextlib.contextmanager
+def redirect_app_caches(workdir):
+    """
+    На время бенчмарка кэш карт, индекс регионов и кэш тайлов пишутся в workdir:
+    бенчмарк не заменяет индекс и карты запущенного сервера.
+    """
+    patches = [
+        (map_cache, "CACHE_DIR", workdir),
+        (region_index, "REGION_INDEX_DIR", os.path.join(workdir, "regions")),
+        (region_index, "_region_index", None),
+        (tile_builder, "TILE_CACHE_DIR", os.path.join(workdir, "tiles")),
+        (tile_builder, "TILE_STATE_FILE", os.path.join(workdir, "tiles", "current.json")),
+        (tile_builder, "_state_cache", {"version": None, "state": tile_builder.DEFAULT_TILE_STATE}),
+    ]
+    saved = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield workdir
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+
+
+def is_scratch_url(db_url):
+    """
+    True для баз, которые бенчмарк может безопасно перезаписать: SQLite, кроме
+    базы приложения (DB_URL). PostgreSQL считается рабочей базой.
+    """
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite":
+        return False
+    if not url.database or url.database == ":memory:":
+        return True
+    app_url = make_url(DB_URL)
+    if app_url.get_backend_name() != "sqlite" or not app_url.database:
+        return True
+    return os.path.abspath(url.database) != os.path.abspath(app_url.database)
@@ -0,0 +1,169 @@
+# benchmarks/synthetic.py
+
+"""Синтетические данные для бенчмарков: границы регионов в формате GeoJSON и полеты"""
+
+import numpy as np
+import shapely
+from shapely.geometry import box, mapping
+
+# Примерный охват территории России (EPSG:4326)
+RUSSIA_BBOX = (28.0, 42.0, 180.0, 78.0)
+
+# Число объектов для типовых наборов границ
+REGION_LEVEL_COUNT = 88
+MUNICIPAL_LEVEL_COUNT = 2500
+
+# Справочные значения синтетических полетов
+AIRCRAFT_TYPES = ("BLA", "AER", "SHAR")
+OPERATOR_COUNT = 200
+AIRCRAFT_COUNT = 2000
+
+
+def make_boundaries(count, seed=42, segment_length=0.05, island_share=0.2, bbox=RUSSIA_BBOX):
+    """
+    Генерирует count соседних регионов (диаграмма Вороного по случайным точкам).
+    Границы дробятся на короткие отрезки, чтобы число вершин было похоже на
+    реальные границы; часть регионов получает мелкие и крупные острова.
+    """
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bbox
+    points = shapely.points(np.column_stack([
+        rng.uniform(minx, maxx, count),
+        rng.uniform(miny, maxy, count),
+    ]))
+
+    extent = box(*bbox)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(points), extend_to=extent))
+    cells = shapely.intersection(cells, extent)
+    cells = shapely.segmentize(cells, segment_length)
+
+    # Между соседями остается узкий зазор, как у независимо оцифрованных границ
+    cells = shapely.buffer(cells, -0.0005, join_style='mitre')
+
+    features = []
+    for i, cell in enumerate(cells):
+        geom = cell
+        if rng.random() < island_share:
+            cx, cy = shapely.get_coordinates(shapely.centroid(cell))[0]
+            islands = [
+                shapely.buffer(shapely.points(cx + rng.normal(0, 0.5), cy + rng.normal(0, 0.5)), radius, quad_segs=16)
+                for radius in (0.001, 0.002, 0.3)
+            ]
+            geom = shapely.union_all([cell] + islands)
+        if geom.geom_type == 'Polygon':
+            geom = shapely.multipolygons([geom])
+        features.append({
+            "type": "Feature",
+            "properties": {"name": f"Регион {i + 1}"},
+            "geometry": mapping(geom),
+        })
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def format_compact_coords(lon, lat):
+    """Координаты в компактном формате планов полетов: 5957N02905E"""
+    lat_deg, lat_min = divmod(int(round(abs(lat) * 60)), 60)
+    lon_deg, lon_min = divmod(int(round(abs(lon) * 60)), 60)
+    return (
+        f"{lat_deg:02d}{lat_min:02d}{'N' if lat >= 0 else 'S'}"
+        f"{lon_deg:03d}{lon_min:02d}{'E' if lon >= 0 else 'W'}"
+    )
+
+
+def make_flights(count, seed=42, bbox=RUSSIA_BBOX, start_date="2024-01-01", days=365):
+    """
+    Генерирует count разобранных записей полетов (как после shr_pars/dep_arr_pars):
+    точки вылета равномерно в bbox, даты в пределах days дней от start_date.
+    """
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bbox
+    lons = rng.uniform(minx, maxx, count)
+    lats = rng.uniform(miny, maxy, count)
+    dofs = np.datetime64(start_date) + rng.integers(0, days, count)
+    takeoff_minutes = rng.integers(0, 24 * 60, count)
+    durations = rng.integers(5, 240, count)
+    operators = rng.integers(1, OPERATOR_COUNT + 1, count)
+    aircraft = rng.integers(1, AIRCRAFT_COUNT + 1, count)
+    types = rng.integers(0, len(AIRCRAFT_TYPES), count)
+
+    records = []
+    for i in range(count):
+        coords = format_compact_coords(lons[i], lats[i])
+        landing_minutes = (takeoff_minutes[i] + durations[i]) % (24 * 60)
+        records.append({
+            "flight_id": f"F{i:08d}",
+            "dof": str(dofs[i]),
+            "opr": f"Оператор {operators[i]}",
+            "reg": f"RA-{aircraft[i]:05d}",
+            "typ": AIRCRAFT_TYPES[types[i]],
+            "sid": str(7770000000 + i),
+            "takeoff_time": f"{takeoff_minutes[i] // 60:02d}:{takeoff_minutes[i] % 60:02d}",
+            "landing_time": f"{landing_minutes // 60:02d}:{landing_minutes % 60:02d}",
+            "takeoff_coords": coords,
+            "landing_coords": coords,
+            "flight_duration_minutes": int(durations[i]),
+            "takeoff_lon": float(lons[i]),
+            "takeoff_lat": float(lats[i]),
+        })
+    return records
+
+
+def format_compact_coords_seconds(lon, lat):
+    """Координаты с секундами: 554531N0382513E"""
+    lat_deg, rest = divmod(int(round(abs(lat) * 3600)), 3600)
+    lat_min, lat_sec = divmod(rest, 60)
+    lon_deg, rest = divmod(int(round(abs(lon) * 3600)), 3600)
+    lon_min, lon_sec = divmod(rest, 60)
+    return (
+        f"{lat_deg:02d}{lat_min:02d}{lat_sec:02d}{'N' if lat >= 0 else 'S'}"
+        f"{lon_deg:03d}{lon_min:02d}{lon_sec:02d}{'E' if lon >= 0 else 'W'}"
+    )
+
+
+def make_flight_messages(count, seed=42, invalid_share=0.05, missing_dep_share=0.1,
+                         missing_arr_share=0.15, bbox=RUSSIA_BBOX, start_date="2024-01-01", days=365):
+    """
+    Генерирует таблицу сообщений SHR/DEP/ARR, как в выгрузках планов полетов.
+    invalid_share - доля полетов с некорректными координатами в SHR (координаты
+    берутся из DEP или не определяются), missing_dep_share/missing_arr_share -
+    доли полетов без сообщений DEP/ARR.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    flights = make_flights(count, seed=seed, bbox=bbox, start_date=start_date, days=days)
+    invalid = rng.random(count) < invalid_share
+    has_dep = rng.random(count) >= missing_dep_share
+    has_arr = rng.random(count) >= missing_arr_share
+
+    shr_messages, dep_messages, arr_messages = [], [], []
+    for i, flight in enumerate(flights):
+        dof = flight["dof"].replace("-", "")[2:]
+        atd = flight["takeoff_time"].replace(":", "")
+        ata = flight["landing_time"].replace(":", "")
+        coords = flight["takeoff_coords"]
+        precise_coords = format_compact_coords_seconds(flight["takeoff_lon"], flight["takeoff_lat"])
+        # Некорректные координаты: обрезанная строка, как в реальных выгрузках
+        shr_coords = coords[:-2] + coords[-1] if invalid[i] else coords
+
+        shr_messages.append(
+            f"(SHR-ZZZZZ\n"
+            f"-ZZZZ{atd}\n"
+            f"-M0000/M0005 /ZONA R0,5 {shr_coords}/\n"
+            f"-ZZZZ{ata}\n"
+            f"-DEP/{shr_coords} DEST/{shr_coords} DOF/{dof} OPR/{flight['opr']} "
+            f"REG/{flight['reg']} TYP/{flight['typ']} RMK/СИНТЕТИЧЕСКИЙ ПОЛЕТ SID/{flight['sid']})"
+        )
+        dep_messages.append(
+            f"-TITLE IDEP\n-SID {flight['sid']}\n-ADD {dof}\n-ATD {atd}\n"
+            f"-ADEP ZZZZ\n-ADEPZ {precise_coords}\n-PAP 0"
+            if has_dep[i] else None
+        )
+        arr_messages.append(
+            f"-TITLE IARR\n-SID {flight['sid']}\n-ADA {dof}\n-ATA {ata}\n"
+            f"-ADARR ZZZZ\n-ADARRZ {precise_coords}\n-PAP 0"
+            if has_arr[i] else None
+        )
+
+    return pd.DataFrame({"SHR": shr_messages, "DEP": dep_messages, "ARR": arr_messages})
@@ -0,0 +1,220 @@
+# boundary_versions.py
+
+import logging
+from sqlalchemy import text
+from config import BOUNDARY_VERSIONS_KEEP
+
+logger = logging.getLogger(__name__)
+
+
+def table_exists(conn, table_name):
+    """Проверяет существование таблицы в текущей схеме"""
+    return conn.execute(text("SELECT to_regclass(:table_name) IS NOT NULL"), {"table_name": table_name}).scalar()
+
+
+def ensure_boundary_schema(conn):
+    """
+    Создает таблицы версий границ. Если russia_regions уже заполнена, а версий
+    еще нет (база до версионирования), текущие регионы становятся активной версией.
+    """
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS boundary_versions (
+            id SERIAL PRIMARY KEY,
+            content_hash TEXT,
+            region_count INTEGER,
+            changed_count INTEGER,
+            is_active BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            activated_at TIMESTAMP
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS boundary_version_regions (
+            version_id INTEGER NOT NULL REFERENCES boundary_versions(id) ON DELETE CASCADE,
+            region_id INTEGER NOT NULL,
+            region VARCHAR(200) NOT NULL,
+            area_sq_km NUMERIC(12, 2),
+            geometry GEOMETRY(Geometry, 4326),
+            PRIMARY KEY (version_id, region_id)
+        )
+    """))
+
+    has_versions = conn.execute(text("SELECT EXISTS (SELECT 1 FROM boundary_versions)")).scalar()
+    if not has_versions and table_exists(conn, "russia_regions"):
+        region_count = conn.execute(text("SELECT COUNT(*) FROM russia_regions")).scalar()
+        if region_count:
+            version_id = conn.execute(text("""
+                INSERT INTO boundary_versions (content_hash, region_count, changed_count, is_active, activated_at)
+                VALUES (NULL, :region_count, 0, TRUE, CURRENT_TIMESTAMP)
+                RETURNING id
+            """), {"region_count": region_count}).scalar()
+            conn.execute(text("""
+                INSERT INTO boundary_version_regions (version_id, region_id, region, area_sq_km, geometry)
+                SELECT :version_id, id, region, area_sq_km, geometry FROM russia_regions
+            """), {"version_id": version_id})
+            logger.info("✅ Существующие регионы сохранены как версия границ %s", version_id)
+
+
+def get_active_boundary_version(conn):
+    """Активная версия границ: (id, content_hash) или None"""
+    row = conn.execute(text("""
+        SELECT id, content_hash FROM boundary_versions WHERE is_active ORDER BY id DESC LIMIT 1
+    """)).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def switch_boundary_version(conn, content_hash):
+    """
+    Делает регионы из временной таблицы russia_regions_staging (ord, region, wkb)
+    новой активной версией границ. Выполняется в транзакции conn, поэтому
+    переключение атомарно.
+
+    id регионов сохраняются: сначала регионы сопоставляются по названию, затем
+    оставшиеся - по совпадающей геометрии (bbox ~= и ST_Equals). Полеты сбрасываются
+    только в регионах, геометрия которых изменилась или которые исчезли.
+
+    Возвращает словарь: version_id, region_ids (в порядке ord), changed, added, removed, reset_flights.
+    """
+    active = get_active_boundary_version(conn)
+    if active and content_hash and active[1] == content_hash:
+        region_count = conn.execute(text("SELECT COUNT(*) FROM russia_regions")).scalar()
+        logger.info("✅ Границы совпадают с активной версией %s, изменений нет", active[0])
+        return {"version_id": active[0], "region_ids": None, "changed": 0, "added": 0,
+                "removed": 0, "reset_flights": 0, "unchanged": True, "region_count": region_count}
+
+    # Геометрия разбирается и площадь считается один раз
+    conn.execute(text("""
+        CREATE TEMP TABLE boundary_staged ON COMMIT DROP AS
+        SELECT ord, region, lower(trim(region)) AS name_key, geom,
+               ROUND((ST_Area(geom::geography) / 1000000.0)::numeric, 2) AS area_sq_km,
+               NULL::integer AS region_id
+        FROM (
+            SELECT ord, region, ST_SetSRID(ST_GeomFromWKB(decode(wkb, 'hex')), 4326) AS geom
+            FROM russia_regions_staging
+        ) staged
+    """))
+
+    # 1. Сопоставление по названию (одинаковые названия - по порядку)
+    conn.execute(text("""
+        UPDATE boundary_staged s SET region_id = m.id
+        FROM (
+            SELECT id, lower(trim(region)) AS name_key,
+                   row_number() OVER (PARTITION BY lower(trim(region)) ORDER BY id) AS rn
+            FROM russia_regions
+        ) m,
+        (
+            SELECT ord, row_number() OVER (PARTITION BY name_key ORDER BY ord) AS rn
+            FROM boundary_staged
+        ) n
+        WHERE n.ord = s.ord AND m.name_key = s.name_key AND m.rn = n.rn
+    """))
+
+    # 2. Переименованные регионы - по совпадающей геометрии
+    conn.execute(text("""
+        UPDATE boundary_staged s SET region_id = m.id
+        FROM (
+            SELECT DISTINCT ON (s2.ord) s2.ord, r.id
+            FROM boundary_staged s2
+            JOIN russia_regions r ON r.geometry ~= s2.geom AND ST_Equals(r.geometry, s2.geom)
+            WHERE s2.region_id IS NULL
+              AND r.id NOT IN (SELECT region_id FROM boundary_staged WHERE region_id IS NOT NULL)
+            ORDER BY s2.ord, r.id
+        ) m
+        WHERE m.ord = s.ord
+    """))
+    conn.execute(text("""
+        UPDATE boundary_staged s SET region_id = NULL
+        FROM (
+            SELECT ord, row_number() OVER (PARTITION BY region_id ORDER BY ord) AS rn
+            FROM boundary_staged WHERE region_id IS NOT NULL
+        ) d
+        WHERE d.ord = s.ord AND d.rn > 1
+    """))
+
+    # 3. Изменившиеся и удаленные регионы
+    conn.execute(text("""
+        CREATE TEMP TABLE boundary_changes ON COMMIT DROP AS
+        SELECT s.region_id, 'changed' AS change
+        FROM boundary_staged s
+        JOIN russia_regions r ON r.id = s.region_id
+        WHERE NOT (r.geometry ~= s.geom AND ST_Equals(r.geometry, s.geom))
+        UNION ALL
+        SELECT r.id, 'removed'
+        FROM russia_regions r
+        WHERE r.id NOT IN (SELECT region_id FROM boundary_staged WHERE region_id IS NOT NULL)
+    """))
+
+    # 4. Новые регионы получают новые id
+    added = conn.execute(text("""
+        UPDATE boundary_staged
+        SET region_id = nextval(pg_get_serial_sequence('russia_regions', 'id'))
+        WHERE region_id IS NULL
+    """)).rowcount
+
+    # 5. Полеты и метрики затронутых регионов
+    reset_flights = 0
+    if table_exists(conn, "flights"):
+        reset_flights = conn.execute(text("""
+            UPDATE flights SET takeoff_region_id = NULL
+            WHERE takeoff_region_id IN (SELECT region_id FROM boundary_changes)
+        """)).rowcount
+    if table_exists(conn, "region_basic_metrics"):
+        conn.execute(text("""
+            DELETE FROM region_basic_metrics
+            WHERE region_id IN (SELECT region_id FROM boundary_changes WHERE change = 'removed')
+        """))
+
+    # 6. Применяем изменения к активной таблице регионов
+    removed = conn.execute(text("""
+        DELETE FROM russia_regions
+        WHERE id IN (SELECT region_id FROM boundary_changes WHERE change = 'removed')
+    """)).rowcount
+    conn.execute(text("""
+        UPDATE russia_regions r
+        SET region = s.region, area_sq_km = s.area_sq_km, geometry = s.geom
+        FROM boundary_staged s
+        WHERE r.id = s.region_id
+          AND (r.region IS DISTINCT FROM s.region
+               OR r.id IN (SELECT region_id FROM boundary_changes WHERE change = 'changed'))
+    """))
+    conn.execute(text("""
+        INSERT INTO russia_regions (id, region, area_sq_km, geometry)
+        SELECT region_id, region, area_sq_km, geom
+        FROM boundary_staged s
+        WHERE NOT EXISTS (SELECT 1 FROM russia_regions r WHERE r.id = s.region_id)
+        ORDER BY ord
+    """))
+    changed = conn.execute(text("SELECT COUNT(*) FROM boundary_changes WHERE change = 'changed'")).scalar()
+
+    # 7. Новая версия становится активной
+    region_count = conn.execute(text("SELECT COUNT(*) FROM boundary_staged")).scalar()
+    version_id = conn.execute(text("""
+        INSERT INTO boundary_versions (content_hash, region_count, changed_count)
+        VALUES (:content_hash, :region_count, :changed_count)
+        RETURNING id
+    """), {"content_hash": content_hash, "region_count": region_count, "changed_count": changed + added + removed}).scalar()
+    conn.execute(text("""
+        INSERT INTO boundary_version_regions (version_id, region_id, region, area_sq_km, geometry)
+        SELECT :version_id, region_id, region, area_sq_km, geom FROM boundary_staged
+    """), {"version_id": version_id})
+    conn.execute(text("""
+        UPDATE boundary_versions
+        SET is_active = (id = :version_id),
+            activated_at = CASE WHEN id = :version_id THEN CURRENT_TIMESTAMP ELSE activated_at END
+    """), {"version_id": version_id})
+
+    # Старые неактивные версии удаляются (вместе с геометрией)
+    conn.execute(text("""
+        DELETE FROM boundary_versions
+        WHERE NOT is_active
+          AND id NOT IN (SELECT id FROM boundary_versions ORDER BY id DESC LIMIT :keep)
+    """), {"keep": BOUNDARY_VERSIONS_KEEP})
+
+    region_ids = [row[0] for row in conn.execute(text("SELECT region_id FROM boundary_staged ORDER BY ord"))]
+
+    logger.info(
+        "✅ Активна версия границ %s: %s регионов, изменено %s, добавлено %s, удалено %s, сброшено полетов %s",
+        version_id, region_count, changed, added, removed, reset_flights
+    )
+    return {"version_id": version_id, "region_ids": region_ids, "changed": changed, "added": added,
+            "removed": removed, "reset_flights": reset_flights, "unchanged": False, "region_count": region_count}
@@ -10,15 +10,103 @@ DB_NAME = os.getenv("DB_NAME", "BPLA")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "1234")
 
-# Формируем URL подключения к БД
-DB_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Формируем URL подключения к БД. DB_URL=sqlite:///путь.sqlite включает встроенное
+# хранилище без PostgreSQL (полеты и метрики; векторные тайлы требуют PostGIS)
+DB_URL = os.getenv("DB_URL", f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+
+# Пул соединений движка (один на процесс, см. storage.get_storage)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Потоки для синхронных обращений к БД из обработчиков запросов. Не больше
+# соединений пула: иначе потоки простаивают в ожидании соединения
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
 
 # Настройки приложения
 UPLOADS_FOLDER = "uploads"
 CACHE_DIR = "cache"
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+# Загрузки пишутся на диск кусками этого размера (память на загрузку не зависит от размера файла)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Запас на заголовки multipart/form-data сверх MAX_FILE_SIZE при проверке Content-Length
+UPLOAD_FORM_OVERHEAD = 64 * 1024
 
 # Настройки обработки
 RECORDS_TO_PROCESS = 10000
 SIMPLIFY_TOLERANCE = 500
-AREA_THRESHOLD = 100e6
\ No newline at end of file
+AREA_THRESHOLD = 100e6
+
+# Пирамида детализации карты: уровень -> допуск упрощения (м, EPSG:32646)
+MAP_LEVELS = {
+    "coarse": 5000,
+    "medium": 2000,
+    "fine": SIMPLIFY_TOLERANCE,
+}
+# Минимальный коэффициент увеличения карты, с которого используется уровень
+MAP_LEVEL_MIN_ZOOM = {
+    "coarse": 1,
+    "medium": 3,
+    "fine": 8,
+}
+DEFAULT_MAP_LEVEL = "fine"
+
+# Настройки векторных тайлов (/tiles/{z}/{x}/{y}.mvt)
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_MAX_ZOOM = 14
+
+# Кэш карт: бюджет на диске (старые версии границ вытесняются по LRU)
+MAP_CACHE_MAX_SIZE = 500 * 1024 * 1024  # 500MB
+# Версия алгоритма построения карты, входит в ключ кэша
+MAP_CACHE_VERSION = 2
+# Сколько разобранных файлов карт держать в памяти процесса (уровни активной карты)
+MAP_PAYLOAD_CACHE_SIZE = 2 * len(MAP_LEVELS)
+
+# Объединение границ соседних регионов (м, EPSG:32646)
+SNAP_DISTANCE = 100
+SNAP_TOLERANCE = 800
+# Параллельная обработка геометрии: число процессов и минимальное число регионов
+GEOMETRY_WORKERS = 1
+PARALLEL_MIN_FEATURES = 500
+
+# Число записей DBF, по которым определяется кодировка shapefile
+DBF_SAMPLE_RECORDS = 50
+
+# Время жизни сессии поэлементной загрузки shapefile (секунды)
+SHAPEFILE_SESSION_TTL = 60 * 60
+
+# Сколько версий границ хранить (вместе с активной)
+BOUNDARY_VERSIONS_KEEP = 5
+# Размер пакета при определении регионов вылета
+REGION_ASSIGN_BATCH_SIZE = 10000
+
+# Размер пакета при заполнении новых столбцов в миграциях схемы
+MIGRATION_BATCH_SIZE = 50000
+
+# Гистограммы /internal/metrics: границы корзин времени запросов и SQL (секунды)
+REQUEST_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+# Границы корзин числа SQL-запросов на один HTTP-запрос (видны N+1)
+REQUEST_QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Длина текста SQL в метке statement
+QUERY_LABEL_MAX_LENGTH = 160
+# Число разных меток statement, остальные запросы учитываются в серии "other"
+QUERY_LABEL_MAX_SERIES = int(os.getenv("QUERY_LABEL_MAX_SERIES", "200"))
+
+# Профилирование запросов по заголовку X-Profile: 1 или ?profile=1
+PROFILE_SAMPLE_INTERVAL = 0.005  # интервал семплирования стеков (секунды)
+PROFILES_KEEP = 50  # сколько последних профилей хранить в cache/profiles
+
+# Логирование (настраивается один раз при запуске сервера, см. logging_config.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text или json
+LOG_FILE = os.getenv("LOG_FILE")  # дополнительно писать лог в файл
+# Прогресс длинных циклов выводится не чаще одного раза за интервал (секунды)
+LOG_PROGRESS_INTERVAL = 5.0
+# Повторяющиеся предупреждения (например, о некорректных координатах): первые
+# LOG_SAMPLE_FIRST выводятся, дальше - каждое LOG_SAMPLE_EVERY с числом пропущенных
+LOG_SAMPLE_FIRST = 5
+LOG_SAMPLE_EVERY = 1000
+
+# Прогрев при запуске сервера: индекс регионов, карта и метрики загружаются в фоне,
+# /ready отвечает 200 только после прогрева
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
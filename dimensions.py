@@ -0,0 +1,119 @@
+# dimensions.py
+
+import logging
+from sqlalchemy import bindparam, text
+from storage import get_storage
+from config import DB_URL
+
+logger = logging.getLogger(__name__)
+
+# Справочники полетов: измерение -> (таблица, столбец значения)
+DIMENSION_TABLES = {
+    "operator": ("operators", "name"),
+    "aircraft": ("aircraft", "reg"),
+    "aircraft_type": ("aircraft_types", "code"),
+    "source_file": ("source_files", "name"),
+}
+
+
+class DimensionCache:
+    """
+    Словари справочников (значение -> id) в памяти на время загрузки.
+    Справочники читаются один раз, новые значения добавляются одним запросом на измерение.
+    """
+
+    def __init__(self, conn):
+        self.ids = {}
+        for dimension, (table, key) in DIMENSION_TABLES.items():
+            result = conn.execute(text(f"SELECT {key}, id FROM {table}"))
+            self.ids[dimension] = {row[0]: row[1] for row in result}
+
+    def assign(self, conn, dimension, values, attributes=None):
+        """
+        Возвращает словарь значение -> id, добавляя в справочник отсутствующие значения.
+        attributes - дополнительные столбцы новых значений: {значение: {столбец: значение}}.
+        """
+        table, key = DIMENSION_TABLES[dimension]
+        cache = self.ids[dimension]
+        missing = sorted({value for value in values if value is not None} - cache.keys())
+        if not missing:
+            return cache
+
+        columns = sorted({column for value in missing for column in (attributes or {}).get(value, {})})
+        conn.execute(
+            text(f"""
+                INSERT INTO {table} ({", ".join([key] + columns)})
+                VALUES ({", ".join(f":{column}" for column in [key] + columns)})
+                ON CONFLICT ({key}) DO NOTHING
+            """),
+            [{key: value, **{column: (attributes or {}).get(value, {}).get(column) for column in columns}} for value in missing]
+        )
+
+        result = conn.execute(
+            text(f"SELECT {key}, id FROM {table} WHERE {key} IN :values").bindparams(bindparam("values", expanding=True)),
+            {"values": missing}
+        )
+        cache.update({row[0]: row[1] for row in result})
+        logger.info("✅ Справочник %s: добавлено %s значений", table, len(missing))
+        return cache
+
+
+def get_region_breakdown(region_id, db_url=DB_URL, limit=10):
+    """Распределение полетов региона по операторам и типам воздушных судов"""
+    engine = get_storage(db_url).engine
+
+    with engine.connect() as conn:
+        region = conn.execute(
+            text("SELECT region FROM russia_regions WHERE id = :region_id"),
+            {"region_id": region_id}
+        ).scalar()
+        if region is None:
+            return None
+
+        total_flights = conn.execute(
+            text("SELECT COUNT(*) FROM flights WHERE takeoff_region_id = :region_id"),
+            {"region_id": region_id}
+        ).scalar() or 0
+
+        # Группировка идет по целочисленным ключам, названия подставляются для топа
+        operators = conn.execute(text("""
+            SELECT o.name, c.flight_count
+            FROM (
+                SELECT operator_id, COUNT(*) AS flight_count
+                FROM flights
+                WHERE takeoff_region_id = :region_id
+                GROUP BY operator_id
+                ORDER BY flight_count DESC
+                LIMIT :limit
+            ) c
+            LEFT JOIN operators o ON o.id = c.operator_id
+            ORDER BY c.flight_count DESC
+        """), {"region_id": region_id, "limit": limit}).fetchall()
+
+        aircraft_types = conn.execute(text("""
+            SELECT t.code, t.description, c.flight_count
+            FROM (
+                SELECT type_id, COUNT(*) AS flight_count
+                FROM flights
+                WHERE takeoff_region_id = :region_id
+                GROUP BY type_id
+                ORDER BY flight_count DESC
+                LIMIT :limit
+            ) c
+            LEFT JOIN aircraft_types t ON t.id = c.type_id
+            ORDER BY c.flight_count DESC
+        """), {"region_id": region_id, "limit": limit}).fetchall()
+
+    return {
+        "region_id": region_id,
+        "region_name": region,
+        "total_flights": int(total_flights),
+        "operators": [
+            {"operator": row[0], "flight_count": int(row[1])}
+            for row in operators
+        ],
+        "aircraft_types": [
+            {"type": row[0], "description": row[1], "flight_count": int(row[2])}
+            for row in aircraft_types
+        ]
+    }
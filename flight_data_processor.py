@@ -6,47 +6,30 @@ import time
 import json
 import logging
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import sys
 import os
-import glob
 import geopandas as gpd
-from shapely.geometry import Point
+from region_index import get_region_index
 from metrics_calculator import calculate_metrics
+from tile_builder import invalidate_tile_cache
+from dimensions import DimensionCache
+from storage import get_storage
+from instrumentation import IngestRun
+from logging_config import ProgressLogger
 
-from config import DB_URL, UPLOADS_FOLDER
+from config import DB_URL, REGION_ASSIGN_BATCH_SIZE
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
-# === 🗃 СТРУКТУРА ТАБЛИЦЫ ===
-DESIRED_COLUMNS = {
-    "id": "SERIAL PRIMARY KEY",
-    "flight_id": "TEXT",
-    "dof": "DATE",
-    "opr": "TEXT",
-    "reg": "TEXT",
-    "typ": "TEXT",
-    "typ_desc": "TEXT",
-    "sid": "TEXT",
-    "source_file": "TEXT",
-    "takeoff_time": "TEXT",
-    "landing_time": "TEXT",
-    "takeoff_coords": "TEXT",
-    "landing_coords": "TEXT",
-    "takeoff_region_id": "INTEGER",
-    "flight_duration_minutes": "INTEGER",
-    "created_at": "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
-}
-
+# === 🗃 СТРУКТУРА ТАБЛИЦЫ (см. migrations.py) ===
 TABLE_NAME = "flights"
 REGIONS_TABLE = "russia_regions"
 
+# Размер пакета при записи полетов в БД
+INSERT_BATCH_SIZE = 5000
+
 # === 📚 РАСШИФРОВКА ТИПОВ ===
 TYP_DESCRIPTIONS = {
     "BLA": "беспилотный летательный аппарат",
@@ -54,35 +37,6 @@ TYP_DESCRIPTIONS = {
     "SHAR": "шар-зонд (привязной аэростат, параплан и т.д.)"
 }
 
-def find_geojson_file():
-    """Находит GeoJSON файл в папке uploads"""
-    try:
-        # Создаем папку uploads если её нет
-        os.makedirs(UPLOADS_FOLDER, exist_ok=True)
-        
-        # Путь к стандартному файлу
-        default_geojson = os.path.join(UPLOADS_FOLDER, "russia_regions.geojson")
-        
-        if os.path.exists(default_geojson):
-            logger.info(f"✅ Найден GeoJSON файл: {default_geojson}")
-            return default_geojson
-        
-        # Если стандартного файла нет, ищем любой .geojson файл
-        geojson_files = glob.glob(os.path.join(UPLOADS_FOLDER, "*.geojson"))
-        
-        if geojson_files:
-            # Берем первый найденный файл
-            geojson_file = geojson_files[0]
-            logger.info(f"✅ Найден GeoJSON файл: {geojson_file}")
-            return geojson_file
-        else:
-            logger.error(f"❌ В папке {UPLOADS_FOLDER} не найдено GeoJSON файлов")
-            return None
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка поиска GeoJSON файла: {e}")
-        return None
-
 # === 🔧 ФУНКЦИИ ПАРСИНГА ===
 
 def is_valid_coords(coord_str):
@@ -245,35 +199,24 @@ def dep_arr_pars(message):
 # === 🗄 ФУНКЦИИ РАБОТЫ С БД ===
 
 class RegionFinder:
-    """Класс для поиска регионов по координатам используя GeoJSON"""
+    """Класс для поиска регионов по координатам по индексу активной версии границ"""
     
-    def __init__(self):
-        self.geojson_file = find_geojson_file()
-        self.gdf = None
-        self.regions_map = {}
+    def __init__(self, db_url=DB_URL):
+        self.storage = get_storage(db_url)
+        self.index = None
         
     def load_regions(self):
-        """Загружает регионы из GeoJSON файла"""
-        if not self.geojson_file:
-            logger.error("❌ GeoJSON файл не найден")
-            return False
-        
+        """Загружает индекс регионов (из базы он строится только при смене версии границ)"""
         try:
-            self.gdf = gpd.read_file(self.geojson_file)
-            logger.info(f"✅ Загружено {len(self.gdf)} регионов из GeoJSON: {os.path.basename(self.geojson_file)}")
-            
-            # Создаем кэш для быстрого поиска
-            for idx, row in self.gdf.iterrows():
-                region_id = idx + 1
-                self.regions_map[region_id] = {
-                    'name': row['region'],
-                    'geometry': row['geometry']
-                }
-            
+            self.index = get_region_index(self.storage)
+            if self.index is None:
+                logger.error("❌ Регионы не загружены в базу")
+                return False
+            logger.info("✅ Загружено %s регионов из индекса версии %s", len(self.index), self.index.version)
             return True
             
         except Exception as e:
-            logger.error(f"❌ Ошибка загрузки GeoJSON: {e}")
+            logger.error("❌ Ошибка загрузки регионов: %s", e)
             return False
     
     def parse_compact_coords_to_decimal(self, coords_str):
@@ -311,7 +254,10 @@ class RegionFinder:
                 lon_dir = coords_str[14]
                 
             else:
-                logger.warning(f"⚠️ Неподдерживаемый формат координат: {coords_str} (длина: {len(coords_str)})")
+                logger.warning(
+                    "⚠️ Неподдерживаемый формат координат: %s (длина: %d)", coords_str, len(coords_str),
+                    extra={"sampled": True}
+                )
                 return None, None
 
             # Конвертация в десятичные градусы
@@ -326,11 +272,11 @@ class RegionFinder:
             return lon, lat  # (lon, lat) для GeoPandas
             
         except Exception as e:
-            logger.error(f"❌ Ошибка парсинга координат '{coords_str}': {e}")
+            logger.error("❌ Ошибка парсинга координат '%s': %s", coords_str, e, extra={"sampled": True})
             return None, None
     
     def find_region_by_coords(self, coords_str):
-        """Находит регион по компактным координатам используя GeoJSON"""
+        """Находит регион по компактным координатам"""
         if not coords_str:
             return None
         
@@ -339,61 +285,27 @@ class RegionFinder:
         if lon is None or lat is None:
             return None
         
-        # Создаем точку
-        point = Point(lon, lat)
-        
-        # Ищем регион, содержащий точку
-        for region_id, region_data in self.regions_map.items():
-            try:
-                if region_data['geometry'].contains(point):
-                    logger.debug(f"✅ Найден регион {region_id} для координат {coords_str}")
-                    return region_id
-            except Exception as e:
-                logger.warning(f"⚠️ Ошибка проверки региона {region_data['name']}: {e}")
-                continue
-        
-        logger.debug(f"❌ Регион не найден для координат {coords_str}")
-        return None
-
-def recreate_table_if_schema_changed(engine):
-    """Пересоздает таблицу если схема изменилась"""
-    with engine.connect() as conn:
-        result = conn.execute(text("""
-            SELECT column_name, data_type 
-            FROM information_schema.columns 
-            WHERE table_schema = 'public' AND table_name = :table_name
-            ORDER BY ordinal_position;
-        """), {"table_name": TABLE_NAME})
-        current_columns = {row[0]: row[1] for row in result}
-
-        schema_changed = False
-        for col, dtype in DESIRED_COLUMNS.items():
-            base_type = dtype.split()[0].upper()
-            if col not in current_columns or current_columns[col].upper() != base_type:
-                schema_changed = True
-                break
-
-        if schema_changed:
-            logger.info("🔄 Схема изменилась — пересоздаём таблицу...")
-            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE_NAME};"))
-            
-            columns_def = ",\n    ".join([f"{col} {dtype}" for col, dtype in DESIRED_COLUMNS.items()])
-            create_sql = f"""
-                CREATE TABLE {TABLE_NAME} (
-                    {columns_def}
-                );
-            """
-            conn.execute(text(create_sql))
-            
-            conn.execute(text(f"""
-                CREATE INDEX idx_flights_region_id 
-                ON {TABLE_NAME} (takeoff_region_id);
-            """))
-            
-            conn.commit()
-            logger.info(f"✅ Таблица '{TABLE_NAME}' пересоздана.")
+        region_id = self.index.find(lon, lat)
+        if region_id is not None:
+            logger.debug("✅ Найден регион %s для координат %s", region_id, coords_str)
         else:
-            logger.info(f"✅ Таблица '{TABLE_NAME}' актуальна.")
+            logger.debug("❌ Регион не найден для координат %s", coords_str)
+        return region_id
+
+    def find_regions_by_coords(self, coords_list):
+        """Находит регионы для списка компактных координат одним запросом к индексу"""
+        lons, lats, positions = [], [], []
+        for i, coords_str in enumerate(coords_list):
+            lon, lat = self.parse_compact_coords_to_decimal(coords_str) if coords_str else (None, None)
+            if lon is not None and lat is not None:
+                lons.append(lon)
+                lats.append(lat)
+                positions.append(i)
+
+        result = [None] * len(coords_list)
+        for position, region_id in zip(positions, self.index.find_many(lons, lats)):
+            result[position] = region_id
+        return result
 
 def parse_dof(dof_str):
     """Парсит дату из формата YYMMDD"""
@@ -441,73 +353,75 @@ def calculate_flight_duration(takeoff_time, landing_time, dof):
         return None
 
 def update_takeoff_regions_geojson(engine, region_finder):
-    """Обновляет регионы вылета используя GeoJSON"""
-    logger.info("🌍 Определение регионов вылета по координатам (GeoJSON)...")
+    """
+    Определяет регионы вылета для полетов без региона. Полеты перебираются
+    пачками по id (без OFFSET), каждая пачка фиксируется отдельно.
+    Возвращает число полетов, получивших регион.
+    """
+    logger.info("🌍 Определение регионов вылета по координатам...")
     
     # Загружаем регионы
     if not region_finder.load_regions():
         logger.error("❌ Не удалось загрузить регионы, пропускаем определение")
-        return
+        return 0
     
-    with engine.connect() as conn:
-        # Получаем записи без определенного региона
-        result = conn.execute(text(f"""
-            SELECT id, takeoff_coords 
-            FROM {TABLE_NAME} 
-            WHERE takeoff_coords IS NOT NULL 
-              AND takeoff_region_id IS NULL
-            LIMIT 10000
-        """))
-        records = result.fetchall()
-
-        if not records:
-            logger.info("✅ Все регионы уже определены или нет координат для обработки.")
-            return
-
-        logger.info(f"🔍 Найдено {len(records)} записей с координатами для обработки...")
-        
-        updated = 0
-        errors = 0
-        no_region_found = 0
-        
-        for row in records:
-            flight_id, coords_str = row
-            if not coords_str:
-                continue
-
-            try:
-                # Ищем регион используя GeoJSON
-                region_id = region_finder.find_region_by_coords(coords_str)
-                
-                if region_id is not None:
-                    # Обновляем запись в базе данных
+    last_id = 0
+    processed = 0
+    updated = 0
+    errors = 0
+    while True:
+        with engine.connect() as conn:
+            records = conn.execute(text(f"""
+                SELECT id, takeoff_coords 
+                FROM {TABLE_NAME} 
+                WHERE takeoff_coords IS NOT NULL 
+                  AND takeoff_region_id IS NULL
+                  AND id > :last_id
+                ORDER BY id
+                LIMIT :batch_size
+            """), {"last_id": last_id, "batch_size": REGION_ASSIGN_BATCH_SIZE}).fetchall()
+
+            if not records:
+                break
+            last_id = records[-1][0]
+            processed += len(records)
+
+            # Регионы для всей пачки ищутся одним запросом к индексу
+            region_ids = region_finder.find_regions_by_coords([row[1] for row in records])
+            updates = [
+                {"region_id": region_id, "id": row[0]}
+                for row, region_id in zip(records, region_ids)
+                if region_id is not None
+            ]
+
+            if updates:
+                try:
                     conn.execute(
                         text(f"""
                             UPDATE {TABLE_NAME} 
                             SET takeoff_region_id = :region_id
                             WHERE id = :id
                         """),
-                        {
-                            "region_id": region_id,
-                            "id": flight_id
-                        }
+                        updates
                     )
-                    updated += 1
-                else:
-                    no_region_found += 1
-                
-                if (updated + no_region_found) % 100 == 0:
-                    logger.info(f"📊 Обработано {updated + no_region_found} записей...")
-                    
-            except Exception as e:
-                logger.warning(f"⚠️ Ошибка при обработке записи {flight_id}: {e}")
-                errors += 1
+                    conn.commit()
+                    updated += len(updates)
+                except Exception as e:
+                    logger.warning("⚠️ Ошибка при обновлении регионов вылета: %s", e)
+                    conn.rollback()
+                    errors += len(updates)
 
-        conn.commit()
-        logger.info(f"✅ Обновлено {updated} записей с регионами вылета.")
-        logger.info(f"❌ Не найдено регионов для {no_region_found} записей.")
-        if errors > 0:
-            logger.warning(f"⚠️ Ошибок при обработке: {errors}")
+        logger.info("🔄 Обработано %s записей, обновлено %s", processed, updated)
+
+    if processed == 0:
+        logger.info("✅ Все регионы уже определены или нет координат для обработки.")
+        return 0
+
+    logger.info("✅ Обновлено %s записей с регионами вылета.", updated)
+    logger.info("❌ Не найдено регионов для %s записей.", processed - updated - errors)
+    if errors > 0:
+        logger.warning("⚠️ Ошибок при обработке: %s", errors)
+    return updated
 
 def get_region_statistics(engine):
     """Выводит статистику по регионам"""
@@ -518,17 +432,17 @@ def get_region_statistics(engine):
             # Общее количество записей
             result = conn.execute(text(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE takeoff_coords IS NOT NULL"))
             total_with_coords = result.scalar()
-            logger.info(f"📈 Всего записей с координатами: {total_with_coords}")
+            logger.info("📈 Всего записей с координатами: %s", total_with_coords)
             
             # Количество записей с определенными регионами
             result = conn.execute(text(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE takeoff_region_id IS NOT NULL"))
             total_with_regions = result.scalar()
-            logger.info(f"📈 Записей с определенными регионами: {total_with_regions}")
+            logger.info("📈 Записей с определенными регионами: %s", total_with_regions)
 
             # Количество записей без регионов
             result = conn.execute(text(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE takeoff_coords IS NOT NULL AND takeoff_region_id IS NULL"))
             total_without_regions = result.scalar()
-            logger.info(f"📈 Записей без определенных регионов: {total_without_regions}")
+            logger.info("📈 Записей без определенных регионов: %s", total_without_regions)
 
             # Количество полетов по регионам
             result = conn.execute(text(f"""
@@ -550,7 +464,7 @@ def get_region_statistics(engine):
                 region_name = row[0] if row[0] else "Не определен"
                 count = row[1] if row[1] else 0
                 region_display = region_name[:30] + "..." if len(region_name) > 30 else region_name
-                logger.info(f"│ {region_display:<30} │ {count:>12} │")
+                logger.info("│ %-30s │ %12s │", region_display, count)
                 has_data = True
             
             if not has_data:
@@ -559,190 +473,257 @@ def get_region_statistics(engine):
             logger.info("└────────────────────────────────┴──────────────┘")
             
     except Exception as e:
-        logger.error(f"❌ Ошибка получения статистики: {e}")
+        logger.error("❌ Ошибка получения статистики: %s", e)
+
+def write_flight_records(storage, records, original_filename):
+    """
+    Записывает разобранные полеты в хранилище пакетами.
+    Возвращает число записанных полетов.
+    """
+    inserted = 0
+    with storage.engine.connect() as conn:
+        # Операторы, борта и типы заменяются id справочников одним запросом на справочник
+        dimensions = DimensionCache(conn)
+        operator_ids = dimensions.assign(conn, "operator", [record["opr"] for record in records])
+        aircraft_ids = dimensions.assign(conn, "aircraft", [record["reg"] for record in records])
+        type_codes = {record["typ"] for record in records if record["typ"]}
+        type_ids = dimensions.assign(conn, "aircraft_type", type_codes, attributes={
+            code: {"description": TYP_DESCRIPTIONS.get(code, code)} for code in type_codes
+        })
+        source_file_id = dimensions.assign(conn, "source_file", [original_filename])[original_filename]
+        for record in records:
+            record["operator_id"] = operator_ids.get(record.pop("opr"))
+            record["aircraft_id"] = aircraft_ids.get(record.pop("reg"))
+            record["type_id"] = type_ids.get(record.pop("typ"))
+            record["source_file_id"] = source_file_id
+
+        # Месячные партиции создаются до вставки, чтобы записи не попадали в партицию по умолчанию
+        storage.prepare_flight_months(conn, [record["dof"] for record in records])
+
+        insert_sql = text(f"""
+            INSERT INTO {TABLE_NAME} (
+                flight_id, dof, operator_id, aircraft_id, type_id, sid, source_file_id,
+                takeoff_time, landing_time, takeoff_coords, landing_coords,
+                takeoff_region_id, flight_duration_minutes, takeoff_lon, takeoff_lat
+            ) VALUES (
+                :flight_id, :dof, :operator_id, :aircraft_id, :type_id, :sid, :source_file_id,
+                :takeoff_time, :landing_time, :takeoff_coords, :landing_coords,
+                NULL, :flight_duration_minutes, :takeoff_lon, :takeoff_lat
+            )
+        """)
+        for start in range(0, len(records), INSERT_BATCH_SIZE):
+            batch = records[start:start + INSERT_BATCH_SIZE]
+            try:
+                # Ошибка в пакете откатывает только его
+                with conn.begin_nested():
+                    conn.execute(insert_sql, batch)
+                inserted += len(batch)
+            except Exception as e:
+                logger.warning("⚠️ Ошибка при вставке записей %s-%s: %s", start, start + len(batch), e)
+                continue
 
-def process_flight_data_excel(file_path, original_filename):
-    """Основная функция обработки данных о полетах из Excel файла"""
+        conn.commit()
+    return inserted
+
+def parse_flight_records(df, parse_coords):
+    """
+    Разбирает строки Excel (столбцы SHR/DEP/ARR) в записи полетов для write_flight_records.
+    parse_coords - разбор компактных координат в (lon, lat). Возвращает (записи, статистика).
+    """
+    # === НАСТРОЙКА ПАРСЕРОВ ===
+    column_parsers = {}
+    for col in df.columns:
+        col_lower = col.strip().lower()
+        if col_lower == "shr":
+            column_parsers[col] = shr_pars
+        elif col_lower in ("dep", "arr"):
+            column_parsers[col] = dep_arr_pars
+        else:
+            logger.info("⚠️  Столбец '%s' не распознан, будет пропущен.", col)
+
+    # === ОБРАБОТКА ДАННЫХ ===
+    stats = {
+        "total_processed": 0,
+        "valid_dep_coords": 0,
+        "valid_dest_coords": 0,
+        "corrected_coords": 0
+    }
+
+    progress = ProgressLogger(logger, "Разбор записей", total=len(df))
+    records = []
+    for idx, row in df.iterrows():
+        stats["total_processed"] += 1
+        progress.update()
+
+        # === ПАРСИНГ ДАННЫХ ===
+        parsed_data = {}
+        for col_name, parser_func in column_parsers.items():
+            value = row[col_name]
+            parsed = parser_func(value)
+            parsed_data[col_name] = parsed
+
+        # === ОБРАБОТКА КООРДИНАТ С ПРИОРИТЕТОМ ===
+        shr_data = parsed_data.get('SHR', {})
+        dep_data = parsed_data.get('DEP', {})
+        arr_data = parsed_data.get('ARR', {})
+        
+        # КООРДИНАТЫ ВЫЛЕТА
+        dep_coords = get_best_coords(
+            dep_data.get('ADEPZ'),
+            shr_data.get('DEP'),
+            shr_data.get('service_line_coords')
+        )
+        
+        # КООРДИНАТЫ ПОСАДКИ
+        dest_coords = get_best_coords(
+            arr_data.get('ADARRZ'),
+            shr_data.get('DEST')
+        )
+        
+        # Статистика
+        if dep_coords:
+            stats["valid_dep_coords"] += 1
+        if dest_coords:
+            stats["valid_dest_coords"] += 1
+        if (dep_coords and not shr_data.get('DEP')) or (dest_coords and not shr_data.get('DEST')):
+            stats["corrected_coords"] += 1
+
+        # === ПОДГОТОВКА ДАННЫХ ДЛЯ БД ===
+        flight_id = shr_data.get("flight_id") or None
+        sid = shr_data.get("SID") or None
+        
+        if not (flight_id or sid):
+            progress.count("без идентификатора")
+            continue  # Пропускаем записи без идентификаторов
+
+        dof = parse_dof(shr_data.get("DOF"))
+
+        # Время вылета
+        takeoff_time = None
+        if dep_data and dep_data.get("ATD"):
+            takeoff_time = extract_time_from_code(dep_data["ATD"])
+        if not takeoff_time and shr_data.get("start"):
+            takeoff_time = extract_time_from_code(shr_data["start"])
+
+        # Время посадки
+        landing_time = None
+        if arr_data and arr_data.get("ATA"):
+            landing_time = extract_time_from_code(arr_data["ATA"])
+        if not landing_time and shr_data.get("end"):
+            landing_time = extract_time_from_code(shr_data["end"])
+
+        duration = calculate_flight_duration(takeoff_time, landing_time, dof)
+        takeoff_lon, takeoff_lat = parse_coords(dep_coords)
+
+        records.append({
+            "flight_id": flight_id,
+            "dof": dof,
+            "opr": shr_data.get("OPR") or None,
+            "reg": shr_data.get("REG") or None,
+            "typ": shr_data.get("TYP") or None,
+            "sid": sid,
+            "takeoff_time": takeoff_time,
+            "landing_time": landing_time,
+            "takeoff_coords": dep_coords,  # Важно: сохраняем как takeoff_coords
+            "landing_coords": dest_coords, # Важно: сохраняем как landing_coords
+            "flight_duration_minutes": duration,
+            "takeoff_lon": takeoff_lon,
+            "takeoff_lat": takeoff_lat
+        })
+
+    progress.done()
+    return records, stats
+
+def process_flight_data_excel(file_path, original_filename, db_url=DB_URL):
+    """
+    Основная функция обработки данных о полетах из Excel файла.
+    Время, строки и обращения к БД по этапам сохраняются в ingest_runs.
+    """
+    with IngestRun(original_filename) as run:
+        result = run_flight_data_ingest(run, file_path, original_filename, db_url)
+        if not result["success"]:
+            run.fail(result["error"])
+
+    run.log_summary()
+    result["ingest_run"] = {"id": run.save(db_url), **run.to_dict()}
+    return result
+
+def run_flight_data_ingest(run, file_path, original_filename, db_url=DB_URL):
+    """Этапы загрузки файла полетов с замерами в run (IngestRun)"""
     start_time = time.time()
     
     try:
         # === ПОДКЛЮЧЕНИЕ К БД ===
         try:
-            engine = create_engine(DB_URL)
+            storage = get_storage(db_url)
+            engine = storage.engine
             with engine.connect() as conn:
                 conn.execute(text("SELECT 1"))
             logger.info("✅ Подключение к БД успешно.")
         except Exception as e:
-            logger.error(f"❌ Ошибка подключения: {e}")
+            logger.error("❌ Ошибка подключения: %s", e)
             return {"success": False, "error": f"Ошибка подключения к БД: {e}"}
 
         # === ПОДГОТОВКА ТАБЛИЦЫ ===
-        recreate_table_if_schema_changed(engine)
+        with run.stage("schema"):
+            storage.ensure_flights_schema()
 
         # === ЧТЕНИЕ EXCEL ФАЙЛА ===
         try:
-            df = pd.read_excel(file_path)
-            logger.info(f"✅ Файл Excel загружен: {len(df)} записей")
+            with run.stage("read_excel") as stage:
+                df = pd.read_excel(file_path)
+                stage["rows"] = run.rows_total = len(df)
+            logger.info("✅ Файл Excel загружен: %s записей", len(df))
         except Exception as e:
-            logger.error(f"❌ Ошибка загрузки Excel файла: {e}")
+            logger.error("❌ Ошибка загрузки Excel файла: %s", e)
             return {"success": False, "error": f"Ошибка загрузки Excel файла: {e}"}
 
-        # === НАСТРОЙКА ПАРСЕРОВ ===
-        column_parsers = {}
-        for col in df.columns:
-            col_lower = col.strip().lower()
-            if col_lower == "shr":
-                column_parsers[col] = shr_pars
-            elif col_lower in ("dep", "arr"):
-                column_parsers[col] = dep_arr_pars
-            else:
-                logger.info(f"⚠️  Столбец '{col}' не распознан, будет пропущен.")
-
-        # === ОБРАБОТКА ДАННЫХ И ЗАПИСЬ В БД ===
-        inserted_records = 0
-        stats = {
-            "total_processed": 0,
-            "valid_dep_coords": 0,
-            "valid_dest_coords": 0,
-            "corrected_coords": 0
-        }
-
-        logger.info(f"\n🔄 Начинаем обработку {len(df)} записей...")
+        # === ОБРАБОТКА ДАННЫХ ===
+        region_finder = RegionFinder(db_url)
+        with run.stage("parse") as stage:
+            records, stats = parse_flight_records(df, region_finder.parse_compact_coords_to_decimal)
+            stage["rows"] = stats["total_processed"]
 
-        with engine.connect() as conn:
-            for idx, row in df.iterrows():
-
-
-                stats["total_processed"] += 1
-                
-                if stats["total_processed"] % 1000 == 0:
-                    logger.info(f"📊 Обработано {stats['total_processed']} записей...")
-
-                # === ПАРСИНГ ДАННЫХ ===
-                parsed_data = {}
-                for col_name, parser_func in column_parsers.items():
-                    value = row[col_name]
-                    parsed = parser_func(value)
-                    parsed_data[col_name] = parsed
-
-                # === ОБРАБОТКА КООРДИНАТ С ПРИОРИТЕТОМ ===
-                shr_data = parsed_data.get('SHR', {})
-                dep_data = parsed_data.get('DEP', {})
-                arr_data = parsed_data.get('ARR', {})
-                
-                # КООРДИНАТЫ ВЫЛЕТА
-                dep_coords = get_best_coords(
-                    dep_data.get('ADEPZ'),
-                    shr_data.get('DEP'),
-                    shr_data.get('service_line_coords')
-                )
-                
-                # КООРДИНАТЫ ПОСАДКИ
-                dest_coords = get_best_coords(
-                    arr_data.get('ADARRZ'),
-                    shr_data.get('DEST')
-                )
-                
-                # Статистика
-                if dep_coords:
-                    stats["valid_dep_coords"] += 1
-                if dest_coords:
-                    stats["valid_dest_coords"] += 1
-                if (dep_coords and not shr_data.get('DEP')) or (dest_coords and not shr_data.get('DEST')):
-                    stats["corrected_coords"] += 1
-
-                # === ПОДГОТОВКА ДАННЫХ ДЛЯ БД ===
-                flight_id = shr_data.get("flight_id") or None
-                sid = shr_data.get("SID") or None
-                
-                if not (flight_id or sid):
-                    continue  # Пропускаем записи без идентификаторов
-
-                dof = parse_dof(shr_data.get("DOF"))
-
-                # Время вылета
-                takeoff_time = None
-                if dep_data and dep_data.get("ATD"):
-                    takeoff_time = extract_time_from_code(dep_data["ATD"])
-                if not takeoff_time and shr_data.get("start"):
-                    takeoff_time = extract_time_from_code(shr_data["start"])
-
-                # Время посадки
-                landing_time = None
-                if arr_data and arr_data.get("ATA"):
-                    landing_time = extract_time_from_code(arr_data["ATA"])
-                if not landing_time and shr_data.get("end"):
-                    landing_time = extract_time_from_code(shr_data["end"])
-
-                duration = calculate_flight_duration(takeoff_time, landing_time, dof)
-
-                # === ЗАПИСЬ В БД ===
-                try:
-                    conn.execute(
-                        text(f"""
-                            INSERT INTO {TABLE_NAME} (
-                                flight_id, dof, opr, reg, typ, typ_desc, sid, source_file,
-                                takeoff_time, landing_time, takeoff_coords, landing_coords,
-                                takeoff_region_id, flight_duration_minutes
-                            ) VALUES (
-                                :flight_id, :dof, :opr, :reg, :typ, :typ_desc, :sid, :source_file,
-                                :takeoff_time, :landing_time, :takeoff_coords, :landing_coords,
-                                NULL, :flight_duration_minutes
-                            )
-                        """),
-                        {
-                            "flight_id": flight_id,
-                            "dof": dof,
-                            "opr": shr_data.get("OPR") or None,
-                            "reg": shr_data.get("REG") or None,
-                            "typ": shr_data.get("TYP") or None,
-                            "typ_desc": TYP_DESCRIPTIONS.get(shr_data.get("TYP"), shr_data.get("TYP")) if shr_data.get("TYP") else None,
-                            "sid": sid,
-                            "source_file": original_filename,
-                            "takeoff_time": takeoff_time,
-                            "landing_time": landing_time,
-                            "takeoff_coords": dep_coords,  # Важно: сохраняем как takeoff_coords
-                            "landing_coords": dest_coords, # Важно: сохраняем как landing_coords
-                            "flight_duration_minutes": duration
-                        }
-                    )
-                    inserted_records += 1
-                    
-                except Exception as e:
-                    logger.warning(f"⚠️ Ошибка при вставке записи {idx}: {e}")
-                    continue
-
-            conn.commit()
+        # === ЗАПИСЬ В БД ===
+        with run.stage("insert") as stage:
+            inserted_records = stage["rows"] = run.rows_inserted = write_flight_records(
+                storage, records, original_filename
+            )
 
         # === ОПРЕДЕЛЕНИЕ РЕГИОНОВ ===
-        region_finder = RegionFinder()  # Теперь без параметра
-        update_takeoff_regions_geojson(engine, region_finder)
+        with run.stage("assign_regions") as stage:
+            stage["rows"] = update_takeoff_regions_geojson(engine, region_finder)
+
+        # Точки вылета в тайлах устарели
+        invalidate_tile_cache()
 
         # === РАСЧЕТ МЕТРИК ===
         logger.info("📊 Запуск расчета метрик...")
-        metrics_result = calculate_metrics()
+        with run.stage("calculate_metrics"):
+            metrics_result = calculate_metrics(db_url)
         if metrics_result["success"]:
-            logger.info(f"✅ Метрики рассчитаны для {metrics_result['regions_count']} регионов")
+            logger.info("✅ Метрики рассчитаны для %s регионов", metrics_result['regions_count'])
         else:
-            logger.warning(f"⚠️ Не удалось рассчитать метрики: {metrics_result.get('error', 'Неизвестная ошибка')}")
+            logger.warning("⚠️ Не удалось рассчитать метрики: %s", metrics_result.get('error', 'Неизвестная ошибка'))
 
         # === СТАТИСТИКА ===
         end_time = time.time()
         elapsed = end_time - start_time
         
-        logger.info(f"\n{'='*60}")
+        logger.info('='*60)
         logger.info("📊 ИТОГОВАЯ СТАТИСТИКА")
         logger.info('='*60)
-        logger.info(f"Всего обработано записей: {stats['total_processed']}")
-        logger.info(f"Успешно загружено в БД: {inserted_records}")
-        logger.info(f"Корректные координаты вылета: {stats['valid_dep_coords']}")
-        logger.info(f"Корректные координаты посадки: {stats['valid_dest_coords']}")
-        logger.info(f"Исправлено координат: {stats['corrected_coords']}")
-        logger.info(f"⏱ Время выполнения: {elapsed:.2f} секунд")
+        logger.info("Всего обработано записей: %s", stats['total_processed'])
+        logger.info("Успешно загружено в БД: %s", inserted_records)
+        logger.info("Корректные координаты вылета: %s", stats['valid_dep_coords'])
+        logger.info("Корректные координаты посадки: %s", stats['valid_dest_coords'])
+        logger.info("Исправлено координат: %s", stats['corrected_coords'])
+        logger.info("⏱ Время выполнения: %.2f секунд", elapsed)
         logger.info('='*60)
 
         # Статистика по регионам
-        get_region_statistics(engine)
+        with run.stage("region_statistics"):
+            get_region_statistics(engine)
 
         logger.info("🎉 Обработка завершена!")
 
@@ -765,7 +746,7 @@ def process_flight_data_excel(file_path, original_filename):
         }
         
     except Exception as e:
-        logger.error(f"❌ Ошибка обработки данных о полетах: {e}")
+        logger.error("❌ Ошибка обработки данных о полетах: %s", e)
         return {
             "success": False,
             "error": str(e)
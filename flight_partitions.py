@@ -0,0 +1,231 @@
+# flight_partitions.py
+
+import re
+import logging
+from datetime import date
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+FLIGHTS_TABLE = "flights"
+DEFAULT_PARTITION = "flights_default"
+ARCHIVE_SCHEMA = "flights_archive"
+PARTITION_NAME_PATTERN = re.compile(r"^flights_p(\d{4})_(\d{2})$")
+
+
+def get_month_start(value):
+    """Первое число месяца для даты (date или строка YYYY-MM-DD)"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.replace(day=1)
+
+
+def get_next_month(month_start):
+    """Первое число следующего месяца"""
+    if month_start.month == 12:
+        return month_start.replace(year=month_start.year + 1, month=1)
+    return month_start.replace(month=month_start.month + 1)
+
+
+def get_partition_name(month_start):
+    """Имя месячной партиции: flights_p2024_01"""
+    return f"flights_p{month_start.year:04d}_{month_start.month:02d}"
+
+
+def get_partition_month(partition_name):
+    """Месяц партиции по ее имени (None для партиции по умолчанию)"""
+    match = PARTITION_NAME_PATTERN.match(partition_name)
+    if not match:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def is_partitioned(conn, table_name=FLIGHTS_TABLE):
+    """True, если таблица секционирована, None - если таблицы нет"""
+    relkind = conn.execute(text("""
+        SELECT c.relkind FROM pg_class c
+        WHERE c.oid = to_regclass(:table_name)
+    """), {"table_name": table_name}).scalar()
+    if relkind is None:
+        return None
+    return relkind == 'p'
+
+
+def list_flight_partitions(conn):
+    """Имена партиций таблицы полетов"""
+    result = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table_name)
+        ORDER BY c.relname
+    """), {"table_name": FLIGHTS_TABLE})
+    return [row[0] for row in result]
+
+
+def create_flights_table(conn, columns):
+    """
+    Создает таблицу полетов, секционированную по месяцам даты полета (dof).
+    Записи без даты попадают в партицию по умолчанию. Первичный ключ в
+    секционированной таблице должен включать dof, поэтому id индексируется отдельно.
+    """
+    columns_def = ",\n    ".join([f"{col} {dtype}" for col, dtype in columns.items()])
+    conn.execute(text(f"""
+        CREATE TABLE {FLIGHTS_TABLE} (
+            {columns_def}
+        ) PARTITION BY RANGE (dof);
+    """))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {FLIGHTS_TABLE} DEFAULT;"))
+
+    # Индексы создаются на родительской таблице и наследуются всеми партициями
+    conn.execute(text(f"CREATE INDEX idx_flights_id ON {FLIGHTS_TABLE} (id);"))
+    conn.execute(text(f"CREATE INDEX idx_flights_region_dof ON {FLIGHTS_TABLE} (takeoff_region_id, dof);"))
+    conn.execute(text(f"CREATE INDEX idx_flights_source_file ON {FLIGHTS_TABLE} (source_file);"))
+
+
+def ensure_flight_partitions(conn, dofs):
+    """Создает недостающие месячные партиции для дат полетов (YYYY-MM-DD)"""
+    months = {get_month_start(dof) for dof in dofs if dof}
+    existing = set(list_flight_partitions(conn))
+
+    created = []
+    for month_start in sorted(months):
+        partition_name = get_partition_name(month_start)
+        if partition_name in existing:
+            continue
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {partition_name}
+            PARTITION OF {FLIGHTS_TABLE}
+            FOR VALUES FROM ('{month_start.isoformat()}') TO ('{get_next_month(month_start).isoformat()}');
+        """))
+        created.append(partition_name)
+
+    if created:
+        logger.info("✅ Созданы партиции полетов: %s", ', '.join(created))
+    return created
+
+
+def convert_flights_to_partitioned(conn, columns):
+    """
+    Переводит существующую обычную таблицу полетов в секционированную.
+    id и последовательность сохраняются, данные переносятся одним INSERT ... SELECT.
+    """
+    conn.execute(text(f"ALTER TABLE {FLIGHTS_TABLE} RENAME TO flights_unpartitioned;"))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('flights_unpartitioned', 'id')")).scalar()
+    if sequence:
+        # Последовательность переименовывается, чтобы новая таблица получила прежнее имя
+        conn.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO flights_unpartitioned_id_seq;"))
+
+    create_flights_table(conn, columns)
+
+    months = conn.execute(text("""
+        SELECT DISTINCT date_trunc('month', dof)::date FROM flights_unpartitioned WHERE dof IS NOT NULL
+    """)).scalars().all()
+    ensure_flight_partitions(conn, months)
+
+    column_list = ", ".join(columns)
+    moved = conn.execute(text(f"""
+        INSERT INTO {FLIGHTS_TABLE} ({column_list})
+        SELECT {column_list} FROM flights_unpartitioned
+    """)).rowcount
+    conn.execute(text(f"""
+        SELECT setval(pg_get_serial_sequence('{FLIGHTS_TABLE}', 'id'),
+                      COALESCE((SELECT MAX(id) FROM {FLIGHTS_TABLE}), 0) + 1, false)
+    """))
+    conn.execute(text("DROP TABLE flights_unpartitioned;"))
+    logger.info("✅ Таблица '%s' секционирована по месяцам, перенесено %s записей", FLIGHTS_TABLE, moved)
+
+
+def get_table_columns(conn, schema, table_name):
+    """Колонки таблицы в порядке их создания"""
+    result = conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = :schema AND table_name = :table_name
+        ORDER BY ordinal_position
+    """), {"schema": schema, "table_name": table_name})
+    return [row[0] for row in result]
+
+
+def append_table_rows(conn, source, target_schema, target_name):
+    """
+    Дописывает строки таблицы source в target_schema.target_name и удаляет source.
+    Копируются колонки целевой таблицы (в архиве могут быть не все колонки,
+    добавленные в flights позже).
+    """
+    column_list = ", ".join(get_table_columns(conn, target_schema, target_name))
+    moved = conn.execute(text(f"""
+        INSERT INTO {target_schema}.{target_name} ({column_list})
+        SELECT {column_list} FROM {source}
+    """)).rowcount
+    conn.execute(text(f"DROP TABLE {source};"))
+    return moved
+
+
+def archive_flight_partitions(engine, before, drop=False):
+    """
+    Отсоединяет месячные партиции, целиком лежащие раньше даты before.
+    Отсоединение не переписывает данные: партиция переносится в схему
+    flights_archive (или удаляется при drop=True). Если месяц уже архивировался
+    (полеты за него загрузили снова), строки дописываются в архивную таблицу.
+    """
+    before = date.fromisoformat(before) if isinstance(before, str) else before
+    archived = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return archived
+
+        if not drop:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};"))
+
+        for partition_name in list_flight_partitions(conn):
+            month_start = get_partition_month(partition_name)
+            if month_start is None or get_next_month(month_start) > before:
+                continue
+
+            conn.execute(text(f"ALTER TABLE {FLIGHTS_TABLE} DETACH PARTITION {partition_name};"))
+            if drop:
+                conn.execute(text(f"DROP TABLE {partition_name};"))
+            else:
+                archive_exists = conn.execute(text("SELECT to_regclass(:table_name) IS NOT NULL"), {
+                    "table_name": f"{ARCHIVE_SCHEMA}.{partition_name}"
+                }).scalar()
+                if archive_exists:
+                    moved = append_table_rows(conn, partition_name, ARCHIVE_SCHEMA, partition_name)
+                    logger.info("✅ %s записей дописано в архивную партицию %s", moved, partition_name)
+                else:
+                    conn.execute(text(f"ALTER TABLE {partition_name} SET SCHEMA {ARCHIVE_SCHEMA};"))
+            archived.append(partition_name)
+
+    if archived:
+        action = "удалены" if drop else f"перенесены в схему {ARCHIVE_SCHEMA}"
+        logger.info("✅ Партиции полетов %s: %s", action, ', '.join(archived))
+    return archived
+
+
+def restore_flight_partition(engine, partition_name):
+    """
+    Возвращает архивную партицию обратно в таблицу полетов. Если за этот месяц
+    уже есть действующая партиция (полеты загрузили снова), архивные строки
+    дописываются в таблицу полетов, а архивная таблица удаляется.
+    """
+    month_start = get_partition_month(partition_name)
+    if month_start is None:
+        raise ValueError(f"Некорректное имя партиции: {partition_name}")
+
+    with engine.begin() as conn:
+        if partition_name in list_flight_partitions(conn):
+            column_list = ", ".join(get_table_columns(conn, ARCHIVE_SCHEMA, partition_name))
+            moved = conn.execute(text(f"""
+                INSERT INTO {FLIGHTS_TABLE} ({column_list})
+                SELECT {column_list} FROM {ARCHIVE_SCHEMA}.{partition_name}
+            """)).rowcount
+            conn.execute(text(f"DROP TABLE {ARCHIVE_SCHEMA}.{partition_name};"))
+            logger.info("✅ %s записей из архива дописано в партицию %s", moved, partition_name)
+            return
+
+        conn.execute(text(f"ALTER TABLE {ARCHIVE_SCHEMA}.{partition_name} SET SCHEMA public;"))
+        conn.execute(text(f"""
+            ALTER TABLE {FLIGHTS_TABLE} ATTACH PARTITION {partition_name}
+            FOR VALUES FROM ('{month_start.isoformat()}') TO ('{get_next_month(month_start).isoformat()}');
+        """))
+    logger.info("✅ Партиция %s возвращена из архива", partition_name)
@@ -0,0 +1,362 @@
+# instrumentation.py
+
+import re
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from functools import lru_cache
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from storage import get_storage
+from config import DB_URL, REQUEST_LATENCY_BUCKETS, QUERY_LATENCY_BUCKETS, REQUEST_QUERY_COUNT_BUCKETS
+from config import QUERY_LABEL_MAX_LENGTH, QUERY_LABEL_MAX_SERIES
+
+try:
+    import resource
+except ImportError:
+    # Windows: пиковая память не измеряется
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Текущая загрузка: запросы к БД засчитываются ей, из какого бы модуля они ни выполнялись
+_current_run = contextvars.ContextVar("ingest_run", default=None)
+# Счетчик SQL-запросов текущего HTTP-запроса
+_current_request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+class Histogram:
+    """
+    Гистограмма в формате Prometheus: накопленные счетчики по корзинам для набора меток.
+    При max_series новые метки сверх лимита учитываются в серии "other".
+    """
+
+    def __init__(self, name, description, label_names, buckets, max_series=None):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.max_series = max_series
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        # Счетчики по корзинам хранятся без накопления, накопление - при выводе
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                if self.max_series is not None and len(self.series) >= self.max_series:
+                    labels = ("other",) * len(self.label_names)
+                    series = self.series.get(labels)
+                if series is None:
+                    series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self.series.items()]
+
+        for labels, counts, total in sorted(series):
+            label_text = ",".join(
+                f'{name}="{escape_label_value(value)}"' for name, value in zip(self.label_names, labels)
+            )
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return "\n".join(lines)
+
+
+def escape_label_value(value):
+    """Экранирование значения метки Prometheus"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REQUEST_LATENCY = Histogram(
+    "bpla_http_request_duration_seconds", "Время обработки HTTP-запросов",
+    ("method", "route", "status"), REQUEST_LATENCY_BUCKETS
+)
+REQUEST_QUERIES = Histogram(
+    "bpla_http_request_db_queries", "Число SQL-запросов на один HTTP-запрос",
+    ("method", "route"), REQUEST_QUERY_COUNT_BUCKETS
+)
+QUERY_LATENCY = Histogram(
+    "bpla_db_query_duration_seconds", "Время выполнения SQL-запросов",
+    ("statement",), QUERY_LATENCY_BUCKETS, max_series=QUERY_LABEL_MAX_SERIES
+)
+
+# Списки параметров IN (?, ?, ...) и строки VALUES (...), (...) разной длины
+_PARAMETER = r"(?:\?|%s|%\(\w+\)s|:\w+|\$\d+|'\?'|-?\d+(?:\.\d+)?)"
+_IN_LIST_PATTERN = re.compile(rf"\bIN \({_PARAMETER}(?:, ?{_PARAMETER})*\)", re.IGNORECASE)
+_ROW = r"\((?:[^()]|%\(\w+\)s)*\)"
+_VALUES_ROWS_PATTERN = re.compile(rf"\b(VALUES {_ROW})(?:, ?{_ROW})+", re.IGNORECASE)
+_STRING_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+_PARTITION_NAME_PATTERN = re.compile(r"\bflights_p\d{4}_\d{2}\b")
+
+
+@lru_cache(maxsize=1024)
+def get_statement_label(statement):
+    """
+    Текст SQL для метки: пробелы схлопываются, списки IN и строки VALUES
+    сворачиваются, литералы и имена месячных партиций заменяются, длина ограничивается
+    """
+    label = " ".join(statement.split())
+    label = _STRING_LITERAL_PATTERN.sub("'?'", label)
+    label = _PARTITION_NAME_PATTERN.sub("flights_p*", label)
+    label = _IN_LIST_PATTERN.sub("IN (...)", label)
+    label = _VALUES_ROWS_PATTERN.sub(r"\1, ...", label)
+    return label[:QUERY_LABEL_MAX_LENGTH]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_round_trip(conn, cursor, statement, parameters, context, executemany):
+    """Считает обращения к БД активной загрузки и HTTP-запроса (executemany - одно обращение)"""
+    run = _current_run.get()
+    if run is not None:
+        run.db_round_trips += 1
+    request_queries = _current_request_queries.get()
+    if request_queries is not None:
+        request_queries[0] += 1
+    context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    """Время выполнения SQL по тексту запроса"""
+    QUERY_LATENCY.observe((get_statement_label(statement),), time.perf_counter() - context._query_started)
+
+
+def get_route_path(scope, routes):
+    """Шаблон пути маршрута (/metrics/region/{region_id}) вместо фактического URL"""
+    route = scope.get("route")
+    if route is None:
+        for candidate in routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", None) or "unmatched"
+
+
+@contextmanager
+def track_request(request):
+    """
+    Замер HTTP-запроса: время по маршруту и статусу, число SQL-запросов.
+    Статус ответа задается через возвращаемый словарь.
+    """
+    item = {"status": 500}
+    queries = [0]
+    token = _current_request_queries.set(queries)
+    started = time.perf_counter()
+    try:
+        yield item
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_request_queries.reset(token)
+        route = get_route_path(request.scope, request.app.routes)
+        REQUEST_LATENCY.observe((request.method, route, str(item["status"])), elapsed)
+        REQUEST_QUERIES.observe((request.method, route), queries[0])
+
+
+def render_prometheus_metrics():
+    """Все метрики в текстовом формате Prometheus"""
+    return "\n".join(
+        histogram.render() for histogram in (REQUEST_LATENCY, REQUEST_QUERIES, QUERY_LATENCY)
+    ) + "\n"
+
+
+def create_ingest_runs_table(conn, serial_primary_key):
+    """Таблица замеров загрузок; stages - JSON с замерами по этапам"""
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS ingest_runs (
+            id {serial_primary_key},
+            source_file TEXT,
+            status TEXT NOT NULL,
+            error TEXT,
+            started_at TIMESTAMP,
+            duration_seconds DOUBLE PRECISION,
+            rows_total INTEGER,
+            rows_inserted INTEGER,
+            rows_per_second DOUBLE PRECISION,
+            db_round_trips INTEGER,
+            peak_memory_mb DOUBLE PRECISION,
+            stages TEXT
+        )
+    """))
+
+
+def reset_peak_memory():
+    """Сбрасывает пик RSS процесса (только Linux), False если сброс недоступен"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_memory_mb():
+    """Пиковый RSS процесса в МБ: VmHWM из /proc, иначе ru_maxrss"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: байты на macOS, килобайты на Linux
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class IngestRun:
+    """
+    Замеры одной загрузки файла полетов: время, строки в секунду и число
+    обращений к БД по этапам, пиковая память процесса. Сохраняются в ingest_runs.
+    При параллельных загрузках пик памяти общий для процесса.
+    """
+
+    def __init__(self, source_file):
+        self.source_file = source_file
+        self.started_at = datetime.now()
+        self.status = "running"
+        self.error = None
+        self.stages = {}
+        self.db_round_trips = 0
+        self.rows_total = None
+        self.rows_inserted = None
+        self.duration_seconds = None
+        self.peak_memory_mb = None
+        self._started = None
+        self._token = None
+
+    def __enter__(self):
+        reset_peak_memory()
+        self._started = time.perf_counter()
+        self._token = _current_run.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _current_run.reset(self._token)
+        self.duration_seconds = time.perf_counter() - self._started
+        self.peak_memory_mb = get_peak_memory_mb()
+        if exc is not None:
+            self.fail(str(exc))
+        elif self.status == "running":
+            self.status = "success"
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Замер этапа. Число обработанных строк задается через возвращаемый словарь:
+        with run.stage("insert") as stage: stage["rows"] = ...
+        """
+        item = {"rows": None}
+        round_trips = self.db_round_trips
+        started = time.perf_counter()
+        try:
+            yield item
+        finally:
+            seconds = time.perf_counter() - started
+            rows = item["rows"]
+            self.stages[name] = {
+                "seconds": round(seconds, 4),
+                "rows": rows,
+                "rows_per_second": round(rows / seconds, 1) if rows and seconds > 0 else None,
+                "db_round_trips": self.db_round_trips - round_trips,
+            }
+
+    def fail(self, error):
+        """Отмечает загрузку как неудачную"""
+        self.status = "failed"
+        self.error = error
+
+    @property
+    def rows_per_second(self):
+        if not self.rows_inserted or not self.duration_seconds:
+            return None
+        return round(self.rows_inserted / self.duration_seconds, 1)
+
+    def to_dict(self):
+        return {
+            "source_file": self.source_file,
+            "status": self.status,
+            "error": self.error,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "duration_seconds": round(self.duration_seconds, 3) if self.duration_seconds is not None else None,
+            "rows_total": self.rows_total,
+            "rows_inserted": self.rows_inserted,
+            "rows_per_second": self.rows_per_second,
+            "db_round_trips": self.db_round_trips,
+            "peak_memory_mb": self.peak_memory_mb,
+            "stages": self.stages,
+        }
+
+    def save(self, db_url=DB_URL):
+        """Сохраняет замеры в ingest_runs, возвращает id записи (None при ошибке)"""
+        run = self.to_dict()
+        run["stages"] = json.dumps(self.stages, ensure_ascii=False)
+        try:
+            with get_storage(db_url).engine.begin() as conn:
+                return conn.execute(text("""
+                    INSERT INTO ingest_runs (
+                        source_file, status, error, started_at, duration_seconds, rows_total,
+                        rows_inserted, rows_per_second, db_round_trips, peak_memory_mb, stages
+                    ) VALUES (
+                        :source_file, :status, :error, :started_at, :duration_seconds, :rows_total,
+                        :rows_inserted, :rows_per_second, :db_round_trips, :peak_memory_mb, :stages
+                    )
+                    RETURNING id
+                """), {**run, "started_at": self.started_at}).scalar()
+        except Exception as e:
+            logger.warning("⚠️ Не удалось сохранить замеры загрузки: %s", e)
+            return None
+
+    def log_summary(self):
+        """Выводит время этапов в лог"""
+        stages = ", ".join(f"{name} {item['seconds']:.2f} s" for name, item in self.stages.items())
+        logger.info("⏱ Этапы загрузки: %s", stages)
+        logger.info("⏱ Обращений к БД: %s, пик памяти: %s МБ", self.db_round_trips, self.peak_memory_mb)
+
+
+def list_ingest_runs(db_url=DB_URL, limit=50):
+    """Последние загрузки файлов полетов с замерами, новые первыми"""
+    with get_storage(db_url).engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT id, source_file, status, error, started_at, duration_seconds, rows_total,
+                   rows_inserted, rows_per_second, db_round_trips, peak_memory_mb, stages
+            FROM ingest_runs
+            ORDER BY id DESC
+            LIMIT :limit
+        """), {"limit": limit}).mappings().fetchall()
+
+    runs = []
+    for row in rows:
+        run = dict(row)
+        started_at = run["started_at"]
+        if isinstance(started_at, str):
+            # SQLite возвращает TIMESTAMP строкой
+            started_at = datetime.fromisoformat(started_at)
+        if started_at is not None:
+            run["started_at"] = started_at.isoformat(timespec="seconds")
+        run["stages"] = json.loads(run["stages"]) if run["stages"] else {}
+        runs.append(run)
+    return runs
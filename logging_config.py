@@ -0,0 +1,139 @@
+# logging_config.py
+
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_PROGRESS_INTERVAL, LOG_SAMPLE_FIRST, LOG_SAMPLE_EVERY
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# Стандартные атрибуты LogRecord: остальные переданы через extra= и попадают в JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON, поля из extra= добавляются как есть"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживает записи с extra={"sampled": True}: по каждому шаблону сообщения
+    выводятся первые first записей, дальше - каждая every-я с общим числом повторов.
+    Шаблон - это msg до подстановки аргументов, поэтому сообщения с разными
+    значениями (координатами, строками) считаются одним событием.
+    """
+
+    def __init__(self, first=LOG_SAMPLE_FIRST, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.first = first
+        self.every = every
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        # Фильтр общий для всех обработчиков: запись оценивается один раз
+        decision = getattr(record, "_sampling_decision", None)
+        if decision is not None:
+            return decision
+
+        key = (record.name, record.msg)
+        with self.lock:
+            self.counts[key] += 1
+            count = self.counts[key]
+        decision = count <= self.first or (count - self.first) % self.every == 0
+        if decision and count > self.first:
+            record.occurrences = count
+            record.msg = f"{record.msg} (повторов: %d)"
+            record.args = (record.args or ()) + (count,)
+        record._sampling_decision = decision
+        return decision
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, log_file=LOG_FILE):
+    """
+    Настраивает корневой логгер: текст или JSON в stderr и, если задан, в файл.
+    Вызывается один раз при запуске сервера; модули только получают логгеры
+    через logging.getLogger(__name__). Повторный вызов заменяет обработчики.
+    """
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if getattr(handler, "bpla_handler", False):
+            root.removeHandler(handler)
+            handler.close()
+
+    sampling_filter = SamplingFilter()
+    for handler in handlers:
+        handler.bpla_handler = True
+        handler.setFormatter(formatter)
+        handler.addFilter(sampling_filter)
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+class ProgressLogger:
+    """
+    Прогресс длинного цикла: вместо записи на каждый элемент - запись не чаще
+    раза в interval секунд и итог в done(). События внутри цикла (пропущенные
+    строки и т.п.) считаются через count() и выводятся одной строкой в итоге.
+    """
+
+    def __init__(self, logger, label, total=None, interval=LOG_PROGRESS_INTERVAL, level=logging.INFO):
+        self.logger = logger
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.level = level
+        self.processed = 0
+        self.events = Counter()
+        self.enabled = logger.isEnabledFor(level)
+        self.started = time.monotonic()
+        self.next_report = self.started + interval
+
+    def update(self, n=1):
+        self.processed += n
+        if self.enabled and time.monotonic() >= self.next_report:
+            self.next_report = time.monotonic() + self.interval
+            self.logger.log(
+                self.level, "🔄 %s: %d из %s", self.label, self.processed, self.total or "?",
+                extra={"progress": self.label, "processed": self.processed, "total": self.total}
+            )
+
+    def count(self, event, n=1):
+        """Считает событие вместо отдельной записи в лог"""
+        self.events[event] += n
+
+    def done(self):
+        elapsed = time.monotonic() - self.started
+        events = "".join(f", {event}: {count}" for event, count in self.events.items())
+        self.logger.log(
+            self.level, "✅ %s: %d за %.2f с%s", self.label, self.processed, elapsed, events,
+            extra={
+                "progress": self.label,
+                "processed": self.processed,
+                "elapsed_seconds": round(elapsed, 3),
+                "events": dict(self.events),
+            }
+        )
@@ -1,40 +1,156 @@
 # uvicorn main:app --reload --host 0.0.0.0 --port 8000
  
 # main.py
-from sqlalchemy import create_engine, text
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from sqlalchemy import text
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 import os
 import json
+import logging
 from datetime import datetime
 import uuid
 import shutil
-import pandas as pd
-from map_builder import process_geojson_file, get_last_map
-from shapefile_processor import process_shapefile
-from flight_data_processor import process_flight_data_excel
+import hashlib
+from contextlib import asynccontextmanager
+# geopandas, pandas и plotly (map_builder, shapefile_processor, flight_data_processor,
+# map_style) импортируются в обработчиках при первом использовании: эндпоинты
+# чтения их не используют, а запуск воркера их не ждет
+import map_cache
+from map_cache import get_last_map, get_map_levels, get_level_for_zoom
+from map_cache import get_cache_key, get_active_cached_map, get_last_map_info, update_last_map_info
 from metrics_calculator import BasicMetricsCalculator, calculate_metrics
-import traceback
 from sqlalchemy import text
 from overview_metrics import get_overview_metrics
+from tile_builder import TileBuilder, is_valid_tile, invalidate_tile_cache
+from flight_partitions import archive_flight_partitions
+from storage import get_storage, get_boundary_state, run_in_db_thread
+from dimensions import get_region_breakdown
+from instrumentation import list_ingest_runs, track_request, render_prometheus_metrics
+from profiling import is_profile_requested, profile_block, read_profile, run_attached
+from logging_config import configure_logging
+from warmup import start_warmup, mark_ready, is_ready, get_warmup_state
 import tempfile
-from shapefile_processor import ShapefileProcessor, process_shapefile, save_geojson_to_uploads
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
 
 # Импортируем настройки из config
-from config import DB_URL, UPLOADS_FOLDER
+from config import DB_URL, UPLOADS_FOLDER, MAP_LEVELS, MAP_LEVEL_MIN_ZOOM, WARMUP_ON_STARTUP
+from config import MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE, UPLOAD_FORM_OVERHEAD
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, UPLOADS_FOLDER)
 SHAPEFILE_DIR = os.path.join(BASE_DIR, "shapefile_uploads")
 FLIGHT_DATA_DIR = os.path.join(BASE_DIR, "flight_data_uploads")
 
-# Создаем директории для загрузок, если они не существуют
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(SHAPEFILE_DIR, exist_ok=True)
-os.makedirs(FLIGHT_DATA_DIR, exist_ok=True)
+tile_builder = TileBuilder(DB_URL)
+
+
+def create_directories():
+    """Создает директории для загрузок и кэша карт (при запуске, а не при импорте)"""
+    for directory in (UPLOAD_DIR, SHAPEFILE_DIR, FLIGHT_DATA_DIR, map_cache.CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+
+
+def migrate_database():
+    """Применяет недостающие миграции схемы при запуске сервера"""
+    try:
+        get_storage(DB_URL).ensure_flights_schema()
+    except Exception as e:
+        logger.warning("⚠️ Не удалось применить миграции схемы: %s", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Запуск сервера: логирование (LOG_LEVEL, LOG_FORMAT, LOG_FILE), директории,
+    миграции схемы. Затем в фоне прогреваются индекс регионов, карта и метрики
+    (WARMUP_ON_STARTUP); /ready отвечает 200 после прогрева.
+    """
+    configure_logging()
+    create_directories()
+    migrate_database()
+    if WARMUP_ON_STARTUP:
+        start_warmup(DB_URL)
+    else:
+        mark_ready()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+class UploadSizeLimitMiddleware:
+    """
+    Ограничивает размер тела запроса (MAX_FILE_SIZE + запас на заголовки multipart).
+    При известном Content-Length запрос отклоняется с 413 до чтения тела; без него
+    (Transfer-Encoding: chunked) байты считаются по мере чтения, и разбор формы
+    прерывается, как только тело превысило предел, а не после записи на диск целиком.
+    """
+
+    def __init__(self, app, max_body_size):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({"detail": get_file_too_large_message()}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Обработчик FastAPI пробрасывает HTTPException из разбора тела как есть
+                    raise HTTPException(status_code=413, detail=get_file_too_large_message())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware, max_body_size=MAX_FILE_SIZE + UPLOAD_FORM_OVERHEAD)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Время обработки и число SQL-запросов по маршрутам для /internal/metrics"""
+    with track_request(request) as item:
+        response = await call_next(request)
+        item["status"] = response.status_code
+    return response
+
+class ProfileRequestMiddleware:
+    """
+    Профилирование по заголовку X-Profile: 1 или ?profile=1. id профиля
+    возвращается в заголовке X-Profile-Id, профиль - по /internal/profiles/{id}.
+    Без запроса профиля scope, receive и send передаются приложению как есть.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_profile_requested(scope):
+            return await self.app(scope, receive, send)
+
+        with profile_block(f"{scope['method']} {scope['path']}") as profile:
+            async def send_with_profile_id(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-profile-id", profile["id"].encode("latin-1")))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_profile_id)
+
+app.add_middleware(ProfileRequestMiddleware)
 
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 
@@ -49,17 +165,18 @@ async def get_all_regions_metrics():
     """Получает метрики для всех регионов в формате для общей аналитики"""
     try:
         calculator = BasicMetricsCalculator(DB_URL)
-        metrics = calculator.get_all_regions_metrics()
+        metrics = await run_in_db_thread(calculator.get_all_regions_metrics)
         return JSONResponse(metrics)
     except Exception as e:
-        print(f"Ошибка получения метрик всех регионов: {str(e)}")
+        logger.error("Ошибка получения метрик всех регионов: %s", e)
         return JSONResponse({"error": str(e)}, status_code=500)
 
 @app.get("/last_map")
 async def get_last_processed_map():
     """Возвращает последнюю обработанную карту"""
     try:
-        last_map = get_last_map()
+        # Холодный кэш читает файл карты - не в цикле событий
+        last_map = await run_in_threadpool(get_last_map)
         if last_map:
             return JSONResponse(last_map)
         else:
@@ -67,21 +184,83 @@ async def get_last_processed_map():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка загрузки карты: {str(e)}")
 
+@app.get("/map")
+async def get_map_by_level(level: Optional[str] = None, zoom: Optional[float] = None):
+    """Возвращает последнюю карту с уровнем детализации по имени уровня или коэффициенту увеличения"""
+    if level is None:
+        level = get_level_for_zoom(zoom) if zoom is not None else get_map_levels()[0]
+    elif level not in MAP_LEVELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестный уровень детализации: {level}. Доступны: {', '.join(get_map_levels())}"
+        )
+
+    try:
+        map_data = await run_in_threadpool(get_last_map, level)
+        if not map_data:
+            return JSONResponse({"error": "Нет сохраненных карт"}, status_code=404)
+        return JSONResponse({
+            **map_data,
+            "level": level,
+            "levels": get_map_levels(),
+            "level_min_zoom": MAP_LEVEL_MIN_ZOOM
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка загрузки карты: {str(e)}")
+
+@app.get("/map/style")
+async def get_map_style_endpoint(metric: str = "flight_count", bins: str = "quantile", classes: int = 5):
+    """Возвращает раскраску регионов по метрике (цвета в порядке трасс карты, без геометрии)"""
+    from map_style import get_map_style, STYLE_METRICS, BIN_METHODS, MIN_CLASSES, MAX_CLASSES
+
+    if metric not in STYLE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Неизвестная метрика: {metric}. Доступны: {', '.join(STYLE_METRICS)}")
+    if bins not in BIN_METHODS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный способ разбиения: {bins}. Доступны: {', '.join(BIN_METHODS)}")
+    if not MIN_CLASSES <= classes <= MAX_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Количество классов должно быть от {MIN_CLASSES} до {MAX_CLASSES}")
+
+    try:
+        return JSONResponse(await run_in_db_thread(get_map_style, metric, bins, classes))
+    except Exception as e:
+        logger.error("Ошибка расчета раскраски карты: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.get("/tiles/{z}/{x}/{y}.mvt")
+async def get_vector_tile(z: int, x: int, y: int):
+    """Возвращает векторный тайл (Mapbox Vector Tile) с регионами и точками вылета"""
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Тайл не существует")
+
+    try:
+        tile = await run_in_db_thread(tile_builder.get_tile, z, x, y)
+        return Response(
+            content=tile,
+            media_type="application/vnd.mapbox-vector-tile",
+            headers={"Cache-Control": "no-cache"}
+        )
+    except Exception as e:
+        logger.error("Ошибка построения тайла %s/%s/%s: %s", z, x, y, e)
+        raise HTTPException(status_code=500, detail=f"Ошибка построения тайла: {str(e)}")
+
 @app.post("/process")
-async def process_uploaded_file(file: UploadFile = File(...)):
+async def process_uploaded_file(file: UploadFile = File(...), session_id: Optional[str] = Form(None)):
     """Обрабатывает загруженные файлы (GeoJSON или Shapefile)"""
-    
+    from shapefile_processor import SHAPEFILE_COMPONENTS
+
     # Проверяем расширение файла
     filename_lower = file.filename.lower()
     
     if filename_lower.endswith((".json", ".geojson")):
         return await process_geojson_file_handler(file)
-    elif filename_lower.endswith((".shp", ".shx", ".dbf", ".prj", ".zip")):
+    elif filename_lower.endswith(".zip"):
         return await process_shapefile_handler(file)
+    elif filename_lower.endswith(SHAPEFILE_COMPONENTS):
+        return await process_shapefile_component_handler(file, session_id)
     else:
         raise HTTPException(
             status_code=400, 
-            detail="Поддерживаются только .json, .geojson, .shp, .shx, .dbf, .prj и .zip файлы"
+            detail="Поддерживаются только .json, .geojson, .shp, .shx, .dbf, .prj, .cpg и .zip файлы"
         )
 
 @app.post("/process_flights")
@@ -98,13 +277,13 @@ async def process_flight_data_file(file: UploadFile = File(...)):
     
     if result.get("success"):
         try:
-            metrics_result = calculate_metrics()
+            metrics_result = await run_in_db_thread(calculate_metrics)
             if metrics_result["success"]:
-                print(f"✅ Метрики автоматически рассчитаны для {metrics_result['regions_count']} регионов")
+                logger.info("✅ Метрики автоматически рассчитаны для %s регионов", metrics_result["regions_count"])
             else:
-                print(f"⚠️ Не удалось рассчитать метрики: {metrics_result.get('error')}")
+                logger.warning("⚠️ Не удалось рассчитать метрики: %s", metrics_result.get("error"))
         except Exception as e:
-            print(f"⚠️ Ошибка при автоматическом расчете метрик: {e}")
+            logger.warning("⚠️ Ошибка при автоматическом расчете метрик: %s", e)
     
     return JSONResponse(result)
 
@@ -112,39 +291,56 @@ async def process_flight_data_file(file: UploadFile = File(...)):
 async def calculate_basic_metrics():
     """Запускает расчет базовых метрик"""
     try:
-        print("🚀 Запуск расчета метрик...")
-        result = calculate_metrics(DB_URL)  # Явно передаем DB_URL
+        logger.info("🚀 Запуск расчета метрик...")
+        result = await run_in_db_thread(calculate_metrics, DB_URL)  # Явно передаем DB_URL
         
         if result["success"]:
-            print(f"✅ Метрики успешно рассчитаны для {result['regions_count']} регионов")
+            logger.info("✅ Метрики успешно рассчитаны для %s регионов", result["regions_count"])
             return JSONResponse({
                 "success": True,
                 "message": f"Метрики рассчитаны для {result['regions_count']} регионов",
                 "regions_count": result['regions_count']
             })
         else:
-            print(f"❌ Ошибка расчета метрик: {result.get('error')}")
+            logger.error("❌ Ошибка расчета метрик: %s", result.get("error"))
             return JSONResponse({
                 "success": False,
                 "error": result.get("error", "Неизвестная ошибка"),
                 "message": "Метрики не были рассчитаны"
             })
     except Exception as e:
-        error_msg = f"💥 Критическая ошибка расчета метрик: {str(e)}"
-        print(error_msg)
+        logger.exception("💥 Критическая ошибка расчета метрик: %s", e)
         return JSONResponse({
             "success": False,
             "error": str(e),
             "message": "Ошибка расчета метрик"
         })
 
+@app.post("/flights/archive")
+async def archive_flights(before: str = Form(...), drop: bool = Form(False)):
+    """Отсоединяет месячные партиции полетов раньше даты before (YYYY-MM-DD)"""
+    try:
+        archived = await run_in_db_thread(archive_flight_partitions, get_storage(DB_URL).engine, before, drop=drop)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректная дата: {str(e)}")
+    except Exception as e:
+        logger.error("❌ Ошибка архивации полетов: %s", e)
+        return JSONResponse({"success": False, "error": str(e)})
+
+    if archived:
+        # Архивные полеты больше не участвуют в метриках и тайлах
+        await run_in_threadpool(invalidate_tile_cache)
+        await run_in_db_thread(calculate_metrics, DB_URL)
+
+    return JSONResponse({"success": True, "archived": archived, "dropped": drop})
+
 @app.get("/metrics/region/{region_id}")
 async def get_region_metrics(region_id: int):
     """Получает метрики для конкретного региона"""
     try:
         calculator = BasicMetricsCalculator(DB_URL)
         
-        metrics = calculator.get_region_metrics(region_id)
+        metrics = await run_in_db_thread(calculator.get_region_metrics, region_id)
         if not metrics:
             raise HTTPException(status_code=404, detail="Метрики для региона не найдены")
         
@@ -164,18 +360,57 @@ async def get_region_metrics(region_id: int):
                 "evening": metrics[12],
                 "night": metrics[13]
             },
-            "last_calculated": metrics[14].isoformat() if metrics[14] else None
+            # SQLite возвращает TIMESTAMP строкой
+            "last_calculated": metrics[14].isoformat() if hasattr(metrics[14], "isoformat") else metrics[14]
         })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка получения метрик: {str(e)}")
 
+@app.get("/metrics/region/{region_id}/breakdown")
+async def get_region_breakdown_metrics(region_id: int, limit: int = 10):
+    """Распределение полетов региона по операторам и типам воздушных судов"""
+    try:
+        breakdown = await run_in_db_thread(get_region_breakdown, region_id, DB_URL, limit=max(1, min(limit, 100)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка получения распределения: {str(e)}")
+    if breakdown is None:
+        raise HTTPException(status_code=404, detail="Регион не найден")
+    return JSONResponse(breakdown)
+
+@app.get("/ingest/runs")
+async def get_ingest_runs(limit: int = 50):
+    """Замеры последних загрузок файлов полетов: время этапов, строки в секунду, обращения к БД, память"""
+    try:
+        runs = await run_in_db_thread(list_ingest_runs, DB_URL, limit=max(1, min(limit, 500)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка получения замеров загрузок: {str(e)}")
+    return JSONResponse({"runs": runs})
+
+@app.get("/ready")
+async def get_readiness():
+    """Готовность воркера принимать трафик: 503, пока идет прогрев кэшей"""
+    return JSONResponse(get_warmup_state(), status_code=200 if is_ready() else 503)
+
+@app.get("/internal/metrics")
+async def get_internal_metrics():
+    """Гистограммы времени HTTP-запросов и SQL в текстовом формате Prometheus"""
+    return Response(render_prometheus_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/internal/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """Профиль запроса в формате collapsed stacks (для flamegraph.pl или speedscope)"""
+    profile = read_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return Response(profile, media_type="text/plain; charset=utf-8")
+
 @app.get("/metrics/overall")
 async def get_overall_metrics():
     try:
-        metrics = get_overview_metrics()
+        metrics = await run_in_db_thread(get_overview_metrics)
         return JSONResponse(metrics)
     except Exception as e:
-        print(f"Ошибка получения общей аналитики: {e}")
+        logger.error("Ошибка получения общей аналитики: %s", e)
         return JSONResponse({
             "total_flights": 0,
             "avg_duration": 0.0,
@@ -190,7 +425,7 @@ async def get_all_regions_metrics():
     try:
         calculator = BasicMetricsCalculator(DB_URL)
         
-        metrics = calculator.get_all_regions_metrics()
+        metrics = await run_in_db_thread(calculator.get_all_regions_metrics)
         
         # Добавляем проверку на существование данных
         if not metrics:
@@ -198,12 +433,15 @@ async def get_all_regions_metrics():
         
         return JSONResponse(metrics)
     except Exception as e:
-        print(f"Ошибка получения метрик регионов: {str(e)}")
+        logger.error("Ошибка получения метрик регионов: %s", e)
         return JSONResponse({"error": str(e)}, status_code=500)
     
 @app.get("/debug/regions")
 async def debug_regions():
     """Отладочная информация о регионах"""
+    return await run_in_db_thread(get_debug_regions)
+
+def get_debug_regions():
     try:
         calculator = BasicMetricsCalculator(DB_URL)
         
@@ -223,6 +461,9 @@ async def debug_regions():
 @app.get("/find_region_by_name")
 async def find_region_by_name(region_name: str):
     """Находит ID региона по имени"""
+    return await run_in_db_thread(find_region_id_by_name, region_name)
+
+def find_region_id_by_name(region_name):
     try:
         calculator = BasicMetricsCalculator(DB_URL)
         
@@ -256,57 +497,133 @@ async def find_region_by_name(region_name: str):
     except Exception as e:
         return JSONResponse({"error": str(e), "found": False})
 
+def get_file_too_large_message():
+    return f"Файл больше допустимого размера {MAX_FILE_SIZE // (1024 * 1024)} МБ"
+
+def copy_upload(source, path, max_size=MAX_FILE_SIZE, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Копирует загрузку на диск кусками chunk_size, попутно считая md5. Файл пишется
+    во временный рядом с path и заменяет path только целиком: при превышении
+    max_size (413) или ошибке прежний файл не затрагивается. Возвращает (md5, размер).
+    """
+    digest = hashlib.md5()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: source.read(chunk_size), b""):
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(status_code=413, detail=get_file_too_large_message())
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest(), size
+
+async def save_upload_file(file: UploadFile, path):
+    """Сохраняет UploadFile в path в пуле потоков (чтение и запись не блокируют цикл событий)"""
+    return await run_in_threadpool(run_attached, copy_upload, file.file, path)
+
+def get_cached_geojson_map(cache_key):
+    """
+    Кэшированная карта и число регионов, если те же границы уже активны и загружены
+    в эту БД (тогда JSON не разбирается вовсе), иначе None
+    """
+    boundary_state = get_boundary_state(DB_URL)
+    cached_map = get_active_cached_map(cache_key, boundary_state)
+    if not cached_map:
+        return None
+    last_info = get_last_map_info() or {}
+    return cached_map, last_info.get("regions_count", len(cached_map.get("data", [])))
+
+def load_geojson_regions(file_path, filename, cache_key):
+    """
+    Разбирает сохраненный GeoJSON, загружает регионы в БД и строит карту.
+    Выполняется в пуле потоков; возвращает карту, число регионов и признак загрузки в БД.
+    """
+    # Пытаемся прочитать как JSON для проверки валидности
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            input_data = json.load(f)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный JSON файл: {str(e)}")
+
+    # Проверяем, что это FeatureCollection
+    if not isinstance(input_data, dict) or input_data.get("type") != "FeatureCollection":
+        raise HTTPException(status_code=400, detail="Ожидается GeoJSON FeatureCollection")
+
+    # Проверяем наличие features
+    if 'features' not in input_data or not input_data['features']:
+        raise HTTPException(status_code=400, detail="GeoJSON не содержит features")
+
+    # Логируем информацию о загружаемом файле
+    logger.info("Обработка GeoJSON файла: %s", filename)
+    logger.info("Количество features: %s", len(input_data["features"]))
+    logger.info("Файл сохранен как: %s", file_path)
+
+    from map_builder import process_regions_gdf, regions_from_geojson
+    from shapefile_processor import ShapefileProcessor
+
+    # Регионы разбираются один раз и используются для индекса, БД и карты
+    regions = regions_from_geojson(input_data)
+
+    # 🔥 ВАЖНОЕ ИСПРАВЛЕНИЕ: Загружаем GeoJSON в базу данных
+    logger.info("🔄 Загрузка GeoJSON данных в базу данных...")
+    processor = ShapefileProcessor()
+
+    # Загружаем данные в базу (тот же загрузчик, что и для shapefile)
+    db_success = processor.load_regions_gdf(regions)
+
+    if db_success:
+        logger.info("✅ GeoJSON данные успешно загружены в базу данных")
+    else:
+        logger.warning("⚠️ Не удалось загрузить GeoJSON данные в базу")
+
+    # Обрабатываем файл через функцию из map_builder (карта берется из кэша, если уже строилась)
+    plotly_data = process_regions_gdf(regions, cache_key=cache_key)
+    update_last_map_info(
+        database_updated=db_success, regions_count=len(regions),
+        boundary_state=get_boundary_state(DB_URL) if db_success else None
+    )
+    return plotly_data, len(regions), db_success
+
 async def process_geojson_file_handler(file: UploadFile):
     """Обработчик GeoJSON файлов"""
     # Всегда сохраняем как russia_regions.geojson (ПЕРЕЗАПИСЫВАЕМ!)
     file_path = os.path.join(UPLOAD_DIR, "russia_regions.geojson")
 
     try:
-        # Читаем и сохраняем файл (ПЕРЕЗАПИСЫВАЕМ!)
-        content = await file.read()
-        
-        # Сохраняем файл на диск (перезаписываем если существует)
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        # Пытаемся прочитать как JSON для проверки валидности
-        try:
-            input_data = json.loads(content.decode("utf-8"))
-        except json.JSONDecodeError as e:
-            raise HTTPException(status_code=400, detail=f"Некорректный JSON файл: {str(e)}")
-
-        # Проверяем, что это FeatureCollection
-        if not isinstance(input_data, dict) or input_data.get("type") != "FeatureCollection":
-            raise HTTPException(status_code=400, detail="Ожидается GeoJSON FeatureCollection")
-
-        # Проверяем наличие features
-        if 'features' not in input_data or not input_data['features']:
-            raise HTTPException(status_code=400, detail="GeoJSON не содержит features")
-
-        # Логируем информацию о загружаемом файле
-        print(f"Обработка GeoJSON файла: {file.filename}")
-        print(f"Количество features: {len(input_data['features'])}")
-        print(f"Файл сохранен как: {file_path}")
-        
-        # 🔥 ВАЖНОЕ ИСПРАВЛЕНИЕ: Загружаем GeoJSON в базу данных
-        print("🔄 Загрузка GeoJSON данных в базу данных...")
-        processor = ShapefileProcessor()
-        
-        # Создаем таблицу если не существует
-        table_created = processor.create_table_if_not_exists()
-        if not table_created:
-            print("❌ Не удалось создать таблицу russia_regions")
-        
-        # Загружаем данные в базу
-        db_success = processor.load_to_database(input_data)
-        
-        if db_success:
-            print(f"✅ GeoJSON данные успешно загружены в базу данных")
-        else:
-            print(f"⚠️ Не удалось загрузить GeoJSON данные в базу")
-        
-        # Обрабатываем файл через функцию из map_builder с ПРИНУДИТЕЛЬНЫМ ОБНОВЛЕНИЕМ
-        plotly_data = process_geojson_file(input_data, force_refresh=True)
+        # Сохраняем файл на диск потоково (перезаписываем если существует)
+        content_hash, _ = await save_upload_file(file, file_path)
+
+        # Ключ кэша считается по исходным байтам файла и параметрам обработки
+        cache_key = get_cache_key(content_hash)
+
+        cached = await run_in_db_thread(get_cached_geojson_map, cache_key)
+        if cached:
+            cached_map, regions_count = cached
+            logger.info("Границы не изменились, используется кэшированная карта: %s", cache_key)
+            return JSONResponse({
+                **cached_map,
+                "file_info": {
+                    "original_filename": file.filename,
+                    "saved_as": "russia_regions.geojson",
+                    "file_type": "geojson",
+                    "regions_count": regions_count,
+                    "database_updated": True,
+                    "cache_hit": True,
+                    "upload_time": datetime.now().isoformat()
+                }
+            })
+
+        # Разбор, загрузка в БД и построение карты - в пуле потоков
+        plotly_data, regions_count, db_success = await run_in_db_thread(
+            load_geojson_regions, file_path, file.filename, cache_key
+        )
         
         return JSONResponse({
             **plotly_data,
@@ -314,7 +631,7 @@ async def process_geojson_file_handler(file: UploadFile):
                 "original_filename": file.filename,
                 "saved_as": "russia_regions.geojson",
                 "file_type": "geojson",
-                "regions_count": len(input_data['features']),
+                "regions_count": regions_count,
                 "database_updated": db_success,  # 🔥 Добавляем информацию о загрузке в БД
                 "upload_time": datetime.now().isoformat()
             }
@@ -328,148 +645,116 @@ async def process_geojson_file_handler(file: UploadFile):
             os.remove(file_path)
         
         # Логируем полную ошибку для отладки
-        error_details = traceback.format_exc()
-        print(f"Ошибка обработки GeoJSON файла: {str(e)}")
-        print(f"Детали ошибки: {error_details}")
+        logger.exception("Ошибка обработки GeoJSON файла: %s", e)
         
         raise HTTPException(status_code=500, detail=f"Ошибка обработки файла: {str(e)}")
 
+def shapefile_result_response(result, original_filename, file_type):
+    """Ответ с картой по результату process_shapefile"""
+    if not result.get("success"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error", "Неизвестная ошибка")
+        )
+
+    return JSONResponse({
+        **result["plotly_data"],
+        "file_info": {
+            "original_filename": original_filename,
+            "file_type": file_type,
+            "regions_count": result.get("regions_count", 0),
+            "database_updated": result.get("database_updated", False),
+            "upload_time": datetime.now().isoformat()
+        }
+    })
+
 async def process_shapefile_handler(file: UploadFile):
-    """Обработчик Shapefile файлов - использует временную папку только для обработки"""
+    """Обработчик ZIP архивов с shapefile - архив читается без распаковки"""
+    from shapefile_processor import process_shapefile
+
     # Создаем временную папку для обработки
     temp_dir = tempfile.mkdtemp()
     
     try:
-        # Читаем и сохраняем файл во временную папку
-        content = await file.read()
-        file_path = os.path.join(temp_dir, file.filename)
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
+        # Сохраняем файл во временную папку потоково
+        file_path = os.path.join(temp_dir, os.path.basename(file.filename))
+        content_hash, _ = await save_upload_file(file, file_path)
 
-        print(f"Обработка Shapefile компонента: {file.filename}")
-        
-        # Обрабатываем файл
-        if file.filename.lower().endswith('.zip'):
-            result = process_shapefile(file_path, file.filename)
-        else:
-            # Для отдельных компонентов ищем .shp файл
-            shp_file = None
-            for file_in_dir in os.listdir(temp_dir):
-                if file_in_dir.lower().endswith('.shp'):
-                    shp_file = os.path.join(temp_dir, file_in_dir)
-                    break
-            
-            if not shp_file:
-                return JSONResponse({
-                    "status": "waiting_for_components",
-                    "message": "Загружены не все компоненты shapefile"
-                })
-            
-            result = process_shapefile(shp_file, file.filename)
-        
-        if result.get("success"):
-            return JSONResponse({
-                **result["plotly_data"],
-                "file_info": {
-                    "original_filename": file.filename,
-                    "file_type": "shapefile",
-                    "regions_count": result.get("regions_count", 0),
-                    "database_updated": result.get("database_updated", False),
-                    "upload_time": datetime.now().isoformat()
-                }
-            })
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Неизвестная ошибка"))
+        logger.info("Обработка ZIP архива с shapefile: %s", file.filename)
+        result = await run_in_db_thread(process_shapefile, file_path, file.filename, content_hash=content_hash)
+        return shapefile_result_response(result, file.filename, "shapefile_zip")
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка обработки shapefile: {str(e)}")
     finally:
         # Всегда удаляем временную папку после обработки
         if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            await run_in_threadpool(shutil.rmtree, temp_dir, ignore_errors=True)
+
+async def process_shapefile_component_handler(file: UploadFile, session_id: Optional[str]):
+    """
+    Обработчик отдельных компонентов shapefile. Компоненты собираются в сессию загрузки;
+    карта строится, когда загружены все обязательные файлы.
+    """
+    from upload_sessions import add_session_component, get_session_components, get_session_dir, remove_session
+    from upload_sessions import UploadSessionError
+    from shapefile_processor import process_shapefile
 
-async def process_zip_shapefile(zip_path: str, session_dir: str, original_filename: str):
-    """Обрабатывает ZIP архив с shapefile"""
+    # Компонент сохраняется рядом с сессиями и переносится в папку сессии без копирования
+    fd, component_path = tempfile.mkstemp(dir=SHAPEFILE_DIR, suffix=".part")
+    os.close(fd)
     try:
-        # Обрабатываем shapefile через process_shapefile
-        result = process_shapefile(zip_path, original_filename)
-        
-        if result.get("success"):
-            return JSONResponse({
-                **result["plotly_data"],
-                "file_info": {
-                    "original_filename": original_filename,
-                    "file_type": "shapefile_zip",
-                    "regions_count": result.get("regions_count", 0),
-                    "database_updated": result.get("database_updated", False),
-                    "upload_time": datetime.now().isoformat()
-                }
-            })
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Неизвестная ошибка обработки shapefile"))
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка обработки ZIP архива: {str(e)}")
+        await save_upload_file(file, component_path)
+        session_id, shp_path, missing = await run_in_threadpool(
+            add_session_component, SHAPEFILE_DIR, session_id, file.filename, component_path
+        )
+    except UploadSessionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if os.path.exists(component_path):
+            os.remove(component_path)
+
+    logger.info("Обработка Shapefile компонента: %s (сессия %s)", file.filename, session_id)
+
+    if missing:
+        return JSONResponse({
+            "status": "waiting_for_components",
+            "message": "Загружены не все компоненты shapefile",
+            "session_id": session_id,
+            "received_files": await run_in_threadpool(get_session_components, get_session_dir(SHAPEFILE_DIR, session_id)),
+            "missing_files": missing
+        })
 
-async def process_single_shapefile_component(file_path: str, session_dir: str, original_filename: str):
-    """Обрабатывает отдельный компонент shapefile"""
     try:
-        # Для отдельных компонентов shapefile, мы ожидаем, что все файлы будут загружены
-        # в одну сессионную папку. Ищем .shp файл в этой папке.
-        shp_file = None
-        for file in os.listdir(session_dir):
-            if file.lower().endswith('.shp'):
-                shp_file = os.path.join(session_dir, file)
-                break
-        
-        if not shp_file:
-            # Если .shp файл еще не загружен, сообщаем пользователю
-            current_files = [f for f in os.listdir(session_dir)]
-            return JSONResponse({
-                "status": "waiting_for_components",
-                "message": "Загружены не все компоненты shapefile",
-                "current_files": current_files,
-                "required_files": [".shp", ".shx", ".dbf", ".prj"]
-            })
-        
-        # Обрабатываем shapefile
-        result = process_shapefile(shp_file, original_filename)
-        
-        if result.get("success"):
-            return JSONResponse({
-                **result["plotly_data"],
-                "file_info": {
-                    "original_filename": original_filename,
-                    "file_type": "shapefile",
-                    "regions_count": result.get("regions_count", 0),
-                    "database_updated": result.get("database_updated", False),
-                    "upload_time": datetime.now().isoformat()
-                }
-            })
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Неизвестная ошибка обработки shapefile"))
-        
+        result = await run_in_db_thread(process_shapefile, shp_path, file.filename)
+        response = shapefile_result_response(result, file.filename, "shapefile")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка обработки shapefile: {str(e)}")
 
+    await run_in_threadpool(remove_session, SHAPEFILE_DIR, session_id)
+    return response
+
 async def process_flight_data_handler(file: UploadFile):
     """Обработчик файлов с данными о полетах - всегда перезаписывает один файл"""
+    from flight_data_processor import process_flight_data_excel
+
     # Всегда сохраняем как flights_data.xlsx (ПЕРЕЗАПИСЫВАЕМ!)
     file_extension = os.path.splitext(file.filename)[1]
     file_path = os.path.join(FLIGHT_DATA_DIR, f"flights_data{file_extension}")
 
     try:
-        # Читаем и сохраняем файл (ПЕРЕЗАПИСЫВАЕМ!)
-        content = await file.read()
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
+        # Сохраняем файл потоково (ПЕРЕЗАПИСЫВАЕМ!)
+        content_hash, file_size = await save_upload_file(file, file_path)
 
-        print(f"Обработка файла с данными о полетах: {file.filename}")
+        logger.info("Обработка файла с данными о полетах: %s", file.filename)
         
         # Обрабатываем данные о полетах
-        result = process_flight_data_excel(file_path, file.filename)
+        result = await run_in_db_thread(process_flight_data_excel, file_path, file.filename)
+        result["file_info"] = {"md5": content_hash, "size_bytes": file_size}
         
         return result
         
@@ -480,45 +765,9 @@ async def process_flight_data_handler(file: UploadFile):
         if os.path.exists(file_path):
             os.remove(file_path)
         
-        error_details = traceback.format_exc()
-        print(f"Ошибка обработки файла с данными о полетах: {str(e)}")
-        print(f"Детали ошибки: {error_details}")
+        logger.exception("Ошибка обработки файла с данными о полетах: %s", e)
         
         return {
             "success": False,
             "error": f"Ошибка обработки файла с данными о полетах: {str(e)}"
         }
-    
-async def save_geojson_to_database(geojson_data):
-    engine = create_engine(DB_URL)
-    with engine.connect() as conn:
-        # Создаём таблицу, если не существует
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS russia_regions (
-                id SERIAL PRIMARY KEY,
-                region VARCHAR(200) NOT NULL,
-                area_sq_km NUMERIC(12, 2),
-                geometry GEOMETRY(Geometry, 4326)
-            );
-        """))
-        conn.execute(text("TRUNCATE TABLE russia_regions RESTART IDENTITY;"))
-        conn.commit()
-
-        # Вставляем регионы
-        for feature in geojson_data['features']:
-            region_name = feature['properties'].get('region', 'Неизвестный регион')
-            geometry_json = json.dumps(feature['geometry'])
-            conn.execute(text("""
-                INSERT INTO russia_regions (region, area_sq_km, geometry)
-                VALUES (
-                    :region_name,
-                    ST_Area(ST_GeomFromGeoJSON(:geometry)::geography) / 1000000.0,
-                    ST_GeomFromGeoJSON(:geometry)
-                )
-            """), {
-                'region_name': region_name,
-                'geometry': geometry_json
-            })
-        conn.execute(text("UPDATE russia_regions SET area_sq_km = ROUND(area_sq_km, 2)"))
-        conn.commit()
-    print("✅ Таблица russia_regions обновлена из GeoJSON")
\ No newline at end of file
@@ -3,264 +3,244 @@
 import pandas as pd
 import numpy as np
 import geopandas as gpd
+import shapely
 from shapely.ops import snap, unary_union
 from shapely.geometry.polygon import Polygon
 from shapely.geometry.multipolygon import MultiPolygon
-from tqdm import tqdm
 import plotly.graph_objects as go
 from shapely.geometry import Point
 import plotly.express as px
 import os
+import time
 import logging
 import json
 import hashlib
-
-# Настройка логирования в файл
-logging.basicConfig(
-    filename='geometry_processing.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
-# Директория для кэшированных карт
-CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
-os.makedirs(CACHE_DIR, exist_ok=True)
-
-def get_file_hash(geojson_data):
-    """Генерирует хэш для GeoJSON данных"""
-    content = json.dumps(geojson_data, sort_keys=True)
-    return hashlib.md5(content.encode()).hexdigest()
-
-def get_cached_map(file_hash):
-    """Пытается получить кэшированную карту"""
-    cache_file = os.path.join(CACHE_DIR, f"{file_hash}.json")
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                logging.info(f"Загружена кэшированная карта: {file_hash}")
-                return json.load(f)
-        except Exception as e:
-            logging.warning(f"Ошибка загрузки кэша: {e}")
-    return None
-
-def save_map_to_cache(file_hash, plotly_data):
-    """Сохраняет карту в кэш"""
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from config import AREA_THRESHOLD, SIMPLIFY_TOLERANCE, MAP_LEVELS, DEFAULT_MAP_LEVEL
+from config import SNAP_DISTANCE, SNAP_TOLERANCE, GEOMETRY_WORKERS, PARALLEL_MIN_FEATURES
+from logging_config import ProgressLogger
+# Кэш карт вынесен в map_cache, имена остаются доступны из map_builder
+from map_cache import get_file_hash, hash_files, get_cache_key, get_map_levels, get_level_for_zoom
+from map_cache import get_cache_file, get_cached_map, get_trace_names, get_last_map_info, set_last_map
+from map_cache import update_last_map_info, get_active_cached_map, save_map_to_cache, evict_map_cache
+from map_cache import clear_cache, get_last_map
+
+logger = logging.getLogger(__name__)
+
+# Идентификаторы типов геометрий shapely.get_type_id
+POLYGON_TYPE_ID = 3
+MULTIPOLYGON_TYPE_ID = 6
+
+@contextmanager
+def timed_stage(timings, stage):
+    """Накапливает время выполнения этапа в словаре timings (если он передан)"""
+    started = time.perf_counter()
     try:
-        cache_file = os.path.join(CACHE_DIR, f"{file_hash}.json")
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(plotly_data, f, ensure_ascii=False)
-        logging.info(f"Карта сохранена в кэш: {file_hash}")
-        
-        # Сохраняем информацию о последнем файле
-        last_file_info = {
-            'file_hash': file_hash,
-            'timestamp': pd.Timestamp.now().isoformat()
-        }
-        with open(os.path.join(CACHE_DIR, 'last_map.json'), 'w', encoding='utf-8') as f:
-            json.dump(last_file_info, f, ensure_ascii=False)
-    except Exception as e:
-        logging.error(f"Ошибка сохранения кэша: {e}")
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
 
-def get_last_map():
-    """Возвращает данные последней обработанной карты"""
-    try:
-        last_file_path = os.path.join(CACHE_DIR, 'last_map.json')
-        if os.path.exists(last_file_path):
-            with open(last_file_path, 'r', encoding='utf-8') as f:
-                last_info = json.load(f)
-            
-            cache_file = os.path.join(CACHE_DIR, f"{last_info['file_hash']}.json")
-            if os.path.exists(cache_file):
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    logging.info("Загружена последняя карта из кэша")
-                    return json.load(f)
-    except Exception as e:
-        logging.warning(f"Ошибка загрузки последней карты: {e}")
-    return None
-
-def process_geojson_file(geojson_data):
+def filter_small_polygons(geoms, area_thr):
     """
-    Обрабатывает GeoJSON данные и возвращает Plotly-совместимый словарь
+    Удаляет из мультиполигонов части с площадью <= area_thr (векторно, shapely 2).
+    Одиночные полигоны остаются без изменений.
     """
-    try:
-        # Проверяем кэш
-        file_hash = get_file_hash(geojson_data)
-        cached_map = get_cached_map(file_hash)
-        if cached_map:
-            return cached_map
-
-        logging.info("Начало обработки GeoJSON данных")
-        
-        # Создаем GeoDataFrame из переданных данных
-        gdf = gpd.GeoDataFrame.from_features(geojson_data['features'])
-        logging.info(f"Загружено {len(gdf)} регионов из GeoJSON")
-
-        # Определяем поле с названием региона
-        region_column = None
-        for col in ['region', 'name', 'NAME', 'REGION', 'title', 'properties']:
-            if col in gdf.columns:
-                region_column = col
-                break
-        
-        if region_column:
-            if region_column == 'properties':
-                # Если есть поле properties, извлекаем название из него
-                gdf['region'] = gdf['properties'].apply(
-                    lambda x: x.get('name') or x.get('region') or x.get('NAME') or 'Неизвестный регион'
-                )
-            else:
-                gdf['region'] = gdf[region_column]
-        else:
-            # Если нет подходящего поля, создаем свои названия
-            gdf['region'] = [f"Регион_{i}" for i in range(len(gdf))]
-        
-        logging.info(f"Используется поле для названий регионов: {region_column}")
-
-        # Устанавливаем CRS если его нет (предполагаем WGS84 для GeoJSON)
-        if gdf.crs is None:
-            gdf.set_crs('EPSG:4326', inplace=True)
-            logging.info("Установлена система координат EPSG:4326")
-        else:
-            logging.info(f"Исходная система координат: {gdf.crs}")
-
-        # Перевод в систему координат EPSG:32646
-        gdf = gdf.to_crs('EPSG:32646')
-        logging.info("Переведено в EPSG:32646")
-
-        # Подготовка регионов
-        regions = prepare_regions(gdf)
-
-        # Преобразование геометрии для Plotly
-        tqdm.pandas(desc='Преобразование геометрии')
-        regions[['x', 'y']] = regions.geometry.progress_apply(geom2shape)
-        logging.info("Геометрии преобразованы в x, y")
-
-        # Создание карты
-        fig = create_map_figure(regions)
-        logging.info("Карта успешно создана")
-
-        # Сохраняем результат
-        plotly_data = fig.to_dict()
-        save_map_to_cache(file_hash, plotly_data)
-
-        return plotly_data
-
-    except Exception as e:
-        logging.error(f"Ошибка обработки GeoJSON: {str(e)}")
-        import traceback
-        logging.error(traceback.format_exc())
-        raise
-
-
-def prepare_regions(gdf, area_thr=100e6, simplify_tol=500):
+    geoms = np.asarray(geoms, dtype=object)
+    result = geoms.copy()
+    multi_idx = np.flatnonzero(shapely.get_type_id(geoms) == MULTIPOLYGON_TYPE_ID)
+    if len(multi_idx) == 0:
+        return result
+
+    parts, part_idx = shapely.get_parts(geoms[multi_idx], return_index=True)
+    keep = shapely.area(parts) > area_thr
+    removed = int((~keep).sum())
+    if removed:
+        logger.info("Удалено %s полигонов с площадью <= %s", removed, area_thr)
+
+    # Мультиполигоны, у которых не осталось частей, становятся пустыми (как и раньше)
+    out = np.array([shapely.from_wkt('MULTIPOLYGON EMPTY')] * len(multi_idx), dtype=object)
+    result[multi_idx] = shapely.multipolygons(parts[keep], indices=part_idx[keep], out=out)
+    return result
+
+def _snap_to_neighbours(geom, neighbours):
+    """Притягивает границы геометрии к соседям (в порядке их индексов)"""
+    for neighbour in neighbours:
+        if geom.distance(neighbour) < SNAP_DISTANCE:
+            geom = snap(geom, neighbour, SNAP_TOLERANCE)
+    return geom
+
+def _snap_chunk(chunk):
+    """Задача для пула процессов: пары (геометрия, соседи) -> притянутые геометрии"""
+    return [_snap_to_neighbours(geom, neighbours) for geom, neighbours in chunk]
+
+def get_snap_waves(neighbours):
+    """
+    Порядок параллельного объединения границ: регион попадает в волну после всех
+    соседей с меньшим индексом, поэтому внутри волны регионы независимы.
+    """
+    wave_of = [0] * len(neighbours)
+    for i, region_neighbours in enumerate(neighbours):
+        previous = [wave_of[j] + 1 for j in region_neighbours if j < i]
+        wave_of[i] = max(previous, default=0)
+    waves = [[] for _ in range(max(wave_of, default=-1) + 1)]
+    for i, wave in enumerate(wave_of):
+        waves[wave].append(i)
+    return waves
+
+def snap_boundaries(geoms, workers=GEOMETRY_WORKERS):
+    """
+    Объединение границ соседних регионов.
+    Кандидаты в соседи ищутся через STRtree вместо полного перебора пар.
+    Каждый регион притягивается к уже обработанным соседям с меньшим индексом и к
+    исходным - с большим. При workers > 1 и большом числе регионов независимые
+    регионы (волны) обрабатываются в пуле процессов в том же порядке зависимостей,
+    поэтому результат не зависит от GEOMETRY_WORKERS.
+    """
+    geoms = np.asarray(geoms, dtype=object).copy()
+
+    # Запас на смещение вершин соседей, уже притянутых на предыдущих шагах
+    tree = shapely.STRtree(geoms)
+    left, right = tree.query(geoms, predicate='dwithin', distance=SNAP_DISTANCE + 2 * SNAP_TOLERANCE)
+    neighbours = [[] for _ in range(len(geoms))]
+    for i, j in sorted(zip(left.tolist(), right.tolist())):
+        if i != j:
+            neighbours[i].append(j)
+
+    if workers > 1 and len(geoms) >= PARALLEL_MIN_FEATURES:
+        waves = get_snap_waves(neighbours)
+        progress = ProgressLogger(logger, "Объединение границ", total=len(geoms))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for wave in waves:
+                tasks = [(geoms[i], [geoms[j] for j in neighbours[i]]) for i in wave]
+                if len(tasks) < workers * 2:
+                    # Маленькую волну дешевле обработать в текущем процессе
+                    snapped = _snap_chunk(tasks)
+                else:
+                    chunk_size = max(1, len(tasks) // (workers * 4))
+                    chunks = [tasks[k:k + chunk_size] for k in range(0, len(tasks), chunk_size)]
+                    snapped = [geom for chunk in executor.map(_snap_chunk, chunks) for geom in chunk]
+                for i, geom in zip(wave, snapped):
+                    geoms[i] = geom
+                progress.update(len(wave))
+        progress.done()
+        return geoms
+
+    progress = ProgressLogger(logger, "Объединение границ", total=len(geoms))
+    for i in range(len(geoms)):
+        geoms[i] = _snap_to_neighbours(geoms[i], [geoms[j] for j in neighbours[i]])
+        progress.update()
+    progress.done()
+    return geoms
+
+def prepare_regions(gdf, area_thr=AREA_THRESHOLD, simplify_tol=SIMPLIFY_TOLERANCE,
+                    workers=GEOMETRY_WORKERS, timings=None):
     """
     Подготовка регионов: фильтрация, упрощение, объединение границ
     """
     gdf_ = gdf.copy()
 
     # Вычисление площади
-    gdf_['area'] = gdf_.geometry.apply(lambda x: x.area)
-    logging.info("Вычислена площадь регионов")
+    with timed_stage(timings, 'area'):
+        gdf_['area'] = gdf_.geometry.area
+    logger.info("Вычислена площадь регионов")
 
     # Удаление мелких полигонов
-    tqdm.pandas(desc='Удаление мелких полигонов')
-    def filter_small_polys(geometry):
-        if geometry.geom_type == 'MultiPolygon':
-            small_polys = [p for p in geometry.geoms if p.area <= area_thr]
-            if small_polys:
-                logging.info(f"Удалено {len(small_polys)} полигонов с площадью <= {area_thr}")
-            return MultiPolygon([p for p in geometry.geoms if p.area > area_thr])
-        return geometry
-    
-    gdf_.geometry = gdf_.geometry.progress_apply(filter_small_polys)
-    logging.info("Мелкие полигоны удалены")
+    with timed_stage(timings, 'filter_small'):
+        gdf_.geometry = filter_small_polygons(gdf_.geometry.values, area_thr)
+    logger.info("Мелкие полигоны удалены")
 
     # Упрощение геометрии
-    gdf_.geometry = gdf_.geometry.simplify(simplify_tol)
-    logging.info(f"Геометрия упрощена с допуском {simplify_tol}")
-
-    # Объединение границ (упрощенная версия для производительности)
-    logging.info("Начало объединения границ")
-    geoms = gdf_.geometry.values
-    for i in tqdm(range(len(geoms)), desc='Объединение границ'):
-        g1 = geoms[i]
-        for j in range(len(geoms)):
-            if i != j and g1.distance(geoms[j]) < 100:
-                g1 = snap(g1, geoms[j], 800)
-        geoms[i] = g1
-    gdf_.geometry = geoms
-    logging.info("Границы объединены")
+    with timed_stage(timings, 'simplify'):
+        gdf_.geometry = gdf_.geometry.simplify(simplify_tol)
+    logger.info("Геометрия упрощена с допуском %s", simplify_tol)
+
+    # Объединение границ
+    logger.info("Начало объединения границ")
+    with timed_stage(timings, 'snap'):
+        gdf_.geometry = snap_boundaries(gdf_.geometry.values, workers=workers)
+    logger.info("Границы объединены")
 
     # Сортировка по площади
     gdf_ = gdf_.sort_values(by='area', ascending=False).reset_index(drop=True)
-    logging.info("Регионы отсортированы")
+    logger.info("Регионы отсортированы")
 
     return gdf_.drop(columns=['area'])
 
+def geoms_to_xy(geoms):
+    """
+    Векторное преобразование геометрий в координаты для Plotly: внешние кольца
+    всех полигонов региона, разделенные None. Заменяет построчный geom2shape.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    x_lists = [[] for _ in range(len(geoms))]
+    y_lists = [[] for _ in range(len(geoms))]
+
+    type_ids = shapely.get_type_id(geoms)
+    polygonal = np.flatnonzero((type_ids == POLYGON_TYPE_ID) | (type_ids == MULTIPOLYGON_TYPE_ID))
+    if len(polygonal) == 0:
+        return x_lists, y_lists
+
+    parts, part_idx = shapely.get_parts(geoms[polygonal], return_index=True)
+    rings = shapely.get_exterior_ring(parts)
+    coords, ring_idx = shapely.get_coordinates(rings, return_index=True)
+    offsets = np.searchsorted(ring_idx, np.arange(len(rings) + 1))
+    xs = coords[:, 0].tolist()
+    ys = coords[:, 1].tolist()
+
+    for ring, row in enumerate(polygonal[part_idx].tolist()):
+        start, end = offsets[ring], offsets[ring + 1]
+        if start == end:
+            continue
+        if x_lists[row]:
+            x_lists[row].append(None)
+            y_lists[row].append(None)
+        x_lists[row].extend(xs[start:end])
+        y_lists[row].extend(ys[start:end])
+
+    return x_lists, y_lists
+
 def geom2shape(g):
     """
     Преобразование геометрии в координаты для Plotly
     """
-    try:
-        if g.geom_type == 'MultiPolygon':
-            x, y = [], []
-            for poly in g.geoms:
-                if poly.exterior:
-                    x_, y_ = poly.exterior.coords.xy
-                    x.extend(x_)
-                    y.extend(y_)
-                    x.append(None)
-                    y.append(None)
-            if x and y:
-                x = x[:-1]  # Убираем последний None
-                y = y[:-1]
-            return pd.Series([x, y])
-        elif g.geom_type == 'Polygon':
-            if g.exterior:
-                x, y = g.exterior.coords.xy
-                return pd.Series([list(x), list(y)])
-        return pd.Series([[], []])
-    except Exception as e:
-        logging.warning(f"Ошибка преобразования геометрии: {e}")
-        return pd.Series([[], []])
+    x, y = geoms_to_xy([g])
+    return pd.Series([x[0], y[0]])
 
 def create_map_figure(regions):
     """
-    Создание Plotly figure из данных регионов
+    Создание Plotly figure (в виде словаря) из данных регионов.
+    Трассы собираются готовыми словарями: валидация go.Scatter на тысячах
+    регионов занимает больше времени, чем вся обработка геометрии.
     """
-    fig = go.Figure()
-
     # Выбор палитры Plotly
     colors = px.colors.qualitative.Plotly
     num_colors = len(colors)
 
     # Отрисовка регионов
-    for i, r in regions.iterrows():
+    traces = []
+    for i, r in enumerate(regions[['region', 'x', 'y']].itertuples(index=False)):
         # Проверяем, что есть данные для отрисовки
         if len(r.x) > 0 and len(r.y) > 0:
             region_color = colors[i % num_colors]
-            fig.add_trace(go.Scatter(
-                x=r.x,
-                y=r.y,
-                name=r.region,
-                text=r.region,
-                hoverinfo="text",
-                line_color='black',
-                fill='toself',
-                line_width=1,
-                fillcolor=region_color,
-                showlegend=False,
-                hovertemplate=f'<b>{r.region}</b><extra></extra>',
-                hoverlabel=dict(
-                    bgcolor='white',
-                    font=dict(color='black')
-                ),
-                hoveron='fills',
-                line=dict(
-                    color='grey',
-                    width=1
-                )
-            ))
+            traces.append({
+                'type': 'scatter',
+                'x': r.x,
+                'y': r.y,
+                'name': r.region,
+                'text': r.region,
+                'hoverinfo': 'text',
+                'fill': 'toself',
+                'fillcolor': region_color,
+                'showlegend': False,
+                'hovertemplate': f'<b>{r.region}</b><extra></extra>',
+                'hoverlabel': {'bgcolor': 'white', 'font': {'color': 'black'}},
+                'hoveron': 'fills',
+                'line': {'color': 'black', 'width': 1}
+            })
+
+    fig = go.Figure()
 
     # Настройка осей
     fig.update_xaxes(visible=False)
@@ -282,155 +262,167 @@ def create_map_figure(regions):
         template='plotly_white'
     )
 
-    return fig
-
-
-# Настройка логирования в файл
-logging.basicConfig(
-    filename='geometry_processing.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
-# Директория для кэшированных карт
-CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
-os.makedirs(CACHE_DIR, exist_ok=True)
-
-def get_file_hash(geojson_data):
-    """Генерирует хэш для GeoJSON данных"""
-    content = json.dumps(geojson_data, sort_keys=True)
-    return hashlib.md5(content.encode()).hexdigest()
-
-def get_cached_map(file_hash):
-    """Пытается получить кэшированную карту"""
-    cache_file = os.path.join(CACHE_DIR, f"{file_hash}.json")
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                logging.info(f"Загружена кэшированная карта: {file_hash}")
-                return json.load(f)
-        except Exception as e:
-            logging.warning(f"Ошибка загрузки кэша: {e}")
-    return None
+    figure = fig.to_dict()
+    figure['data'] = traces
+    return figure
 
-def save_map_to_cache(file_hash, plotly_data):
-    """Сохраняет карту в кэш"""
-    try:
-        cache_file = os.path.join(CACHE_DIR, f"{file_hash}.json")
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(plotly_data, f, ensure_ascii=False)
-        logging.info(f"Карта сохранена в кэш: {file_hash}")
-        
-        # Сохраняем информацию о последнем файле
-        last_file_info = {
-            'file_hash': file_hash,
-            'timestamp': pd.Timestamp.now().isoformat()
-        }
-        with open(os.path.join(CACHE_DIR, 'last_map.json'), 'w', encoding='utf-8') as f:
-            json.dump(last_file_info, f, ensure_ascii=False)
-    except Exception as e:
-        logging.error(f"Ошибка сохранения кэша: {e}")
 
-def clear_cache():
-    """Очищает кэш карт"""
-    try:
-        for file in os.listdir(CACHE_DIR):
-            if file.endswith('.json') and file != 'last_map.json':
-                os.remove(os.path.join(CACHE_DIR, file))
-        logging.info("Кэш карт очищен")
-    except Exception as e:
-        logging.error(f"Ошибка очистки кэша: {e}")
+def build_map_pyramid(regions, timings=None):
+    """
+    Строит карты всех уровней детализации из подготовленных регионов.
+    Регионы уже упрощены с самым мелким допуском, более грубые уровни
+    получаются дополнительным упрощением без повторной подготовки.
+    """
+    pyramid = {}
+    base_tol = min(MAP_LEVELS.values())
+    for level in get_map_levels():
+        tol = MAP_LEVELS[level]
+        level_regions = regions.copy()
+        if tol > base_tol:
+            with timed_stage(timings, 'simplify_levels'):
+                level_regions.geometry = level_regions.geometry.simplify(tol)
 
-def get_last_map():
-    """Возвращает данные последней обработанной карты"""
-    try:
-        last_file_path = os.path.join(CACHE_DIR, 'last_map.json')
-        if os.path.exists(last_file_path):
-            with open(last_file_path, 'r', encoding='utf-8') as f:
-                last_info = json.load(f)
-            
-            cache_file = os.path.join(CACHE_DIR, f"{last_info['file_hash']}.json")
-            if os.path.exists(cache_file):
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    logging.info("Загружена последняя карта из кэша")
-                    return json.load(f)
-    except Exception as e:
-        logging.warning(f"Ошибка загрузки последней карты: {e}")
+        # Преобразование геометрии для Plotly
+        with timed_stage(timings, 'geom2shape'):
+            level_regions['x'], level_regions['y'] = geoms_to_xy(level_regions.geometry.values)
+
+        with timed_stage(timings, 'figure'):
+            pyramid[level] = create_map_figure(level_regions)
+        logger.info("Построен уровень детализации '%s' (допуск %s)", level, tol)
+    return pyramid
+
+def get_region_names(gdf):
+    """Определяет названия регионов по подходящему полю GeoDataFrame"""
+    region_column = None
+    for col in ['region', 'name', 'NAME', 'REGION', 'title', 'properties']:
+        if col in gdf.columns:
+            region_column = col
+            break
+
+    logger.info("Используется поле для названий регионов: %s", region_column)
+
+    if region_column == 'properties':
+        # Если есть поле properties, извлекаем название из него
+        return gdf['properties'].apply(
+            lambda x: x.get('name') or x.get('region') or x.get('NAME') or 'Неизвестный регион'
+        )
+    if region_column:
+        return gdf[region_column]
+    # Если нет подходящего поля, создаем свои названия
+    return pd.Series([f"Регион_{i}" for i in range(len(gdf))], index=gdf.index)
+
+def regions_from_geojson(geojson_data, timings=None):
+    """
+    GeoJSON -> GeoDataFrame регионов (столбцы region и geometry, EPSG:4326).
+    Разбирается один раз и дальше используется для карты, БД и индекса регионов.
+    """
+    with timed_stage(timings, 'from_features'):
+        gdf = gpd.GeoDataFrame.from_features(geojson_data['features'])
+    logger.info("Загружено %s регионов из GeoJSON", len(gdf))
+
+    gdf['region'] = get_region_names(gdf)
+    regions = gdf[['region', 'geometry']]
+
+    # Устанавливаем CRS если его нет (предполагаем WGS84 для GeoJSON)
+    if regions.crs is None:
+        regions = regions.set_crs('EPSG:4326')
+        logger.info("Установлена система координат EPSG:4326")
+    else:
+        logger.info("Исходная система координат: %s", regions.crs)
+    return regions
+
+def regions_to_geojson(gdf):
+    """
+    Компактная сериализация регионов в текст GeoJSON (без отступов).
+    Геометрия пишется векторно через shapely.to_geojson.
+    """
+    geometries = shapely.to_geojson(gdf.geometry.values)
+    features = ','.join(
+        '{"type":"Feature","properties":{"region":%s},"geometry":%s}' % (
+            json.dumps(region, ensure_ascii=False), geometry if geometry is not None else 'null'
+        )
+        for region, geometry in zip(gdf['region'].tolist(), geometries.tolist())
+    )
+    return '{"type":"FeatureCollection","features":[' + features + ']}'
+
+def get_gdf_hash(gdf):
+    """Хэш регионов GeoDataFrame (если ключ по исходному файлу не передан)"""
+    digest = hashlib.md5()
+    digest.update(json.dumps(gdf['region'].astype(str).tolist(), ensure_ascii=False).encode('utf-8'))
+    for wkb in shapely.to_wkb(gdf.geometry.values):
+        digest.update(wkb or b'')
+    return digest.hexdigest()
+
+def use_cached_map(file_hash, force_refresh=False):
+    """Возвращает карту из кэша и делает ее активной (None, если ее нет)"""
+    cached_map = get_cached_map(file_hash)
+    if cached_map and not force_refresh:
+        set_last_map(file_hash, [
+            level for level in get_map_levels() if os.path.exists(get_cache_file(file_hash, level))
+        ], regions=get_trace_names(cached_map))
+        return cached_map
     return None
 
-def process_geojson_file(geojson_data, force_refresh=False):
+def build_and_cache_map(file_hash, gdf, timings=None):
+    """Строит пирамиду карт из GeoDataFrame регионов и сохраняет ее в кэш"""
+    # Перевод в систему координат EPSG:32646
+    with timed_stage(timings, 'to_crs'):
+        gdf = gdf.to_crs('EPSG:32646')
+    logger.info("Переведено в EPSG:32646")
+
+    # Подготовка регионов с самым детальным допуском пирамиды
+    regions = prepare_regions(gdf, simplify_tol=min(MAP_LEVELS.values()), timings=timings)
+
+    # Создание карт всех уровней детализации
+    pyramid = build_map_pyramid(regions, timings=timings)
+    logger.info("Карта успешно создана")
+
+    # Сохраняем результат
+    save_map_to_cache(file_hash, pyramid)
+
+    return pyramid[DEFAULT_MAP_LEVEL]
+
+def process_regions_gdf(gdf, cache_key=None, force_refresh=False, timings=None):
     """
-    Обрабатывает GeoJSON данные и возвращает Plotly-совместимый словарь
+    Строит (или берет из кэша) карту из GeoDataFrame регионов со столбцами region и geometry.
+    Аналог process_geojson_file без промежуточного GeoJSON.
     """
     try:
-        # Если force_refresh=True, очищаем кэш
-        if force_refresh:
-            clear_cache()
-
-        # Проверяем кэш
-        file_hash = get_file_hash(geojson_data)
-        cached_map = get_cached_map(file_hash)
-        if cached_map and not force_refresh:
+        file_hash = cache_key or get_cache_key(get_gdf_hash(gdf))
+        cached_map = use_cached_map(file_hash, force_refresh)
+        if cached_map:
             return cached_map
 
-        logging.info("Начало обработки GeoJSON данных")
-        
-        # Создаем GeoDataFrame из переданных данных
-        gdf = gpd.GeoDataFrame.from_features(geojson_data['features'])
-        logging.info(f"Загружено {len(gdf)} регионов из GeoJSON")
-
-        # Определяем поле с названием региона
-        region_column = None
-        for col in ['region', 'name', 'NAME', 'REGION', 'title', 'properties']:
-            if col in gdf.columns:
-                region_column = col
-                break
-        
-        if region_column:
-            if region_column == 'properties':
-                # Если есть поле properties, извлекаем название из него
-                gdf['region'] = gdf['properties'].apply(
-                    lambda x: x.get('name') or x.get('region') or x.get('NAME') or 'Неизвестный регион'
-                )
-            else:
-                gdf['region'] = gdf[region_column]
-        else:
-            # Если нет подходящего поля, создаем свои названия
-            gdf['region'] = [f"Регион_{i}" for i in range(len(gdf))]
-        
-        logging.info(f"Используется поле для названий регионов: {region_column}")
-
-        # Устанавливаем CRS если его нет (предполагаем WGS84 для GeoJSON)
+        logger.info("Начало обработки регионов")
         if gdf.crs is None:
-            gdf.set_crs('EPSG:4326', inplace=True)
-            logging.info("Установлена система координат EPSG:4326")
-        else:
-            logging.info(f"Исходная система координат: {gdf.crs}")
-
-        # Перевод в систему координат EPSG:32646
-        gdf = gdf.to_crs('EPSG:32646')
-        logging.info("Переведено в EPSG:32646")
-
-        # Подготовка регионов
-        regions = prepare_regions(gdf)
+            gdf = gdf.set_crs('EPSG:4326')
+        return build_and_cache_map(file_hash, gdf, timings)
 
-        # Преобразование геометрии для Plotly
-        tqdm.pandas(desc='Преобразование геометрии')
-        regions[['x', 'y']] = regions.geometry.progress_apply(geom2shape)
-        logging.info("Геометрии преобразованы в x, y")
+    except Exception as e:
+        logger.exception("Ошибка обработки регионов: %s", e)
+        raise
 
-        # Создание карты
-        fig = create_map_figure(regions)
-        logging.info("Карта успешно создана")
+def process_geojson_file(geojson_data, cache_key=None, force_refresh=False, timings=None):
+    """
+    Обрабатывает GeoJSON данные и возвращает Plotly-совместимый словарь.
+    За один проход строится пирамида уровней детализации (MAP_LEVELS),
+    все уровни кэшируются вместе; возвращается уровень по умолчанию.
 
-        # Сохраняем результат
-        plotly_data = fig.to_dict()
-        save_map_to_cache(file_hash, plotly_data)
+    cache_key - ключ из get_cache_key(hash_files(...)) по исходным байтам загрузки;
+    без него ключ считается по разобранным данным. force_refresh перестраивает
+    карту, не затрагивая другие версии в кэше.
+    """
+    try:
+        # Проверяем кэш
+        file_hash = cache_key or get_cache_key(get_file_hash(geojson_data))
+        cached_map = use_cached_map(file_hash, force_refresh)
+        if cached_map:
+            return cached_map
 
-        return plotly_data
+        logger.info("Начало обработки GeoJSON данных")
+        gdf = regions_from_geojson(geojson_data, timings)
+        return build_and_cache_map(file_hash, gdf, timings)
 
     except Exception as e:
-        logging.error(f"Ошибка обработки GeoJSON: {str(e)}")
-        import traceback
-        logging.error(traceback.format_exc())
-        raise
\ No newline at end of file
+        logger.exception("Ошибка обработки GeoJSON: %s", e)
+        raise
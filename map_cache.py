@@ -0,0 +1,236 @@
+# map_cache.py
+
+"""
+Кэш построенных карт и сведения об активной карте (last_map.json).
+Модуль не зависит от geopandas и plotly: эндпоинты чтения карты используют
+только его, построение карты (map_builder) импортируется при загрузке границ.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from config import AREA_THRESHOLD, MAP_LEVELS, MAP_LEVEL_MIN_ZOOM, DEFAULT_MAP_LEVEL
+from config import MAP_CACHE_MAX_SIZE, MAP_CACHE_VERSION, MAP_PAYLOAD_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Директория для кэшированных карт (создается при запуске сервера и при сохранении карты)
+CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+
+# Разобранные файлы карт в памяти процесса: путь -> ((mtime, размер), данные)
+_payloads = OrderedDict()
+_payloads_lock = threading.Lock()
+
+def read_json_cached(path):
+    """
+    Разобранный JSON файла из памяти процесса. Файл перечитывается, если изменились
+    его время изменения или размер (карту могли перестроить в другом воркере).
+    Возвращаемый объект общий для всех запросов: изменять его нельзя.
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _payloads_lock:
+        item = _payloads.get(path)
+        if item is not None and item[0] == version:
+            _payloads.move_to_end(path)
+            return item[1]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    with _payloads_lock:
+        _payloads[path] = (version, data)
+        _payloads.move_to_end(path)
+        while len(_payloads) > MAP_PAYLOAD_CACHE_SIZE:
+            _payloads.popitem(last=False)
+    return data
+
+def get_file_hash(geojson_data):
+    """Генерирует хэш для уже разобранных GeoJSON данных (если исходных байтов нет)"""
+    content = json.dumps(geojson_data, sort_keys=True)
+    return hashlib.md5(content.encode()).hexdigest()
+
+def hash_files(file_paths, chunk_size=1024 * 1024):
+    """Потоково считает md5 по исходным байтам файлов, не разбирая их содержимое"""
+    file_hash = hashlib.md5()
+    for file_path in sorted(file_paths):
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def get_cache_key(content_hash):
+    """
+    Ключ кэша карты: хэш исходных байтов + параметры обработки.
+    При изменении параметров пирамиды старые карты не переиспользуются.
+    """
+    params = json.dumps({
+        'version': MAP_CACHE_VERSION,
+        'area_thr': AREA_THRESHOLD,
+        'levels': MAP_LEVELS,
+        'crs': 'EPSG:32646'
+    }, sort_keys=True)
+    return hashlib.md5(f"{content_hash}:{params}".encode()).hexdigest()
+
+def get_map_levels():
+    """Возвращает уровни детализации карты от грубого к детальному"""
+    return sorted(MAP_LEVELS, key=lambda level: MAP_LEVELS[level], reverse=True)
+
+def get_level_for_zoom(zoom):
+    """Подбирает уровень детализации для коэффициента увеличения карты"""
+    best_level = get_map_levels()[0]
+    for level in get_map_levels():
+        if zoom >= MAP_LEVEL_MIN_ZOOM.get(level, 1):
+            best_level = level
+    return best_level
+
+def get_cache_file(file_hash, level=None):
+    """Путь к файлу кэша для уровня детализации (уровень по умолчанию хранится без суффикса)"""
+    if level is None or level == DEFAULT_MAP_LEVEL:
+        return os.path.join(CACHE_DIR, f"{file_hash}.json")
+    return os.path.join(CACHE_DIR, f"{file_hash}.{level}.json")
+
+def get_cached_map(file_hash, level=None):
+    """Пытается получить кэшированную карту"""
+    cache_file = get_cache_file(file_hash, level)
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached_map = json.load(f)
+            # Отмечаем использование для вытеснения по LRU
+            os.utime(cache_file)
+            logger.info("Загружена кэшированная карта: %s (уровень: %s)", file_hash, level or DEFAULT_MAP_LEVEL)
+            return cached_map
+        except Exception as e:
+            logger.warning("Ошибка загрузки кэша: %s", e)
+    return None
+
+def get_trace_names(plotly_data):
+    """Названия регионов в порядке трасс карты"""
+    return [trace.get('name') for trace in plotly_data.get('data', [])]
+
+def get_last_map_info():
+    """Возвращает сведения о последней (активной) карте из last_map.json"""
+    last_file_path = os.path.join(CACHE_DIR, 'last_map.json')
+    if os.path.exists(last_file_path):
+        try:
+            # Копия: вызывающий код дополняет сведения (update_last_map_info)
+            return dict(read_json_cached(last_file_path))
+        except Exception as e:
+            logger.warning("Ошибка чтения last_map.json: %s", e)
+    return None
+
+def set_last_map(file_hash, levels, **extra_info):
+    """Делает карту последней (активной)"""
+    last_file_info = {
+        'file_hash': file_hash,
+        'levels': list(levels),
+        'timestamp': datetime.now().isoformat(),
+        **extra_info
+    }
+    with open(os.path.join(CACHE_DIR, 'last_map.json'), 'w', encoding='utf-8') as f:
+        json.dump(last_file_info, f, ensure_ascii=False)
+
+def update_last_map_info(**extra_info):
+    """Дополняет сведения об активной карте (например, результатом загрузки в БД)"""
+    last_info = get_last_map_info()
+    if last_info:
+        last_info.update(extra_info)
+        with open(os.path.join(CACHE_DIR, 'last_map.json'), 'w', encoding='utf-8') as f:
+            json.dump(last_info, f, ensure_ascii=False)
+
+def get_active_cached_map(file_hash, boundary_state):
+    """
+    Возвращает кэшированную карту, если эти же границы уже активны и загружены в БД.
+    В этом случае повторная загрузка файла не требует ни разбора JSON, ни записи в БД.
+    boundary_state - текущее состояние границ в базе (storage.get_boundary_state):
+    оно должно совпасть с сохраненным при загрузке, иначе (другая или пустая база,
+    границы сменились) файл загружается заново.
+    """
+    last_info = get_last_map_info()
+    if not last_info or last_info.get('file_hash') != file_hash or not last_info.get('database_updated'):
+        return None
+    if boundary_state is None or last_info.get('boundary_state') != boundary_state:
+        return None
+    return get_cached_map(file_hash)
+
+def save_map_to_cache(file_hash, pyramid):
+    """Сохраняет все уровни детализации карты в кэш"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for level, plotly_data in pyramid.items():
+            with open(get_cache_file(file_hash, level), 'w', encoding='utf-8') as f:
+                json.dump(plotly_data, f, ensure_ascii=False)
+        logger.info("Карта сохранена в кэш: %s (уровни: %s)", file_hash, ', '.join(pyramid))
+        
+        # Сохраняем информацию о последнем файле и порядок регионов для раскраски (map_style)
+        set_last_map(file_hash, pyramid, regions=get_trace_names(pyramid[DEFAULT_MAP_LEVEL]))
+
+        # Старые версии границ вытесняются только при превышении бюджета
+        evict_map_cache()
+    except Exception as e:
+        logger.error("Ошибка сохранения кэша: %s", e)
+
+def evict_map_cache(max_size=MAP_CACHE_MAX_SIZE):
+    """
+    Вытесняет давно не использованные карты (LRU по времени изменения файлов),
+    пока суммарный размер кэша не уложится в max_size. Активная карта не удаляется.
+    """
+    try:
+        last_info = get_last_map_info() or {}
+        active_hash = last_info.get('file_hash')
+
+        # Группируем файлы уровней по ключу кэша: <hash>.json, <hash>.<level>.json
+        entries = {}
+        for file in os.listdir(CACHE_DIR):
+            if not file.endswith('.json') or file == 'last_map.json':
+                continue
+            path = os.path.join(CACHE_DIR, file)
+            stat = os.stat(path)
+            entry = entries.setdefault(file.split('.')[0], {'size': 0, 'used': 0, 'files': []})
+            entry['size'] += stat.st_size
+            entry['used'] = max(entry['used'], stat.st_mtime)
+            entry['files'].append(path)
+
+        total_size = sum(entry['size'] for entry in entries.values())
+        for file_hash, entry in sorted(entries.items(), key=lambda item: item[1]['used']):
+            if total_size <= max_size:
+                break
+            if file_hash == active_hash:
+                continue
+            for path in entry['files']:
+                os.remove(path)
+            total_size -= entry['size']
+            logger.info("Карта вытеснена из кэша: %s", file_hash)
+    except Exception as e:
+        logger.error("Ошибка вытеснения кэша: %s", e)
+
+def clear_cache():
+    """Очищает кэш карт"""
+    try:
+        for file in os.listdir(CACHE_DIR):
+            if file.endswith('.json') and file != 'last_map.json':
+                os.remove(os.path.join(CACHE_DIR, file))
+        logger.info("Кэш карт очищен")
+    except Exception as e:
+        logger.error("Ошибка очистки кэша: %s", e)
+
+def get_last_map(level=None):
+    """Возвращает данные последней обработанной карты нужного уровня детализации"""
+    try:
+        last_info = get_last_map_info()
+        if last_info:
+            # Карты, построенные до появления пирамиды, содержат только уровень по умолчанию
+            if level not in last_info.get('levels', [DEFAULT_MAP_LEVEL]):
+                level = DEFAULT_MAP_LEVEL
+            
+            cache_file = get_cache_file(last_info['file_hash'], level)
+            if os.path.exists(cache_file):
+                logger.debug("Последняя карта из кэша (уровень: %s)", level or DEFAULT_MAP_LEVEL)
+                return read_json_cached(cache_file)
+    except Exception as e:
+        logger.warning("Ошибка загрузки последней карты: %s", e)
+    return None
@@ -0,0 +1,109 @@
+# map_style.py
+
+import logging
+import numpy as np
+from metrics_calculator import BasicMetricsCalculator
+from map_cache import get_last_map_info, get_last_map, get_trace_names
+from config import DB_URL
+
+logger = logging.getLogger(__name__)
+
+# Метрики из region_basic_metrics, по которым можно раскрашивать карту
+STYLE_METRICS = (
+    "flight_count",
+    "avg_duration_minutes",
+    "total_duration_minutes",
+    "peak_load_per_hour",
+    "avg_daily_flights",
+    "median_daily_flights",
+    "flight_density",
+)
+
+BIN_METHODS = ("quantile", "equal")
+
+# Последовательная палитра YlOrRd (ColorBrewer), из нее выбираются цвета классов
+STYLE_PALETTE = [
+    "#ffffcc", "#ffeda0", "#fed976", "#feb24c", "#fd8d3c",
+    "#fc4e2a", "#e31a1c", "#bd0026", "#800026",
+]
+NO_DATA_COLOR = "#d9d9d9"
+MIN_CLASSES = 2
+MAX_CLASSES = len(STYLE_PALETTE)
+
+
+def normalize_region_name(name):
+    """Нормализует название региона для сопоставления карты и метрик"""
+    return " ".join(str(name).lower().split()) if name else ""
+
+
+def get_map_region_names():
+    """Названия регионов в порядке трасс активной карты"""
+    last_info = get_last_map_info() or {}
+    if last_info.get("regions"):
+        return last_info["regions"]
+
+    # Карты, построенные до разделения геометрии и стиля, не хранят порядок регионов
+    last_map = get_last_map()
+    return get_trace_names(last_map) if last_map else []
+
+
+def get_palette(classes):
+    """Выбирает равномерно распределенные цвета палитры для заданного числа классов"""
+    indexes = np.linspace(0, len(STYLE_PALETTE) - 1, classes).round().astype(int)
+    return [STYLE_PALETTE[i] for i in indexes]
+
+
+def compute_bins(values, method="quantile", classes=5):
+    """Возвращает границы классов для значений метрики"""
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return []
+
+    if method == "quantile":
+        edges = np.quantile(values, np.linspace(0, 1, classes + 1))
+    else:
+        edges = np.linspace(values.min(), values.max(), classes + 1)
+
+    # Повторяющиеся границы (например, много регионов без полетов) схлопываются
+    return [round(float(edge), 4) for edge in np.unique(edges)]
+
+
+def get_map_style(metric, bins="quantile", classes=5, db_url=DB_URL):
+    """
+    Рассчитывает раскраску активной карты по метрике из region_basic_metrics.
+    Возвращает только цвета и значения в порядке трасс карты, без геометрии.
+    """
+    region_names = get_map_region_names()
+
+    calculator = BasicMetricsCalculator(db_url)
+    metrics_by_name = {
+        normalize_region_name(row["region_name"]): row[metric]
+        for row in calculator.get_all_regions_metrics()
+    }
+
+    values = [metrics_by_name.get(normalize_region_name(name)) for name in region_names]
+    known_values = [value for value in values if value is not None]
+
+    edges = compute_bins(known_values, bins, classes)
+    palette = get_palette(max(len(edges) - 1, 1))
+
+    fillcolor = []
+    for value in values:
+        if value is None:
+            fillcolor.append(NO_DATA_COLOR)
+        else:
+            class_index = int(np.searchsorted(edges[1:-1], value, side="right"))
+            fillcolor.append(palette[class_index])
+
+    logger.info("Рассчитана раскраска карты по метрике %s (%s, %s классов)", metric, bins, len(palette))
+
+    return {
+        "metric": metric,
+        "bins": bins,
+        "edges": edges,
+        "palette": palette,
+        "no_data_color": NO_DATA_COLOR,
+        "regions": region_names,
+        "values": values,
+        "fillcolor": fillcolor
+    }
@@ -1,7 +1,9 @@
 # metrics_calculator.py
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import logging
+from storage import get_storage
+from logging_config import ProgressLogger
 from config import DB_URL
 
 logger = logging.getLogger(__name__)
@@ -9,14 +11,15 @@ logger = logging.getLogger(__name__)
 class BasicMetricsCalculator:
     def __init__(self, db_url=DB_URL):
         self.db_url = db_url
-        self.engine = create_engine(db_url)
+        self.storage = get_storage(db_url)
+        self.engine = self.storage.engine
 
     def create_basic_metrics_table(self):
         """Создает таблицу для хранения метрик по регионам"""
         with self.engine.connect() as conn:
-            conn.execute(text("""
+            conn.execute(text(f"""
                 CREATE TABLE IF NOT EXISTS region_basic_metrics (
-                    id SERIAL PRIMARY KEY,
+                    id {self.storage.serial_primary_key},
                     region_id INTEGER REFERENCES russia_regions(id),
                     region_name VARCHAR(200) NOT NULL,
                     flight_count INTEGER DEFAULT 0,
@@ -53,10 +56,10 @@ class BasicMetricsCalculator:
                 return 0
             
             result = conn.execute(text("""
-                SELECT EXTRACT(HOUR FROM CAST(takeoff_time AS TIME)) as hour, COUNT(*) as hourly_count
+                SELECT CAST(substr(takeoff_time, 1, 2) AS INTEGER) as hour, COUNT(*) as hourly_count
                 FROM flights 
                 WHERE takeoff_region_id = :region_id AND dof = :peak_date
-                GROUP BY EXTRACT(HOUR FROM CAST(takeoff_time AS TIME))
+                GROUP BY CAST(substr(takeoff_time, 1, 2) AS INTEGER)
                 ORDER BY hourly_count DESC
                 LIMIT 1
             """), {'region_id': region_id, 'peak_date': peak_day[0]})
@@ -115,10 +118,10 @@ class BasicMetricsCalculator:
         with self.engine.connect() as conn:
             result = conn.execute(text("""
                 SELECT 
-                    COUNT(CASE WHEN EXTRACT(HOUR FROM CAST(takeoff_time AS TIME)) BETWEEN 6 AND 11 THEN 1 END) as morning,
-                    COUNT(CASE WHEN EXTRACT(HOUR FROM CAST(takeoff_time AS TIME)) BETWEEN 12 AND 17 THEN 1 END) as day,
-                    COUNT(CASE WHEN EXTRACT(HOUR FROM CAST(takeoff_time AS TIME)) BETWEEN 18 AND 23 THEN 1 END) as evening,
-                    COUNT(CASE WHEN EXTRACT(HOUR FROM CAST(takeoff_time AS TIME)) BETWEEN 0 AND 5 THEN 1 END) as night
+                    COUNT(CASE WHEN CAST(substr(takeoff_time, 1, 2) AS INTEGER) BETWEEN 6 AND 11 THEN 1 END) as morning,
+                    COUNT(CASE WHEN CAST(substr(takeoff_time, 1, 2) AS INTEGER) BETWEEN 12 AND 17 THEN 1 END) as day,
+                    COUNT(CASE WHEN CAST(substr(takeoff_time, 1, 2) AS INTEGER) BETWEEN 18 AND 23 THEN 1 END) as evening,
+                    COUNT(CASE WHEN CAST(substr(takeoff_time, 1, 2) AS INTEGER) BETWEEN 0 AND 5 THEN 1 END) as night
                 FROM flights 
                 WHERE takeoff_region_id = :region_id 
                   AND takeoff_time IS NOT NULL
@@ -133,22 +136,22 @@ class BasicMetricsCalculator:
 
     def calculate_basic_metrics(self):
         """Рассчитывает и сохраняет метрики по регионам"""
-        print("🔄 Создание таблицы для метрик...")
+        logger.debug("🔄 Создание таблицы для метрик...")
         # Создаем таблицу
         self.create_basic_metrics_table()
         
         with self.engine.connect() as conn:
             # Очищаем таблицу
-            conn.execute(text("TRUNCATE TABLE region_basic_metrics RESTART IDENTITY;"))
+            self.storage.truncate(conn, "region_basic_metrics")
             
-            print("📊 Расчет базовых метрик...")
+            logger.info("📊 Расчет базовых метрик...")
             # Рассчитываем базовые метрики
             result = conn.execute(text("""
                 SELECT 
                     rr.id as region_id,
                     rr.region as region_name,
                     COUNT(f.id) as flight_count,
-                    ROUND(AVG(f.flight_duration_minutes)::numeric, 2) as avg_duration_minutes,
+                    ROUND(AVG(f.flight_duration_minutes), 2) as avg_duration_minutes,
                     COALESCE(SUM(f.flight_duration_minutes), 0) as total_duration_minutes
                 FROM russia_regions rr
                 LEFT JOIN flights f ON rr.id = f.takeoff_region_id
@@ -157,26 +160,26 @@ class BasicMetricsCalculator:
             """))
             
             metrics_data = result.fetchall()
-            print(f"📈 Найдено {len(metrics_data)} регионов для расчета метрик")
+            logger.info("📈 Найдено %d регионов для расчета метрик", len(metrics_data))
             
             # Сохраняем метрики
-            processed_count = 0
+            progress = ProgressLogger(logger, "Расчет метрик регионов", total=len(metrics_data))
             for row in metrics_data:
                 region_id = row[0]
                 region_name = row[1]
                 flight_count = row[2] or 0
                 
-                print(f"🔍 Обработка региона: {region_name} (ID: {region_id}), полетов: {flight_count}")
+                logger.debug("🔍 Обработка региона: %s (ID: %s), полетов: %s", region_name, region_id, flight_count)
                 
                 # Рассчитываем дополнительные метрики только если есть полеты
                 if flight_count > 0:
-                    print(f"  📊 Расчет дополнительных метрик для {region_name}...")
                     peak_load = self.calculate_peak_load(region_id)
                     avg_daily, median_daily = self.calculate_daily_dynamics(region_id)
                     flight_density = self.calculate_flight_density(region_id, flight_count)
                     morning, day, evening, night = self.calculate_time_distribution(region_id)
                     
-                    print(f"  ✅ Метрики рассчитаны: пик={peak_load}, ср.день={avg_daily}")
+                    logger.debug("  ✅ Метрики рассчитаны: пик=%s, ср.день=%s", peak_load, avg_daily)
+                    progress.count("регионов с полетами")
                 else:
                     peak_load = 0
                     avg_daily = 0
@@ -208,13 +211,11 @@ class BasicMetricsCalculator:
                     'night': night
                 })
                 
-                processed_count += 1
-                if processed_count % 10 == 0:
-                    print(f"✅ Обработано {processed_count} регионов...")
+                progress.update()
             
             conn.commit()
         
-        print(f"🎉 Расчет метрик завершен! Обработано {len(metrics_data)} регионов")
+        progress.done()
         return len(metrics_data)
 
     def get_region_metrics(self, region_id):
@@ -236,7 +237,7 @@ class BasicMetricsCalculator:
             
             # Средняя продолжительность полета
             avg_duration_result = conn.execute(text("""
-                SELECT ROUND(AVG(flight_duration_minutes)::numeric, 2) 
+                SELECT ROUND(AVG(flight_duration_minutes), 2) 
                 FROM flights 
                 WHERE flight_duration_minutes IS NOT NULL
             """))
@@ -321,7 +322,7 @@ class BasicMetricsCalculator:
 
 def calculate_metrics(db_url=DB_URL):
     """Функция для расчета метрик"""
-    print(f"🔧 Расчет метрик с DB_URL: {db_url}")
+    logger.debug("🔧 Расчет метрик с DB_URL: %s", db_url)
     
     try:
         calculator = BasicMetricsCalculator(db_url)
@@ -329,31 +330,27 @@ def calculate_metrics(db_url=DB_URL):
         # Проверяем подключение к БД
         with calculator.engine.connect() as conn:
             conn.execute(text("SELECT 1"))
-        print("✅ Подключение к БД успешно")
+        logger.debug("✅ Подключение к БД успешно")
         
         # Проверяем наличие данных
         with calculator.engine.connect() as conn:
             flights_count = conn.execute(text("SELECT COUNT(*) FROM flights")).scalar()
-            print(f"📊 Всего полетов в базе: {flights_count}")
+            logger.info("📊 Всего полетов в базе: %d", flights_count)
             
             regions_count = conn.execute(text("SELECT COUNT(*) FROM russia_regions")).scalar()
-            print(f"🗺️ Всего регионов в базе: {regions_count}")
+            logger.info("🗺️ Всего регионов в базе: %d", regions_count)
         
         if flights_count == 0:
-            print("⚠️ Нет данных о полетах для расчета метрик")
+            logger.warning("⚠️ Нет данных о полетах для расчета метрик")
             return {"success": False, "error": "Нет данных о полетах в базе данных"}
         
         # Рассчитываем метрики
-        print("🔄 Начинаем расчет метрик...")
         count = calculator.calculate_basic_metrics()
         
-        print(f"✅ Метрики рассчитаны для {count} регионов")
-        logger.info(f"✅ Метрики рассчитаны для {count} регионов")
+        logger.info("✅ Метрики рассчитаны для %d регионов", count)
         
         return {"success": True, "regions_count": count}
         
     except Exception as e:
-        error_msg = f"❌ Ошибка расчета метрик: {str(e)}"
-        print(error_msg)
-        logger.error(error_msg)
+        logger.error("❌ Ошибка расчета метрик: %s", e)
         return {"success": False, "error": str(e)}
\ No newline at end of file
@@ -0,0 +1,273 @@
+# migrations.py
+
+import time
+import logging
+from sqlalchemy import text
+from flight_partitions import create_flights_table, convert_flights_to_partitioned, is_partitioned
+from instrumentation import create_ingest_runs_table
+from config import MIGRATION_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+FLIGHTS_TABLE = "flights"
+
+# Ключ advisory-блокировки: миграции не выполняются двумя процессами одновременно
+MIGRATION_LOCK_ID = 4242001
+
+# Столбцы таблицы полетов на момент первой миграции. Новые столбцы
+# добавляются только новыми миграциями, этот список не меняется.
+BASE_FLIGHT_COLUMNS = {
+    "id": "SERIAL",
+    "flight_id": "TEXT",
+    "dof": "DATE",
+    "opr": "TEXT",
+    "reg": "TEXT",
+    "typ": "TEXT",
+    "typ_desc": "TEXT",
+    "sid": "TEXT",
+    "source_file": "TEXT",
+    "takeoff_time": "TEXT",
+    "landing_time": "TEXT",
+    "takeoff_coords": "TEXT",
+    "landing_coords": "TEXT",
+    "takeoff_region_id": "INTEGER",
+    "flight_duration_minutes": "INTEGER",
+    "created_at": "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+}
+
+# Разбор компактных координат (5957N02905E / 554531N0382513E) в SQL,
+# повторяет RegionFinder.parse_compact_coords_to_decimal
+TAKEOFF_LON_SQL = """
+    CASE WHEN length(c) = 11 THEN
+        (substr(c, 6, 3)::int + substr(c, 9, 2)::int / 60.0)
+        * CASE WHEN substr(c, 11, 1) = 'W' THEN -1 ELSE 1 END
+    ELSE
+        (substr(c, 8, 3)::int + substr(c, 11, 2)::int / 60.0 + substr(c, 13, 2)::int / 3600.0)
+        * CASE WHEN substr(c, 15, 1) = 'W' THEN -1 ELSE 1 END
+    END
+"""
+TAKEOFF_LAT_SQL = """
+    CASE WHEN length(c) = 11 THEN
+        (substr(c, 1, 2)::int + substr(c, 3, 2)::int / 60.0)
+        * CASE WHEN substr(c, 5, 1) = 'S' THEN -1 ELSE 1 END
+    ELSE
+        (substr(c, 1, 2)::int + substr(c, 3, 2)::int / 60.0 + substr(c, 5, 2)::int / 3600.0)
+        * CASE WHEN substr(c, 7, 1) = 'S' THEN -1 ELSE 1 END
+    END
+"""
+COMPACT_COORDS_CONDITION = "(c ~ '^[0-9]{4}[NS][0-9]{5}[EW]$' OR c ~ '^[0-9]{6}[NS][0-9]{7}[EW]$')"
+
+
+def get_table_columns(conn, table_name):
+    """Столбцы таблицы в схеме public"""
+    result = conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = :table_name
+    """), {"table_name": table_name})
+    return {row[0] for row in result}
+
+
+def backfill_in_batches(engine, update_sql, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Заполняет производные столбцы пачками по id (без OFFSET), каждая пачка
+    в своей транзакции. update_sql получает параметры :start_id и :end_id.
+    Прерванное заполнение продолжается при следующем запуске миграций.
+    """
+    with engine.connect() as conn:
+        bounds = conn.execute(text(f"SELECT MIN(id), MAX(id) FROM {FLIGHTS_TABLE}")).fetchone()
+    if bounds is None or bounds[0] is None:
+        return 0
+
+    updated = 0
+    start_id, max_id = bounds
+    while start_id <= max_id:
+        end_id = start_id + batch_size
+        with engine.begin() as conn:
+            updated += conn.execute(text(update_sql), {"start_id": start_id, "end_id": end_id}).rowcount
+        start_id = end_id
+        logger.info("🔄 Заполнено %s записей (id < %s)", updated, min(end_id, max_id + 1))
+    return updated
+
+
+def migrate_flights_baseline(engine):
+    """
+    Таблица полетов, секционированная по месяцам. Существующая таблица не
+    пересоздается: недостающие столбцы добавляются, обычная таблица переводится
+    в секционированную с сохранением данных.
+    """
+    with engine.begin() as conn:
+        partitioned = is_partitioned(conn, FLIGHTS_TABLE)
+        if partitioned is None:
+            create_flights_table(conn, BASE_FLIGHT_COLUMNS)
+            return
+
+        existing = get_table_columns(conn, FLIGHTS_TABLE)
+        for col, dtype in BASE_FLIGHT_COLUMNS.items():
+            if col not in existing:
+                conn.execute(text(f"ALTER TABLE {FLIGHTS_TABLE} ADD COLUMN {col} {dtype};"))
+
+        if not partitioned:
+            convert_flights_to_partitioned(conn, BASE_FLIGHT_COLUMNS)
+
+
+def add_takeoff_point_columns(engine):
+    """
+    Десятичные координаты точки вылета: разбор takeoff_coords выполняется
+    один раз при загрузке, а не в каждом запросе тайлов.
+    """
+    with engine.begin() as conn:
+        # Столбцы без значения по умолчанию добавляются без перезаписи таблицы
+        conn.execute(text(f"""
+            ALTER TABLE {FLIGHTS_TABLE}
+                ADD COLUMN IF NOT EXISTS takeoff_lon DOUBLE PRECISION,
+                ADD COLUMN IF NOT EXISTS takeoff_lat DOUBLE PRECISION;
+        """))
+
+    backfill_in_batches(engine, f"""
+        UPDATE {FLIGHTS_TABLE} f
+        SET takeoff_lon = p.lon, takeoff_lat = p.lat
+        FROM (
+            SELECT id, {TAKEOFF_LON_SQL} AS lon, {TAKEOFF_LAT_SQL} AS lat
+            FROM (
+                SELECT id, upper(replace(takeoff_coords, ' ', '')) AS c
+                FROM {FLIGHTS_TABLE}
+                WHERE id >= :start_id AND id < :end_id
+                  AND takeoff_coords IS NOT NULL
+                  AND takeoff_lon IS NULL
+            ) raw
+            WHERE {COMPACT_COORDS_CONDITION}
+        ) p
+        WHERE f.id = p.id
+    """)
+
+
+def normalize_flight_dimensions(engine):
+    """
+    Операторы, борта, типы и исходные файлы выносятся в справочники: в полетах
+    остаются целочисленные ссылки, текстовые столбцы удаляются после заполнения.
+    typ_desc хранится один раз в aircraft_types.description.
+    """
+    # (справочник, столбец значения, столбец в flights, исходный столбец в flights)
+    dimensions = [
+        ("operators", "name", "operator_id", "opr"),
+        ("aircraft", "reg", "aircraft_id", "reg"),
+        ("aircraft_types", "code", "type_id", "typ"),
+        ("source_files", "name", "source_file_id", "source_file"),
+    ]
+
+    with engine.begin() as conn:
+        for table, key, fk_column, _ in dimensions:
+            extra = ",\n                description TEXT" if table == "aircraft_types" else ""
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id SERIAL PRIMARY KEY,
+                    {key} TEXT NOT NULL UNIQUE{extra}
+                )
+            """))
+            conn.execute(text(f"""
+                ALTER TABLE {FLIGHTS_TABLE}
+                    ADD COLUMN IF NOT EXISTS {fk_column} INTEGER REFERENCES {table}(id)
+            """))
+
+        existing = get_table_columns(conn, FLIGHTS_TABLE)
+        if "opr" not in existing:
+            # Текстовые столбцы уже перенесены и удалены
+            return
+
+        for table, key, _, source_column in dimensions:
+            conn.execute(text(f"""
+                INSERT INTO {table} ({key})
+                SELECT DISTINCT {source_column} FROM {FLIGHTS_TABLE} WHERE {source_column} IS NOT NULL
+                ON CONFLICT ({key}) DO NOTHING
+            """))
+        conn.execute(text(f"""
+            UPDATE aircraft_types t SET description = d.typ_desc
+            FROM (
+                SELECT DISTINCT ON (typ) typ, typ_desc FROM {FLIGHTS_TABLE}
+                WHERE typ IS NOT NULL AND typ_desc IS NOT NULL
+                ORDER BY typ, id DESC
+            ) d
+            WHERE t.code = d.typ AND t.description IS NULL
+        """))
+
+    backfill_in_batches(engine, f"""
+        UPDATE {FLIGHTS_TABLE} f
+        SET operator_id = (SELECT id FROM operators WHERE name = f.opr),
+            aircraft_id = (SELECT id FROM aircraft WHERE reg = f.reg),
+            type_id = (SELECT id FROM aircraft_types WHERE code = f.typ),
+            source_file_id = (SELECT id FROM source_files WHERE name = f.source_file)
+        WHERE f.id >= :start_id AND f.id < :end_id
+    """)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            ALTER TABLE {FLIGHTS_TABLE}
+                DROP COLUMN IF EXISTS opr,
+                DROP COLUMN IF EXISTS reg,
+                DROP COLUMN IF EXISTS typ,
+                DROP COLUMN IF EXISTS typ_desc,
+                DROP COLUMN IF EXISTS source_file
+        """))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_flights_source_file_id ON {FLIGHTS_TABLE} (source_file_id)"))
+
+
+def add_ingest_runs_table(engine):
+    """Замеры загрузок файлов полетов по этапам"""
+    with engine.begin() as conn:
+        create_ingest_runs_table(conn, "SERIAL PRIMARY KEY")
+
+
+# Миграции применяются по порядку номеров, каждая ровно один раз
+MIGRATIONS = [
+    (1, "Секционированная таблица полетов", migrate_flights_baseline),
+    (2, "Координаты точки вылета takeoff_lon/takeoff_lat", add_takeoff_point_columns),
+    (3, "Справочники операторов, бортов, типов и файлов", normalize_flight_dimensions),
+    (4, "Замеры загрузок ingest_runs", add_ingest_runs_table),
+]
+
+
+def get_applied_versions(conn):
+    """Номера уже примененных миграций"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            duration_seconds NUMERIC(10, 2),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def apply_migrations(engine):
+    """Применяет недостающие миграции схемы, возвращает номера примененных"""
+    applied_now = []
+    with engine.connect() as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+        try:
+            with engine.begin() as conn:
+                applied = get_applied_versions(conn)
+
+            for version, name, migrate in MIGRATIONS:
+                if version in applied:
+                    continue
+
+                logger.info("🔄 Миграция %s: %s...", version, name)
+                start_time = time.time()
+                migrate(engine)
+                duration = time.time() - start_time
+
+                with engine.begin() as conn:
+                    conn.execute(text("""
+                        INSERT INTO schema_migrations (version, name, duration_seconds)
+                        VALUES (:version, :name, :duration)
+                    """), {"version": version, "name": name, "duration": round(duration, 2)})
+                applied_now.append(version)
+                logger.info("✅ Миграция %s применена за %.2f с", version, duration)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+            lock_conn.commit()
+
+    if not applied_now:
+        logger.info("✅ Схема базы данных актуальна.")
+    return applied_now
@@ -1,5 +1,6 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import json
+from storage import get_storage
 from config import DB_URL
 
 # === Настройки подключения к БД ===
@@ -13,7 +14,7 @@ def get_overview_metrics(db_url=DB_URL):
     - regions_with_flights
     - top_regions (топ-5 по количеству полётов)
     """
-    engine = create_engine(db_url)
+    engine = get_storage(db_url).engine
     
     with engine.connect() as conn:
         # 1. Общее количество полётов
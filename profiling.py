@@ -0,0 +1,174 @@
+# profiling.py
+
+import os
+import re
+import sys
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import Counter
+from urllib.parse import parse_qs
+from contextlib import contextmanager
+from config import CACHE_DIR, PROFILE_SAMPLE_INTERVAL, PROFILES_KEEP
+
+logger = logging.getLogger(__name__)
+
+# Директория с профилями запросов в формате collapsed stacks (flamegraph.pl, speedscope)
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), CACHE_DIR, 'profiles')
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Профилировщик текущего запроса: потоки, в которые вынесена работа запроса,
+# добавляются к нему через attach_current_thread()
+_current_profiler = contextvars.ContextVar("profiler", default=None)
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профилировщик: фоновый поток раз в interval секунд снимает
+    стеки отслеживаемых потоков и считает одинаковые стеки. Код запроса
+    не трассируется, накладные расходы не зависят от числа вызовов.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.thread_ids = set()
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+
+    def add_thread(self, thread_id):
+        self.thread_ids.add(thread_id)
+
+    def remove_thread(self, thread_id):
+        self.thread_ids.discard(thread_id)
+
+    def start(self):
+        self.add_thread(threading.get_ident())
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Стеки в формате collapsed: 'корень;...;вершина число_семплов'"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def collapse_stack(frame):
+    """Стек кадров от корня к вершине: функция (файл:строка определения)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def attach_current_thread():
+    """Добавляет текущий поток к профилю запроса (для работы, вынесенной в пул потоков)"""
+    profiler = _current_profiler.get()
+    if profiler is not None:
+        profiler.add_thread(threading.get_ident())
+
+
+def detach_current_thread():
+    """Убирает текущий поток из профиля запроса, когда поток возвращается в пул"""
+    profiler = _current_profiler.get()
+    if profiler is not None:
+        profiler.remove_thread(threading.get_ident())
+
+
+def run_attached(func, *args, **kwargs):
+    """Выполняет func в потоке пула, добавив поток к профилю запроса на время вызова"""
+    attach_current_thread()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        detach_current_thread()
+
+
+def is_profile_requested(scope):
+    """
+    Профилирование включается заголовком X-Profile: 1 или параметром ?profile=1
+    (проверяется по ASGI scope, без разбора запроса).
+    Поток цикла событий общий для всех запросов, поэтому в профиль попадают и
+    стеки других запросов, выполнявшихся одновременно. Точный профиль - при
+    единственном запросе; работа в пуле потоков (run_in_db_thread, загрузка файлов)
+    учитывается только для профилируемого запроса.
+    """
+    if (b"x-profile", b"1") in scope.get("headers", ()):
+        return True
+    query_string = scope.get("query_string", b"")
+    return b"profile=1" in query_string and parse_qs(query_string.decode("latin-1")).get("profile") == ["1"]
+
+
+@contextmanager
+def profile_block(label):
+    """
+    Профилирует блок кода и сохраняет профиль в cache/profiles.
+    Возвращает словарь с id профиля.
+    """
+    profile = {"id": uuid.uuid4().hex}
+    profiler = SamplingProfiler()
+    token = _current_profiler.set(profiler)
+    profiler.start()
+    try:
+        yield profile
+    finally:
+        profiler.stop()
+        _current_profiler.reset(token)
+        save_profile(profile["id"], profiler)
+        logger.info(
+            "🔬 Профиль %s (%s): %s семплов за %.2f с", profile["id"], label, profiler.samples, profiler.duration
+        )
+
+
+def save_profile(profile_id, profiler):
+    """Сохраняет профиль и удаляет старые сверх PROFILES_KEEP"""
+    try:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        with open(get_profile_path(profile_id), 'w', encoding='utf-8') as f:
+            f.write(profiler.collapsed())
+
+        profiles = sorted(
+            (os.path.join(PROFILES_DIR, name) for name in os.listdir(PROFILES_DIR)),
+            key=os.path.getmtime,
+            reverse=True
+        )
+        for path in profiles[PROFILES_KEEP:]:
+            os.remove(path)
+    except OSError as e:
+        logger.warning("⚠️ Не удалось сохранить профиль %s: %s", profile_id, e)
+
+
+def get_profile_path(profile_id):
+    return os.path.join(PROFILES_DIR, f"{profile_id}.folded")
+
+
+def read_profile(profile_id):
+    """Профиль в формате collapsed stacks (None, если не найден)"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(get_profile_path(profile_id), 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,163 @@
+# region_index.py
+
+import os
+import logging
+import tempfile
+import threading
+import numpy as np
+import shapely
+from config import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Директория с бинарными индексами регионов (по одному на версию границ в базе)
+REGION_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), CACHE_DIR, 'regions')
+
+# Индекс, загруженный в память процесса сервера
+_region_index = None
+_region_index_lock = threading.Lock()
+
+
+class RegionIndex:
+    """Регионы в памяти процесса с пространственным индексом STRtree"""
+
+    def __init__(self, version, ids, names, geometries):
+        self.version = version
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = list(names)
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find_many(self, lons, lats):
+        """
+        Возвращает id регионов для массивов координат (None, если точка вне регионов).
+        При пересечении регионов берется первый по порядку, как при линейном поиске.
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        result = [None] * len(lons)
+        if len(lons) == 0:
+            return result
+
+        points = shapely.points(lons, lats)
+        point_idx, region_idx = self.tree.query(points, predicate='within')
+
+        # Для каждой точки оставляем регион с минимальным порядковым номером
+        order = np.lexsort((region_idx, point_idx))
+        point_idx, region_idx = point_idx[order], region_idx[order]
+        first = np.ones(len(point_idx), dtype=bool)
+        first[1:] = point_idx[1:] != point_idx[:-1]
+
+        for p, r in zip(point_idx[first].tolist(), region_idx[first].tolist()):
+            result[p] = int(self.ids[r])
+        return result
+
+    def find(self, lon, lat):
+        """Возвращает id региона, содержащего точку, или None"""
+        return self.find_many([lon], [lat])[0]
+
+    def save(self, path):
+        """Сохраняет индекс в .npz: WKB всех геометрий одним буфером со смещениями"""
+        wkb = shapely.to_wkb(self.geometries)
+        offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(item) for item in wkb])
+
+        # Пишем через временный файл, чтобы параллельные процессы не прочитали неполный индекс
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(
+                f,
+                version=np.array(self.version),
+                ids=self.ids,
+                names=np.array(self.names, dtype=str),
+                wkb=np.frombuffer(b''.join(wkb), dtype=np.uint8),
+                offsets=offsets,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Загружает индекс из .npz без разбора GeoJSON"""
+        with np.load(path) as data:
+            buffer = data['wkb'].tobytes()
+            offsets = data['offsets']
+            wkb = [buffer[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+            return cls(
+                str(data['version']),
+                data['ids'],
+                data['names'].tolist(),
+                shapely.from_wkb(wkb),
+            )
+
+
+def get_index_file(version):
+    """Путь к файлу индекса для версии границ"""
+    return os.path.join(REGION_INDEX_DIR, f"{version}.npz")
+
+
+def set_current_index(index):
+    """Делает индекс текущим для процесса и удаляет индексы других версий границ"""
+    global _region_index
+    index_file = get_index_file(index.version)
+
+    with _region_index_lock:
+        _region_index = index
+
+    for file_name in os.listdir(REGION_INDEX_DIR):
+        if file_name.endswith('.npz') and file_name != os.path.basename(index_file):
+            try:
+                os.remove(os.path.join(REGION_INDEX_DIR, file_name))
+            except OSError:
+                pass
+
+
+def build_region_index(version, ids, names, geometries):
+    """
+    Строит индекс регионов версии границ и сохраняет его на диск.
+    ids - id регионов из russia_regions, в том же порядке, что и геометрии.
+    """
+    os.makedirs(REGION_INDEX_DIR, exist_ok=True)
+    index = RegionIndex(version, ids, names, geometries)
+    index.save(get_index_file(version))
+    set_current_index(index)
+    logger.info("✅ Построен индекс регионов версии %s: %s регионов", version, len(index))
+    return index
+
+
+def build_region_index_from_db(storage, version):
+    """Строит индекс регионов по таблице russia_regions хранилища"""
+    ids, names, wkb = storage.read_regions()
+    if not ids:
+        return None
+    return build_region_index(version, ids, names, shapely.from_wkb(wkb))
+
+
+def get_region_index(storage):
+    """
+    Возвращает индекс регионов активной версии границ. Индекс берется из памяти
+    процесса, затем с диска, и только при смене версии строится заново из базы.
+    """
+    global _region_index
+    version = storage.get_boundary_version()
+    if version is None:
+        return None
+
+    with _region_index_lock:
+        if _region_index is not None and _region_index.version == version:
+            return _region_index
+
+    index_file = get_index_file(version)
+    if os.path.exists(index_file):
+        try:
+            index = RegionIndex.load(index_file)
+            set_current_index(index)
+            logger.info("✅ Индекс регионов загружен: %s регионов", len(index))
+            return index
+        except Exception as e:
+            logger.warning("⚠️ Ошибка чтения индекса регионов, строим заново: %s", e)
+
+    return build_region_index_from_db(storage, version)
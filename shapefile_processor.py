@@ -2,26 +2,275 @@ import os
 import geopandas as gpd
 import json
 import logging
-from sqlalchemy import create_engine, text
-import tempfile
+from sqlalchemy import text
 import zipfile
-from map_builder import process_geojson_file
+import glob
+import codecs
+import hashlib
+import struct
+import io
+import csv
+import numpy as np
+import shapely
+from map_builder import process_regions_gdf, regions_from_geojson, regions_to_geojson
+from map_cache import hash_files, get_cache_key, get_active_cached_map, get_last_map_info, update_last_map_info
+from tile_builder import invalidate_tile_cache
+from region_index import build_region_index
+from boundary_versions import ensure_boundary_schema, switch_boundary_version
+from flight_data_processor import RegionFinder, update_takeoff_regions_geojson
+from metrics_calculator import calculate_metrics
+from storage import get_storage, get_boundary_state
 from datetime import datetime
-import shutil
-from config import DB_URL, UPLOADS_FOLDER
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+from config import DB_URL, UPLOADS_FOLDER, DBF_SAMPLE_RECORDS
+
 logger = logging.getLogger(__name__)
 
+# Расширения компонентов shapefile, влияющих на результат обработки
+SHAPEFILE_COMPONENTS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+# Компоненты, без которых shapefile не прочитать, и файл проекции
+REQUIRED_SHAPEFILE_COMPONENTS = ('.shp', '.shx', '.dbf')
+PROJECTION_COMPONENT = '.prj'
+
+# Код файла в заголовке .shp/.shx
+SHP_FILE_CODE = 9994
+
+# Кодировки, которые пробуются по выборке записей DBF, если .cpg и LDID ничего не дали
+FALLBACK_ENCODINGS = ['utf-8', 'cp1251', 'cp866', 'koi8-r', 'iso-8859-5']
+
+# Байт языкового драйвера (LDID, смещение 29 в заголовке DBF) -> кодировка
+DBF_LANGUAGE_DRIVERS = {
+    0x01: 'cp437', 0x02: 'cp850', 0x03: 'cp1252', 0x57: 'cp1252',
+    0x26: 'cp866', 0x65: 'cp866', 0x64: 'cp852', 0x66: 'cp865',
+    0x6A: 'cp737', 0x6B: 'cp857', 0xC8: 'cp1250', 0xC9: 'cp1251', 0xCA: 'cp1254', 0xCB: 'cp1253',
+}
+
+CYRILLIC_LETTERS = set('абвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ')
+
+
+def make_vsizip_path(zip_path, member):
+    """Путь GDAL для чтения файла из ZIP архива без распаковки"""
+    return f"/vsizip/{os.path.abspath(zip_path)}/{member}"
+
+
+def split_vsizip_path(path):
+    """Разбирает путь /vsizip/<архив>.zip/<файл> на путь архива и имя файла в нем"""
+    if not path.startswith('/vsizip/'):
+        return None, None
+    inner = path[len('/vsizip/'):]
+    split_at = inner.lower().find('.zip/')
+    if split_at < 0:
+        return None, None
+    return inner[:split_at + 4], inner[split_at + 5:]
+
+
+def open_shapefile_component(shapefile_path, extension):
+    """
+    Открывает компонент shapefile (.dbf, .cpg) рядом с .shp без учета регистра расширения.
+    Поддерживает shapefile внутри ZIP (путь /vsizip/...). Возвращает файловый объект или None.
+    """
+    zip_path, member = split_vsizip_path(shapefile_path)
+    if zip_path:
+        stem = os.path.splitext(member)[0]
+        with zipfile.ZipFile(zip_path) as zf:
+            for name in zf.namelist():
+                name_stem, name_ext = os.path.splitext(name)
+                if name_stem == stem and name_ext.lower() == extension:
+                    # Файл читается потоком; архив остается открытым, пока открыт компонент
+                    return zf.open(name)
+        return None
+
+    stem = os.path.splitext(shapefile_path)[0]
+    for path in glob.glob(glob.escape(stem) + '.*'):
+        if os.path.splitext(path)[1].lower() == extension:
+            return open(path, 'rb')
+    return None
+
+
+def normalize_encoding(name):
+    """Приводит название кодировки из .cpg (UTF-8, 1251, ANSI 1251, 65001...) к имени кодека Python"""
+    name = (name or '').strip().upper().replace('ANSI', '').replace('WINDOWS-', '').strip()
+    if name in ('65001', 'UTF8', 'UTF-8'):
+        return 'utf-8'
+    if name.isdigit():
+        name = f'cp{name}'
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def read_cpg_encoding(shapefile_path):
+    """Кодировка из файла .cpg, если он есть"""
+    cpg_file = open_shapefile_component(shapefile_path, '.cpg')
+    if not cpg_file:
+        return None
+    with cpg_file as f:
+        return normalize_encoding(f.read().decode('ascii', errors='ignore'))
+
+
+def read_dbf_sample(dbf_file, sample_size=DBF_SAMPLE_RECORDS):
+    """
+    Читает заголовок DBF и первые sample_size записей из открытого файла.
+    Возвращает (LDID, [(имя поля в байтах, [значения в байтах])]) только для текстовых полей.
+    """
+    with dbf_file as f:
+        header = f.read(32)
+        record_count, header_length, record_length = struct.unpack('<IHH', header[4:12])
+        language_driver = header[29]
+
+        descriptors = f.read(header_length - 32)
+        fields = []
+        offset = 1  # первый байт записи - флаг удаления
+        for i in range(0, len(descriptors) - 31, 32):
+            descriptor = descriptors[i:i + 32]
+            if descriptor[0] == 0x0D:
+                break
+            name = descriptor[:11].split(b'\x00')[0]
+            field_type = chr(descriptor[11])
+            length = descriptor[16]
+            fields.append((name, field_type, offset, length))
+            offset += length
+
+        # Записи начинаются сразу после заголовка длиной header_length
+        records = f.read(record_length * min(record_count, sample_size))
+
+    text_fields = []
+    for name, field_type, offset, length in fields:
+        if field_type not in ('C', 'V'):
+            continue
+        values = []
+        for start in range(0, len(records) - record_length + 1, record_length):
+            value = records[start + offset:start + offset + length].rstrip(b' \x00')
+            if value:
+                values.append(value)
+        text_fields.append((name, values))
+
+    return language_driver, text_fields
+
+
+def score_decoded_names(values):
+    """
+    Оценка правдоподобия расшифрованных названий: доля кириллицы с поправкой на
+    регистр (в неверной однобайтовой кодировке Заглавные и строчные буквы перемешаны)
+    """
+    letters = 0
+    wrong_case = 0
+    for value in values:
+        for prev, char in zip(' ' + value, value):
+            if char in CYRILLIC_LETTERS:
+                letters += 1
+                if char.isupper() and prev in CYRILLIC_LETTERS and prev.islower():
+                    wrong_case += 1
+    return letters - 2 * wrong_case
+
+
+def detect_shapefile_encoding(shapefile_path, sample_size=DBF_SAMPLE_RECORDS):
+    """
+    Определяет кодировку и столбец с названиями регионов без чтения геометрии:
+    по .cpg, байту языкового драйвера DBF и выборке из нескольких записей.
+    Возвращает (кодировка, имя столбца); None, если определить не удалось.
+    """
+    dbf_file = open_shapefile_component(shapefile_path, '.dbf')
+    if not dbf_file:
+        return None, None
+
+    language_driver, text_fields = read_dbf_sample(dbf_file, sample_size)
+    declared = [enc for enc in (read_cpg_encoding(shapefile_path), DBF_LANGUAGE_DRIVERS.get(language_driver)) if enc]
+
+    candidates = []
+    for enc in declared + FALLBACK_ENCODINGS:
+        if enc not in candidates:
+            candidates.append(enc)
+
+    best = None
+    for priority, enc in enumerate(candidates):
+        for name, values in text_fields:
+            try:
+                decoded = [value.decode(enc) for value in values]
+                column = name.decode(enc)
+            except UnicodeDecodeError:
+                continue
+            score = score_decoded_names(decoded)
+            if score <= 0:
+                continue
+            # Заявленная кодировка и первый подходящий столбец имеют приоритет при равной оценке
+            key = (score, enc in declared, -priority)
+            if best is None or key > best[0]:
+                best = (key, enc, column)
+            break
+
+    if best:
+        return best[1], best[2]
+
+    # Кириллицы нет: используем заявленную кодировку и первый текстовый столбец с данными
+    encoding = declared[0] if declared else None
+    for name, values in text_fields:
+        if values:
+            return encoding, name.decode(encoding or 'utf-8', errors='replace')
+    return encoding, None
+
+
+def check_component_header(extension, header):
+    """Проверяет первые байты компонента shapefile, возвращает текст ошибки или None"""
+    if extension in ('.shp', '.shx'):
+        if len(header) < 100 or struct.unpack('>i', header[:4])[0] != SHP_FILE_CODE:
+            return f"файл {extension} поврежден или не является shapefile"
+    elif extension == '.dbf':
+        if len(header) < 32 or struct.unpack('<H', header[8:10])[0] <= 32:
+            return "файл .dbf поврежден"
+    return None
+
+
+def validate_shapefile_zip(zip_path):
+    """
+    Проверяет ZIP архив без распаковки: по оглавлению ищет .shp и его компоненты,
+    у обязательных компонентов потоково читает только заголовки.
+    Возвращает (имя .shp в архиве, список предупреждений); при ошибке - ValueError.
+    """
+    try:
+        zf = zipfile.ZipFile(zip_path)
+    except zipfile.BadZipFile:
+        raise ValueError("Файл не является ZIP архивом")
+
+    with zf:
+        members = [info for info in zf.infolist() if not info.is_dir()]
+        shp_members = [info.filename for info in members if info.filename.lower().endswith('.shp')]
+        if not shp_members:
+            raise ValueError("В архиве не найден .shp файл")
+
+        # GDAL ищет компоненты внутри архива с учетом регистра имени
+        shp_member = shp_members[0]
+        stem = os.path.splitext(shp_member)[0]
+        components = {
+            os.path.splitext(info.filename)[1].lower(): info.filename
+            for info in members
+            if os.path.splitext(info.filename)[0] == stem
+        }
+
+        missing = [ext for ext in REQUIRED_SHAPEFILE_COMPONENTS if ext not in components]
+        if missing:
+            raise ValueError(f"В архиве отсутствуют компоненты shapefile: {', '.join(missing)}")
+
+        for extension in REQUIRED_SHAPEFILE_COMPONENTS:
+            with zf.open(components[extension]) as f:
+                error = check_component_header(extension, f.read(100))
+            if error:
+                raise ValueError(f"Некорректный архив: {error}")
+
+    warnings = []
+    if len(shp_members) > 1:
+        warnings.append(f"В архиве несколько .shp файлов, используется {shp_member}")
+    if PROJECTION_COMPONENT not in components:
+        warnings.append("В архиве нет .prj файла, координаты считаются в EPSG:4326")
+    return shp_member, warnings
+
 
 class ShapefileProcessor:
     def __init__(self, db_url=DB_URL):
         self.db_url = db_url
-        self.engine = create_engine(db_url)
+        self.engine = get_storage(db_url).engine
+        self.last_switch = None
 
     def debug_table_creation(self):
         """Метод для отладки создания таблицы"""
@@ -35,7 +284,7 @@ class ShapefileProcessor:
                     );
                 """))
                 exists = result.scalar()
-                logger.info(f"Таблица russia_regions существует: {exists}")
+                logger.info("Таблица russia_regions существует: %s", exists)
                 
                 if exists:
                     # Проверяем структуру таблицы
@@ -46,90 +295,47 @@ class ShapefileProcessor:
                         ORDER BY ordinal_position;
                     """))
                     columns = [f"{row[0]} ({row[1]})" for row in result]
-                    logger.info(f"Структура таблицы: {columns}")
+                    logger.info("Структура таблицы: %s", columns)
                     
                     # Проверяем количество записей
                     result = conn.execute(text("SELECT COUNT(*) FROM russia_regions;"))
                     count = result.scalar()
-                    logger.info(f"Количество записей в таблице: {count}")
+                    logger.info("Количество записей в таблице: %s", count)
                 
                 return exists
                 
         except Exception as e:
-            logger.error(f"Ошибка при отладке таблицы: {e}")
+            logger.error("Ошибка при отладке таблицы: %s", e)
             return False
 
-    def extract_shapefile(self, file_path):
-        """Извлекает shapefile из zip или возвращает путь к существующему файлу"""
+    def locate_shapefile(self, file_path):
+        """
+        Возвращает путь для чтения shapefile. ZIP архив не распаковывается:
+        его содержимое проверяется по заголовкам и читается через /vsizip/.
+        """
         if file_path.lower().endswith('.zip'):
-            # Создаем временную директорию для распаковки
-            temp_dir = tempfile.mkdtemp()
-            logger.info(f"Распаковка ZIP архива в: {temp_dir}")
-            
-            try:
-                # Распаковываем архив
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-                logger.info("ZIP архив успешно распакован")
-                
-                # Ищем .shp файл в распакованных файлах
-                shp_files = []
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        if file.lower().endswith('.shp'):
-                            shp_files.append(os.path.join(root, file))
-                
-                if not shp_files:
-                    logger.error("В архиве не найден .shp файл")
-                    raise ValueError("В архиве не найден .shp файл")
-                
-                # Берем первый найденный .shp файл
-                shp_path = shp_files[0]
-                logger.info(f"Найден shapefile: {shp_path}")
-                
-                return shp_path
-                    
-            except Exception as e:
-                logger.error(f"Ошибка распаковки ZIP архива: {e}")
-                # Очищаем временную папку в случае ошибки
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                raise e
-        else:
-            # Если это не ZIP, возвращаем путь как есть
-            return file_path
+            shp_member, warnings = validate_shapefile_zip(file_path)
+            for warning in warnings:
+                logger.warning("⚠️ %s", warning)
+            logger.info("Найден shapefile в архиве: %s", shp_member)
+            return make_vsizip_path(file_path, shp_member)
+
+        # Если это не ZIP, возвращаем путь как есть
+        return file_path
     
-    def shapefile_to_geojson(self, shapefile_path):
-        """Конвертирует shapefile в GeoJSON"""
-        # Попытка загрузить с разными кодировками
-        encodings = ['utf-8', 'cp1251', 'iso-8859-5', 'koi8-r']
-        gdf = None
-        used_encoding = 'utf-8'
-        region_col = 'region'
-
-        for enc in encodings:
-            try:
-                logger.info(f"Попытка загрузки с кодировкой: {enc}")
-                gdf = gpd.read_file(shapefile_path, encoding=enc)
-                
-                # Ищем столбец с названиями регионов
-                for col in gdf.select_dtypes(include='object').columns:
-                    if not gdf[col].dropna().empty:
-                        sample = gdf[col].dropna().astype(str).iloc[0]
-                        if any(c in sample.lower() for c in 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'):
-                            region_col = col
-                            used_encoding = enc
-                            logger.info(f"Найден столбец с названиями: '{region_col}' (кодировка: {enc})")
-                            break
-                else:
-                    continue
-                break
-            except Exception as e:
-                logger.warning(f"Кодировка {enc} не подошла: {e}")
-                continue
-        else:
-            # Fallback: без указания кодировки
-            logger.info("Используем автоопределение кодировки")
-            gdf = gpd.read_file(shapefile_path)
+    def shapefile_to_geodataframe(self, shapefile_path):
+        """Читает shapefile в GeoDataFrame регионов (столбцы region и geometry, EPSG:4326)"""
+        # Кодировка и столбец с названиями определяются по заголовку и нескольким записям DBF,
+        # геометрия читается один раз
+        used_encoding, region_col = detect_shapefile_encoding(shapefile_path)
+        logger.info("Кодировка: %s, столбец с названиями: '%s'", used_encoding, region_col)
+
+        read_kwargs = {'encoding': used_encoding} if used_encoding else {}
+        if region_col:
+            read_kwargs['include_fields'] = [region_col]
+        gdf = gpd.read_file(shapefile_path, **read_kwargs)
+
+        if not region_col:
             # Выбираем первый текстовый столбец как название
             text_cols = gdf.select_dtypes(include='object').columns.tolist()
             region_col = text_cols[0] if text_cols else 'region_name'
@@ -148,73 +354,13 @@ class ShapefileProcessor:
         gdf = gdf[[region_col, 'geometry']].copy()
         gdf.rename(columns={region_col: 'region'}, inplace=True)
 
-        # Исправляем кодировку если нужно
-        gdf = self._fix_encoding(gdf, used_encoding)
-
-        # Создаем GeoJSON структуру
-        geojson_data = {
-            "type": "FeatureCollection",
-            "features": []
-        }
-
-        for idx, row in gdf.iterrows():
-            # Правильное преобразование геометрии в GeoJSON
-            if hasattr(row.geometry, '__geo_interface__'):
-                geometry_json = row.geometry.__geo_interface__
-            else:
-                try:
-                    from shapely.geometry import mapping
-                    geometry_json = mapping(row.geometry)
-                except:
-                    geometry_json = {
-                        "type": "GeometryCollection",
-                        "geometries": []
-                    }
-
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "region": row['region']
-                },
-                "geometry": geometry_json
-            }
-            geojson_data["features"].append(feature)
-
-        logger.info(f"Создан GeoJSON с {len(gdf)} регионами")
+        logger.info("Прочитано %s регионов", len(gdf))
         
         # Показываем примеры названий
         if len(gdf) > 0:
             logger.info("Примеры регионов:")
             for i, region in enumerate(gdf['region'].head(5), 1):
-                logger.info(f"   {i}. {region}")
-        
-        return geojson_data, len(gdf)
-
-    def _fix_encoding(self, gdf, original_encoding):
-        """Исправление проблем с кодировкой"""
-        sample_text = gdf['region'].iloc[0] if len(gdf) > 0 else ""
-        
-        # Если текст выглядит как неправильная кодировка
-        if 'Р' in str(sample_text) and 'С' in str(sample_text):
-            logger.info("Обнаружена проблема с кодировкой, исправляем...")
-            
-            try:
-                fixed_regions = []
-                for region in gdf['region']:
-                    if region and isinstance(region, str):
-                        try:
-                            fixed = region.encode('windows-1251').decode('utf-8')
-                            fixed_regions.append(fixed)
-                        except:
-                            fixed_regions.append(region)
-                    else:
-                        fixed_regions.append(region)
-                
-                gdf['region'] = fixed_regions
-                logger.info("Кодировка исправлена")
-                
-            except Exception as e:
-                logger.warning(f"Не удалось исправить кодировку: {e}")
+                logger.info("   %s. %s", i, region)
         
         return gdf
 
@@ -259,87 +405,112 @@ class ShapefileProcessor:
                     return True
                     
         except Exception as e:
-            logger.error(f"❌ Ошибка создания таблицы: {e}")
+            logger.error("❌ Ошибка создания таблицы: %s", e)
             return False
 
     def load_to_database(self, geojson_data):
-        """Загружает данные в базу данных PostgreSQL с PostGIS"""
+        """Загружает регионы из GeoJSON в базу данных PostgreSQL с PostGIS"""
+        return self.load_regions_gdf(regions_from_geojson(geojson_data))
+
+    def load_regions_gdf(self, gdf):
+        """Загружает GeoDataFrame регионов (столбцы region и geometry, EPSG:4326)"""
+        return self.load_regions(gdf['region'].tolist(), gdf.geometry.values)
+
+    def load_regions(self, names, geometries):
+        """
+        Массовая загрузка регионов: WKB передается через COPY во временную таблицу,
+        затем регионы становятся новой активной версией границ (switch_boundary_version).
+        id регионов сохраняются, переключение происходит в одной транзакции.
+        """
         try:
-            # Сначала отладочная информация
-            logger.info("🔍 Проверка состояния базы данных перед загрузкой...")
-            table_exists_before = self.debug_table_creation()
-            
+            # Встроенное хранилище (SQLite) загружает регионы само
+            storage = get_storage(self.db_url)
+            if storage.name != "postgresql":
+                return storage.load_regions(names, geometries)
+
             # Создаем таблицу если нужно
-            creation_success = self.create_table_if_not_exists()
-            if not creation_success:
+            if not self.create_table_if_not_exists():
                 logger.error("❌ Не удалось создать таблицу")
                 return False
+
+            geometries = np.asarray(geometries, dtype=object)
+            has_geometry = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+            skipped = int((~has_geometry).sum())
+            if skipped:
+                logger.warning("⚠️ Пропущено %s регионов без геометрии", skipped)
+
+            geometries = geometries[has_geometry]
+            names = np.asarray(names, dtype=object)[has_geometry].tolist()
+            wkb_hex = shapely.to_wkb(geometries, hex=True).tolist()
+            rows = [(ord_, name, wkb) for ord_, (name, wkb) in enumerate(zip(names, wkb_hex))]
+
+            content_hash = hashlib.md5()
+            for _, name, wkb in rows:
+                content_hash.update(f"{name}\t{wkb}\n".encode('utf-8'))
+
+            with self.engine.begin() as conn:
+                ensure_boundary_schema(conn)
+                conn.execute(text("""
+                    CREATE TEMP TABLE russia_regions_staging (
+                        ord INTEGER,
+                        region TEXT,
+                        wkb TEXT
+                    ) ON COMMIT DROP
+                """))
+                self._copy_to_staging(conn, rows)
+                switch = switch_boundary_version(conn, content_hash.hexdigest())
+
+            self.last_switch = switch
+            if switch["unchanged"]:
+                return switch["region_count"] > 0
+
+            # Индекс регионов новой версии строится из уже прочитанной геометрии с id из БД
+            try:
+                build_region_index(f"v{switch['version_id']}", switch["region_ids"], names, geometries)
+            except Exception as e:
+                logger.warning("⚠️ Не удалось построить индекс регионов: %s", e)
+
+            # Границы изменились - кэшированные тайлы устарели
+            invalidate_tile_cache(switch["version_id"])
+
+            # Регионы вылета пересчитываются только для полетов из измененных регионов
+            # (и еще не привязанных - они могли попасть в новые регионы)
+            if switch["reset_flights"] or switch["added"]:
+                update_takeoff_regions_geojson(self.engine, RegionFinder(self.db_url))
+                calculate_metrics(self.db_url)
             
-            # Проверяем после создания
-            logger.info("🔍 Проверка состояния базы данных после создания таблицы...")
-            table_exists_after = self.debug_table_creation()
-            
-            if not table_exists_after:
-                logger.error("❌ Таблица все еще не существует после попытки создания")
-                return False
-            
-            # Очищаем таблицу перед загрузкой
-            with self.engine.connect() as conn:
-                conn.execute(text("TRUNCATE TABLE russia_regions RESTART IDENTITY;"))
-                conn.commit()
-                logger.info("✅ Таблица очищена")
-            
-            # Загружаем данные в базу
-            inserted_count = 0
-            with self.engine.connect() as conn:
-                for feature in geojson_data['features']:
-                    region_name = feature['properties']['region']
-                    geometry_json = json.dumps(feature['geometry'])
-                    
-                    logger.info(f"Загрузка региона: {region_name}")
-                    
-                    try:
-                        # Используем ST_GeomFromGeoJSON для загрузки геометрии
-                        conn.execute(text("""
-                            INSERT INTO russia_regions (region, area_sq_km, geometry)
-                            VALUES (
-                                :region_name,
-                                ST_Area(ST_GeomFromGeoJSON(:geometry)::geography) / 1000000.0,
-                                ST_GeomFromGeoJSON(:geometry)
-                            )
-                        """), {
-                            'region_name': region_name,
-                            'geometry': geometry_json
-                        })
-                        inserted_count += 1
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка вставки региона {region_name}: {e}")
-                        continue
-                
-                # Округляем площади
-                try:
-                    conn.execute(text("""
-                        UPDATE russia_regions 
-                        SET area_sq_km = ROUND(area_sq_km, 2)
-                    """))
-                except Exception as e:
-                    logger.warning(f"⚠️ Не удалось округлить площади: {e}")
-                
-                conn.commit()
-            
-            # Финальная проверка
-            logger.info("🔍 Финальная проверка базы данных...")
-            self.debug_table_creation()
-            
-            logger.info(f"✅ Данные загружены в базу: {inserted_count} регионов")
-            return inserted_count > 0
+            logger.info("✅ Данные загружены в базу: %s регионов", switch['region_count'])
+            return switch["region_count"] > 0
             
         except Exception as e:
-            logger.error(f"❌ Ошибка загрузки в базу: {e}")
+            logger.error("❌ Ошибка загрузки в базу: %s", e)
             import traceback
-            logger.error(f"Детали ошибки: {traceback.format_exc()}")
+            logger.error("Детали ошибки: %s", traceback.format_exc())
             return False
 
+    def _copy_to_staging(self, conn, rows):
+        """Передает строки во временную таблицу через COPY (или пакетной вставкой, если драйвер не умеет COPY)"""
+        cursor = conn.connection.cursor()
+        try:
+            if hasattr(cursor, 'copy_expert'):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                cursor.copy_expert("COPY russia_regions_staging (ord, region, wkb) FROM STDIN WITH (FORMAT csv)", buffer)
+                return
+        finally:
+            cursor.close()
+
+        conn.execute(
+            text("INSERT INTO russia_regions_staging (ord, region, wkb) VALUES (:ord, :region, :wkb)"),
+            [{'ord': ord_, 'region': name, 'wkb': wkb} for ord_, name, wkb in rows]
+        )
+
+
+def get_uploads_geojson_path():
+    """Путь к активному файлу границ в папке uploads"""
+    return os.path.join(UPLOADS_FOLDER, "russia_regions.geojson")
+
 
 def save_geojson_to_uploads(geojson_data):
     """Сохраняет GeoJSON данные в папку uploads как russia_regions.geojson (ПЕРЕЗАПИСЫВАЕТ!)"""
@@ -348,32 +519,86 @@ def save_geojson_to_uploads(geojson_data):
         os.makedirs(UPLOADS_FOLDER, exist_ok=True)
         
         # Путь для сохранения
-        geojson_path = os.path.join(UPLOADS_FOLDER, "russia_regions.geojson")
+        geojson_path = get_uploads_geojson_path()
         
-        # Сохраняем GeoJSON (ПЕРЕЗАПИСЫВАЕМ!)
+        # Сохраняем GeoJSON компактно (ПЕРЕЗАПИСЫВАЕМ!)
         with open(geojson_path, 'w', encoding='utf-8') as f:
-            json.dump(geojson_data, f, ensure_ascii=False, indent=2)
+            json.dump(geojson_data, f, ensure_ascii=False, separators=(',', ':'))
         
-        logger.info(f"✅ GeoJSON сохранен/перезаписан как: {geojson_path}")
+        logger.info("✅ GeoJSON сохранен/перезаписан как: %s", geojson_path)
         return geojson_path
         
     except Exception as e:
-        logger.error(f"❌ Ошибка сохранения GeoJSON: {e}")
+        logger.error("❌ Ошибка сохранения GeoJSON: %s", e)
         return None
 
 
-def process_shapefile(file_path, original_filename):
-    """Основная функция обработки shapefile"""
-    temp_dir = None
+def save_regions_to_uploads(gdf):
+    """Сохраняет GeoDataFrame регионов в uploads/russia_regions.geojson одной компактной сериализацией"""
+    try:
+        os.makedirs(UPLOADS_FOLDER, exist_ok=True)
+        geojson_path = get_uploads_geojson_path()
+
+        with open(geojson_path, 'w', encoding='utf-8') as f:
+            f.write(regions_to_geojson(gdf))
+
+        logger.info("✅ GeoJSON сохранен/перезаписан как: %s", geojson_path)
+        return geojson_path
+
+    except Exception as e:
+        logger.error("❌ Ошибка сохранения GeoJSON: %s", e)
+        return None
+
+
+def get_shapefile_cache_key(file_path):
+    """Ключ кэша карты по исходным байтам ZIP архива или всех компонентов shapefile"""
+    if file_path.lower().endswith('.zip'):
+        component_paths = [file_path]
+    else:
+        stem = os.path.splitext(file_path)[0]
+        component_paths = [
+            path for path in glob.glob(glob.escape(stem) + '.*')
+            if os.path.splitext(path)[1].lower() in SHAPEFILE_COMPONENTS
+        ]
+    return get_cache_key(hash_files(component_paths))
+
+
+def process_shapefile(file_path, original_filename, content_hash=None):
+    """
+    Основная функция обработки shapefile. content_hash - md5 ZIP архива, посчитанный
+    при загрузке (без него файлы хэшируются заново).
+    """
     try:
         processor = ShapefileProcessor()
+
+        # Те же границы уже активны и загружены в БД - файл не разбираем
+        cache_key = get_cache_key(content_hash) if content_hash else get_shapefile_cache_key(file_path)
+        cached_map = get_active_cached_map(cache_key, get_boundary_state(processor.db_url))
+        if cached_map:
+            logger.info("Границы не изменились, используется кэшированная карта: %s", cache_key)
+            last_info = get_last_map_info() or {}
+            return {
+                "success": True,
+                "plotly_data": cached_map,
+                "regions_count": last_info.get("regions_count", len(cached_map.get("data", []))),
+                "database_updated": True,
+                "geojson_saved": True
+            }
         
-        # Извлекаем shapefile если нужно
-        shapefile_path = processor.extract_shapefile(file_path)
-        logger.info(f"Обрабатывается shapefile: {os.path.basename(shapefile_path)}")
+        # Путь для чтения (ZIP читается без распаковки)
+        try:
+            shapefile_path = processor.locate_shapefile(file_path)
+        except ValueError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "status_code": 400
+            }
+        logger.info("Обрабатывается shapefile: %s", os.path.basename(shapefile_path))
         
-        # Конвертируем в GeoJSON
-        geojson_data, regions_count = processor.shapefile_to_geojson(shapefile_path)
+        # Читаем регионы; дальше GeoDataFrame используется без промежуточного GeoJSON
+        gdf = processor.shapefile_to_geodataframe(shapefile_path)
+        regions_count = len(gdf)
         
         if regions_count == 0:
             return {
@@ -382,13 +607,17 @@ def process_shapefile(file_path, original_filename):
             }
         
         # Сохраняем GeoJSON в папку uploads
-        geojson_path = save_geojson_to_uploads(geojson_data)
-        
-        # Загружаем в базу данных
-        db_success = processor.load_to_database(geojson_data)
+        geojson_path = save_regions_to_uploads(gdf)
+
+        # Загружаем в базу данных (там же строится индекс регионов с id из БД)
+        db_success = processor.load_regions_gdf(gdf)
         
-        # Создаем карту с принудительным обновлением
-        plotly_data = process_geojson_file(geojson_data, force_refresh=True)
+        # Создаем карту (из кэша, если эти границы уже обрабатывались)
+        plotly_data = process_regions_gdf(gdf, cache_key=cache_key)
+        update_last_map_info(
+            database_updated=db_success, regions_count=regions_count,
+            boundary_state=get_boundary_state(processor.db_url) if db_success else None
+        )
         
         return {
             "success": True,
@@ -399,12 +628,8 @@ def process_shapefile(file_path, original_filename):
         }
         
     except Exception as e:
-        logger.error(f"Ошибка обработки shapefile: {e}")
+        logger.error("Ошибка обработки shapefile: %s", e)
         return {
             "success": False,
             "error": str(e)
-        }
-    finally:
-        # Очищаем временные файлы
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
\ No newline at end of file
+        }
\ No newline at end of file
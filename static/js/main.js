@@ -7,6 +7,20 @@ let initialPan = null;
 let currentUploadType = 'map'; // 'map' или 'flights'
 let regionIdMapping = {}; // Добавляем mapping: { traceIndex: regionId }
 
+// Уровни детализации карты
+let currentMapLevel = null;
+let mapLevelsInfo = null; // { levels: [...от грубого к детальному], level_min_zoom: {...} }
+let fullMapXRange = null;
+let mapLevelLoading = false;
+
+// Раскраска карты по метрике (геометрия загружается один раз, цвета отдельно)
+let baseMapColors = [];
+let currentMapMetric = '';
+
+// Сессия поэлементной загрузки shapefile (.shp, .shx, .dbf, .prj загружаются по одному)
+let shapefileSessionId = null;
+const SHAPEFILE_COMPONENT_EXTENSIONS = ['.shp', '.shx', '.dbf', '.prj', '.cpg'];
+
 // Глобальные переменные для поиска
 let allRegions = [];
 let currentSuggestions = [];
@@ -1176,9 +1190,9 @@ function handleFiles(files) {
         isSupported = fileName.endsWith('.xlsx') || fileName.endsWith('.xls');
         errorMessage = 'Для данных о полетах поддерживаются только .xlsx и .xls файлы';
     } else {
-        const supportedFormats = ['.geojson', '.json', '.shp', '.shx', '.dbf', '.prj', '.zip'];
+        const supportedFormats = ['.geojson', '.json', '.zip', ...SHAPEFILE_COMPONENT_EXTENSIONS];
         isSupported = supportedFormats.some(format => fileName.endsWith(format));
-        errorMessage = 'Для карт поддерживаются только .geojson, .json, .shp и .zip файлы';
+        errorMessage = 'Для карт поддерживаются только .geojson, .json, .zip и компоненты shapefile (.shp, .shx, .dbf, .prj, .cpg)';
     }
     
     if (!isSupported) {
@@ -1324,6 +1338,13 @@ async function uploadFile() {
     const formData = new FormData();
     formData.append("file", selectedFile);
 
+    // Компоненты shapefile отправляются в одну сессию, пока сервер не соберет полный набор
+    const isShapefileComponent = currentUploadType === 'map' &&
+        SHAPEFILE_COMPONENT_EXTENSIONS.some(ext => selectedFile.name.toLowerCase().endsWith(ext));
+    if (isShapefileComponent && shapefileSessionId) {
+        formData.append("session_id", shapefileSessionId);
+    }
+
     const progressBar = document.getElementById('progressBar');
     const progress = document.getElementById('progress');
     const uploadStatus = document.getElementById('uploadStatus');
@@ -1366,6 +1387,8 @@ async function uploadFile() {
             } catch (e) {
                 console.error('❌ Ошибка парсинга ошибки:', e);
             }
+            // Сессия могла истечь - следующий компонент начнет новую
+            if (isShapefileComponent) shapefileSessionId = null;
             throw new Error(errorMessage);
         }
 
@@ -1375,6 +1398,27 @@ async function uploadFile() {
         const result = await response.json();
         console.log('✅ Данные успешно обработаны:', result);
 
+        if (result.status === 'waiting_for_components') {
+            shapefileSessionId = result.session_id;
+            const missing = (result.missing_files || []).join(', ');
+            if (progress) progress.style.width = '100%';
+            if (uploadStatus) {
+                uploadStatus.textContent = `Компонент загружен. Осталось загрузить: ${missing}`;
+                uploadStatus.className = 'upload-status';
+            }
+            showNotification(`Загрузите оставшиеся компоненты shapefile: ${missing}`, 'info');
+
+            // Окно остается открытым для выбора следующего компонента
+            const fileInput = document.getElementById('fileInput');
+            const uploadBtn = document.getElementById('uploadBtn');
+            if (fileInput) fileInput.value = '';
+            if (uploadBtn) uploadBtn.disabled = true;
+            selectedFile = null;
+            return;
+        }
+
+        if (isShapefileComponent) shapefileSessionId = null;
+
         if (progress) progress.style.width = '100%';
         
         if (currentUploadType === 'map') {
@@ -1658,7 +1702,8 @@ function loadLastMap() {
     
     mapDiv.innerHTML = '<div class="loading"><div class="spinner"></div><span>Загрузка последней карты...</span></div>';
 
-    fetch('/last_map')
+    // Сначала загружаем самый грубый уровень, детализация подгружается при увеличении
+    fetch('/map')
         .then(response => {
             if (!response.ok) {
                 mapDiv.innerHTML = '<div class="welcome-message"><i class="fas fa-map-marked-alt"></i><h3>Добро пожаловать в систему анализа полетов БПЛА</h3><p>Загрузите GeoJSON или Shapefile для построения интерактивной карты регионов</p><button class="btn-primary" onclick="openUploadModal()"><i class="fas fa-file-upload"></i> Загрузить данные карты</button></div>';
@@ -1693,8 +1738,15 @@ function renderMap(plotlyData) {
         selectedRegionIndex = null;
         selectedTraceIndex = null;
         regionIdMapping = {};
+        currentMapLevel = plotlyData.level || null;
+        mapLevelsInfo = plotlyData.levels ? {
+            levels: plotlyData.levels,
+            level_min_zoom: plotlyData.level_min_zoom || {}
+        } : null;
+        fullMapXRange = null;
         
         originalColors = plotlyData.data.map(trace => trace.fillcolor || '#ccc');
+        baseMapColors = originalColors.slice();
         
         // Сбрасываем mapping
         regionIdMapping = {};
@@ -1746,6 +1798,12 @@ function renderMap(plotlyData) {
         Plotly.newPlot('map', plotlyData.data, layout, config).then(() => {
             console.log('✅ Карта успешно отрисована');
 
+            // Запоминаем полный охват карты для расчета коэффициента увеличения
+            const fullLayout = document.getElementById('map')._fullLayout;
+            if (fullLayout && fullLayout.xaxis && fullLayout.xaxis.range) {
+                fullMapXRange = fullLayout.xaxis.range.slice();
+            }
+
             // Восстанавливаем выделение региона если оно было
             setTimeout(() => {
                 restoreRegionSelection();
@@ -1768,6 +1826,11 @@ function renderMap(plotlyData) {
             
             // Загружаем mapping регионов после отрисовки карты
             loadRegionMapping(plotlyData);
+
+            // Применяем выбранную раскраску по метрике
+            if (currentMapMetric) {
+                applyMapStyle();
+            }
             
             enforceDefaultCursor();
             
@@ -1846,6 +1909,7 @@ function renderMap(plotlyData) {
             // Восстанавливаем обработчики для перетаскивания
             mapElement.on('plotly_relayout', function (eventData) {
                 enforceDefaultCursor();
+                refineMapOnZoom();
             });
 
             // Восстанавливаем обработчики мыши
@@ -1876,6 +1940,127 @@ function renderMap(plotlyData) {
     }
 }
 
+/**
+ * Инициализация выбора метрики для раскраски карты
+ */
+function initMapStyleControl() {
+    const metricSelect = document.getElementById('map-metric');
+    if (!metricSelect) return;
+
+    metricSelect.addEventListener('change', function () {
+        currentMapMetric = metricSelect.value;
+        applyMapStyle();
+    });
+}
+
+/**
+ * Раскрашивает регионы по выбранной метрике, запрашивая только массив цветов
+ */
+async function applyMapStyle() {
+    const mapElement = document.getElementById('map');
+    if (!mapElement || !mapElement.data || mapElement.data.length === 0) return;
+
+    let colors = baseMapColors.slice();
+
+    if (currentMapMetric) {
+        try {
+            const response = await fetch(`/map/style?metric=${encodeURIComponent(currentMapMetric)}&bins=quantile`);
+            if (!response.ok) {
+                showNotification('Не удалось получить раскраску карты', 'warning');
+                return;
+            }
+            const style = await response.json();
+
+            // Сопоставляем цвета с трассами по названию региона
+            const colorByName = {};
+            style.regions.forEach((name, index) => {
+                colorByName[name] = style.fillcolor[index];
+            });
+            colors = mapElement.data.map((trace, index) =>
+                colorByName[trace.name] || style.no_data_color || baseMapColors[index]
+            );
+        } catch (error) {
+            console.error('❌ Ошибка загрузки раскраски карты:', error);
+            return;
+        }
+    }
+
+    originalColors = colors;
+
+    // Выделенный регион сохраняет цвет выделения
+    const indices = [];
+    const fillcolors = [];
+    colors.forEach((color, index) => {
+        if (index !== selectedTraceIndex) {
+            indices.push(index);
+            fillcolors.push(color);
+        }
+    });
+    if (indices.length > 0) {
+        await Plotly.restyle('map', { fillcolor: fillcolors }, indices);
+    }
+}
+
+/**
+ * Подгружает более детальный уровень карты при увеличении масштаба
+ */
+async function refineMapOnZoom() {
+    if (!mapLevelsInfo || !fullMapXRange || mapLevelLoading) return;
+
+    const mapElement = document.getElementById('map');
+    const xRange = mapElement.layout?.xaxis?.range;
+    if (!xRange) return;
+
+    const zoom = (fullMapXRange[1] - fullMapXRange[0]) / Math.abs(xRange[1] - xRange[0]);
+
+    // Самый детальный уровень, разрешенный при текущем увеличении
+    let targetLevel = mapLevelsInfo.levels[0];
+    mapLevelsInfo.levels.forEach(level => {
+        if (zoom >= (mapLevelsInfo.level_min_zoom[level] || 1)) {
+            targetLevel = level;
+        }
+    });
+
+    // Только уточняем: при отдалении оставляем уже загруженную детализацию
+    const levels = mapLevelsInfo.levels;
+    if (levels.indexOf(targetLevel) <= levels.indexOf(currentMapLevel)) return;
+
+    mapLevelLoading = true;
+    try {
+        const response = await fetch(`/map?level=${encodeURIComponent(targetLevel)}`);
+        if (!response.ok) return;
+        const levelData = await response.json();
+
+        // Заменяем только координаты, сохраняя цвета, выделение и обработчики
+        const traceIndexByName = {};
+        mapElement.data.forEach((trace, index) => {
+            traceIndexByName[trace.name] = index;
+        });
+
+        const xs = [];
+        const ys = [];
+        const indices = [];
+        levelData.data.forEach(trace => {
+            const index = traceIndexByName[trace.name];
+            if (index !== undefined) {
+                xs.push(trace.x);
+                ys.push(trace.y);
+                indices.push(index);
+            }
+        });
+
+        currentMapLevel = levelData.level || targetLevel;
+        if (indices.length > 0) {
+            await Plotly.restyle('map', { x: xs, y: ys }, indices);
+        }
+        console.log(`🔍 Загружен уровень детализации карты: ${currentMapLevel}`);
+    } catch (error) {
+        console.error('❌ Ошибка загрузки уровня детализации:', error);
+    } finally {
+        mapLevelLoading = false;
+    }
+}
+
 /**
  * Выделяет регион на карте с ярким контрастным цветом
  */
@@ -2514,6 +2699,10 @@ function updateStatsAfterFlightUpload(statistics) {
         showNotification('Статистика обновлена', 'success');
         setTimeout(() => {
             loadOverallStats();
+            // Обновляем только цвета карты, геометрия не перезагружается
+            if (currentMapMetric) {
+                applyMapStyle();
+            }
         }, 1000);
     }
 }
@@ -2561,6 +2750,7 @@ document.addEventListener('DOMContentLoaded', async function () {
         initFlightsFileUpload(); // Инициализация загрузки полетов
         initSearch();
         initMetricFilter();
+        initMapStyleControl();
         
         console.log('✅ Все модули инициализированы');
         
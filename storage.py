@@ -0,0 +1,301 @@
+# storage.py
+
+import hashlib
+import functools
+import logging
+import threading
+import anyio
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from profiling import run_attached
+from config import DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_THREADPOOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Хранилища по URL: движок и пул соединений создаются один раз на процесс
+_storages = {}
+_storages_lock = threading.Lock()
+# Ограничение одновременных обращений к БД из обработчиков (создается в цикле событий)
+_db_limiter = None
+
+
+def get_pool_options(db_url):
+    """
+    Размер пула соединений из config. Задается только для QueuePool: SQLite в памяти
+    (sqlite://) использует SingletonThreadPool, который этих параметров не принимает.
+    """
+    url = make_url(db_url)
+    if url.get_dialect().get_pool_class(url) is not QueuePool:
+        return {}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+
+
+class PostgresStorage:
+    """PostgreSQL + PostGIS: основное хранилище приложения"""
+
+    name = "postgresql"
+    serial_primary_key = "SERIAL PRIMARY KEY"
+
+    def __init__(self, db_url):
+        self.db_url = db_url
+        self.engine = create_engine(db_url, **get_pool_options(db_url))
+
+    def ensure_flights_schema(self):
+        """Применяет миграции схемы полетов"""
+        from migrations import apply_migrations
+        apply_migrations(self.engine)
+
+    def prepare_flight_months(self, conn, dofs):
+        """Создает месячные партиции для дат загружаемых полетов"""
+        from flight_partitions import ensure_flight_partitions
+        ensure_flight_partitions(conn, dofs)
+
+    def truncate(self, conn, table_name):
+        """Очищает таблицу со сбросом счетчика id"""
+        conn.execute(text(f"TRUNCATE TABLE {table_name} RESTART IDENTITY;"))
+
+    def has_table(self, conn, table_name):
+        """Проверяет существование таблицы"""
+        from boundary_versions import table_exists
+        return table_exists(conn, table_name)
+
+    def get_boundary_version(self):
+        """Версия индекса регионов для активной версии границ (None, если границ нет)"""
+        from boundary_versions import table_exists, ensure_boundary_schema, get_active_boundary_version
+        with self.engine.begin() as conn:
+            if not table_exists(conn, "russia_regions"):
+                return None
+            ensure_boundary_schema(conn)
+            active = get_active_boundary_version(conn)
+        return f"v{active[0]}" if active else None
+
+    def read_regions(self):
+        """Регионы активной версии: (ids, names, WKB)"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT id, region, ST_AsBinary(geometry)
+                FROM russia_regions
+                WHERE geometry IS NOT NULL
+                ORDER BY id
+            """)).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows], [bytes(row[2]) for row in rows]
+
+    def load_regions(self, names, geometries):
+        """Загружает регионы новой версией границ (с сохранением id)"""
+        from shapefile_processor import ShapefileProcessor
+        return ShapefileProcessor(self.db_url).load_regions(names, geometries)
+
+
+class SQLiteStorage:
+    """
+    Встроенное хранилище SQLite для офлайн-запусков и бенчмарков: без сервера БД
+    и PostGIS. Геометрия регионов хранится как WKB, площадь считается в Python.
+    Векторные тайлы и версионирование id регионов в нем недоступны.
+    """
+
+    name = "sqlite"
+    serial_primary_key = "INTEGER PRIMARY KEY AUTOINCREMENT"
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS russia_regions (
+            id INTEGER PRIMARY KEY,
+            region TEXT NOT NULL,
+            area_sq_km REAL,
+            geometry BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS boundary_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content_hash TEXT,
+            region_count INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE TABLE IF NOT EXISTS operators (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE)",
+        "CREATE TABLE IF NOT EXISTS aircraft (id INTEGER PRIMARY KEY AUTOINCREMENT, reg TEXT NOT NULL UNIQUE)",
+        """
+        CREATE TABLE IF NOT EXISTS aircraft_types (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL UNIQUE,
+            description TEXT
+        )
+        """,
+        "CREATE TABLE IF NOT EXISTS source_files (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE)",
+        """
+        CREATE TABLE IF NOT EXISTS flights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            flight_id TEXT,
+            dof DATE,
+            operator_id INTEGER REFERENCES operators(id),
+            aircraft_id INTEGER REFERENCES aircraft(id),
+            type_id INTEGER REFERENCES aircraft_types(id),
+            sid TEXT,
+            source_file_id INTEGER REFERENCES source_files(id),
+            takeoff_time TEXT,
+            landing_time TEXT,
+            takeoff_coords TEXT,
+            landing_coords TEXT,
+            takeoff_region_id INTEGER,
+            flight_duration_minutes INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            takeoff_lon REAL,
+            takeoff_lat REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_flights_region_dof ON flights (takeoff_region_id, dof)",
+        "CREATE INDEX IF NOT EXISTS idx_flights_source_file_id ON flights (source_file_id)",
+    ]
+
+    def __init__(self, db_url):
+        self.db_url = db_url
+        self.engine = create_engine(db_url, **get_pool_options(db_url))
+
+        # pysqlite сам управляет транзакциями и ломает SAVEPOINT: транзакции
+        # открываются явно (рецепт из документации SQLAlchemy)
+        @event.listens_for(self.engine, "connect")
+        def disable_pysqlite_transactions(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(self.engine, "begin")
+        def begin_transaction(conn):
+            conn.exec_driver_sql("BEGIN")
+
+    def ensure_flights_schema(self):
+        """Создает таблицы полетов, справочников, регионов и замеров загрузок"""
+        from instrumentation import create_ingest_runs_table
+        with self.engine.begin() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(text(statement))
+            create_ingest_runs_table(conn, self.serial_primary_key)
+
+    def prepare_flight_months(self, conn, dofs):
+        """Секционирования нет - ничего не делает"""
+
+    def truncate(self, conn, table_name):
+        """Очищает таблицу со сбросом счетчика id"""
+        conn.execute(text(f"DELETE FROM {table_name}"))
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :table_name"), {"table_name": table_name})
+
+    def get_boundary_version(self):
+        """Версия индекса регионов по последней загрузке границ"""
+        with self.engine.connect() as conn:
+            version_id = conn.execute(text("SELECT MAX(id) FROM boundary_versions")).scalar()
+        return f"sqlite-v{version_id}" if version_id else None
+
+    def read_regions(self):
+        """Регионы: (ids, names, WKB)"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT id, region, geometry FROM russia_regions
+                WHERE geometry IS NOT NULL
+                ORDER BY id
+            """)).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows], [bytes(row[2]) for row in rows]
+
+    def load_regions(self, names, geometries):
+        """
+        Заменяет регионы целиком. Площадь считается на эллипсоиде WGS84,
+        как ST_Area(geography) в PostGIS. Полеты привязываются к регионам заново.
+        """
+        import numpy as np
+        import shapely
+        from pyproj import Geod
+        from region_index import build_region_index
+
+        self.ensure_flights_schema()
+        geometries = np.asarray(geometries, dtype=object)
+        has_geometry = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        geometries = geometries[has_geometry]
+        names = np.asarray(names, dtype=object)[has_geometry].tolist()
+
+        geod = Geod(ellps="WGS84")
+        wkb = shapely.to_wkb(geometries).tolist()
+        rows = [
+            {
+                "id": i + 1,
+                "region": name,
+                "area_sq_km": round(abs(geod.geometry_area_perimeter(geometry)[0]) / 1e6, 2),
+                "geometry": item
+            }
+            for i, (name, geometry, item) in enumerate(zip(names, geometries, wkb))
+        ]
+        content_hash = hashlib.md5(b"".join(wkb) + "\n".join(names).encode("utf-8")).hexdigest()
+
+        with self.engine.begin() as conn:
+            if self.has_table(conn, "region_basic_metrics"):
+                conn.execute(text("DELETE FROM region_basic_metrics"))
+            conn.execute(text("DELETE FROM russia_regions"))
+            conn.execute(text("""
+                INSERT INTO russia_regions (id, region, area_sq_km, geometry)
+                VALUES (:id, :region, :area_sq_km, :geometry)
+            """), rows)
+            conn.execute(text("UPDATE flights SET takeoff_region_id = NULL"))
+            version_id = conn.execute(text("""
+                INSERT INTO boundary_versions (content_hash, region_count) VALUES (:content_hash, :region_count)
+            """), {"content_hash": content_hash, "region_count": len(rows)}).lastrowid
+
+        build_region_index(f"sqlite-v{version_id}", [row["id"] for row in rows], names, geometries)
+        logger.info("✅ Регионы загружены в SQLite: %s", len(rows))
+        return len(rows) > 0
+
+    def has_table(self, conn, table_name):
+        """Проверяет существование таблицы"""
+        return conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :table_name"),
+            {"table_name": table_name}
+        ).first() is not None
+
+
+# Хранилища по схеме URL подключения
+STORAGE_BACKENDS = {
+    "postgresql": PostgresStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def get_storage(db_url=DB_URL):
+    """Хранилище для URL подключения (postgresql://... или sqlite:///...)"""
+    with _storages_lock:
+        storage = _storages.get(db_url)
+        if storage is None:
+            scheme = db_url.split(":", 1)[0].split("+", 1)[0]
+            if scheme not in STORAGE_BACKENDS:
+                raise ValueError(f"Неподдерживаемое хранилище: {scheme}")
+            storage = STORAGE_BACKENDS[scheme](db_url)
+            _storages[db_url] = storage
+        return storage
+
+
+def get_boundary_state(db_url=DB_URL):
+    """
+    Состояние границ в базе для проверки кэша карт: хэш URL базы (без пароля) и
+    активная версия границ. None, если границы не загружены или база недоступна.
+    """
+    try:
+        version = get_storage(db_url).get_boundary_version()
+    except Exception as e:
+        logger.warning("⚠️ Не удалось получить версию границ: %s", e)
+        return None
+    if version is None:
+        return None
+    url_hash = hashlib.md5(make_url(db_url).render_as_string(hide_password=True).encode()).hexdigest()[:12]
+    return f"{url_hash}:{version}"
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """
+    Выполняет синхронную работу с БД в пуле потоков, не блокируя цикл событий.
+    Одновременно выполняется не больше DB_THREADPOOL_SIZE вызовов, остальные
+    ждут свободного потока. Контекст запроса (счетчики SQL, профиль) переносится в поток.
+    """
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(DB_THREADPOOL_SIZE)
+
+    return await anyio.to_thread.run_sync(
+        functools.partial(run_attached, func, *args, **kwargs), limiter=_db_limiter
+    )
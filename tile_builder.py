@@ -0,0 +1,184 @@
+# tile_builder.py
+
+import os
+import json
+import uuid
+import shutil
+import logging
+import tempfile
+from datetime import datetime
+from sqlalchemy import text
+from storage import get_storage
+from config import DB_URL, CACHE_DIR, TILE_EXTENT, TILE_BUFFER, TILE_MAX_ZOOM
+
+logger = logging.getLogger(__name__)
+
+# Директория для кэшированных векторных тайлов
+TILE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), CACHE_DIR, 'tiles')
+# Текущее поколение кэша тайлов: версия границ и метка последней инвалидации
+TILE_STATE_FILE = os.path.join(TILE_CACHE_DIR, 'current.json')
+DEFAULT_TILE_STATE = {"boundary_version": None, "generation": "0"}
+
+# Прочитанное состояние и (inode, mtime_ns, size) файла, по которым оно проверяется
+_state_cache = {"version": None, "state": DEFAULT_TILE_STATE}
+
+# Длина экватора в EPSG:3857, используется для расчета размера тайла в метрах
+WEB_MERCATOR_WORLD_SIZE = 40075016.68557849
+
+TILE_SQL = """
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS geom_3857,
+               ST_Transform(ST_TileEnvelope(:z, :x, :y), 4326) AS geom_4326
+    ),
+    tile_regions AS (
+        SELECT r.id, r.region AS name,
+               ST_AsMVTGeom(
+                   ST_Simplify(ST_Transform(r.geometry, 3857), :simplify_tol),
+                   b.geom_3857, :extent, :buffer, true
+               ) AS geom
+        FROM russia_regions r, bounds b
+        WHERE r.geometry && b.geom_4326
+    ),
+    takeoff_points AS (
+        -- Координаты вылета разобраны при загрузке (takeoff_lon/takeoff_lat)
+        SELECT takeoff_region_id AS region_id,
+               ST_Transform(ST_SetSRID(ST_MakePoint(takeoff_lon, takeoff_lat), 4326), 3857) AS geom_3857
+        FROM flights
+        WHERE takeoff_region_id IN (SELECT id FROM tile_regions)
+          AND takeoff_lon IS NOT NULL
+    ),
+    tile_flights AS (
+        -- Точки вылета агрегируются по сетке пикселей тайла
+        SELECT g.region_id, g.flight_count,
+               ST_AsMVTGeom(g.cell, b.geom_3857, :extent, :buffer, true) AS geom
+        FROM (
+            SELECT p.region_id, ST_SnapToGrid(p.geom_3857, :pixel_size) AS cell, COUNT(*) AS flight_count
+            FROM takeoff_points p, bounds b
+            WHERE p.geom_3857 && b.geom_3857
+            GROUP BY p.region_id, cell
+        ) g, bounds b
+    )
+    SELECT
+        COALESCE((SELECT ST_AsMVT(tile_regions.*, 'regions', :extent, 'geom') FROM tile_regions WHERE geom IS NOT NULL), ''::bytea)
+        ||
+        COALESCE((SELECT ST_AsMVT(tile_flights.*, 'flights', :extent, 'geom') FROM tile_flights WHERE geom IS NOT NULL), ''::bytea)
+"""
+
+
+def is_valid_tile(z, x, y):
+    """Проверяет, что координаты тайла существуют на заданном уровне"""
+    if z < 0 or z > TILE_MAX_ZOOM:
+        return False
+    size = 2 ** z
+    return 0 <= x < size and 0 <= y < size
+
+
+def get_tile_cache_state():
+    """
+    Текущее поколение кэша тайлов: {"boundary_version": ..., "generation": ...}.
+    Файл перечитывается, только если изменился (инвалидацию мог выполнить другой воркер).
+    """
+    try:
+        stat = os.stat(TILE_STATE_FILE)
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if _state_cache["version"] != version:
+            with open(TILE_STATE_FILE, 'r', encoding='utf-8') as f:
+                _state_cache["state"] = json.load(f)
+            _state_cache["version"] = version
+        return _state_cache["state"]
+    except (OSError, ValueError):
+        return DEFAULT_TILE_STATE
+
+
+def get_tile_generation_dir(state):
+    """Папка поколения кэша тайлов"""
+    return os.path.join(TILE_CACHE_DIR, f"v{state.get('boundary_version') or 0}-{state['generation']}")
+
+
+def get_tile_cache_file(z, x, y, state=None):
+    """Путь к файлу тайла в кэше текущего (или переданного) поколения"""
+    state = state or get_tile_cache_state()
+    return os.path.join(get_tile_generation_dir(state), str(z), str(x), f"{y}.mvt")
+
+
+def invalidate_tile_cache(boundary_version=None):
+    """
+    Начинает новое поколение кэша тайлов (после загрузки границ, полетов или архивации).
+    Тайл, который строился до инвалидации, сохраняется в папку старого поколения и
+    больше не отдается. boundary_version - новая активная версия границ (без нее
+    сохраняется прежняя). Папки старых поколений удаляются.
+    """
+    try:
+        previous = get_tile_cache_state()
+        state = {
+            "boundary_version": boundary_version if boundary_version is not None else previous.get("boundary_version"),
+            "generation": uuid.uuid4().hex[:12],
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        os.makedirs(TILE_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=TILE_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, TILE_STATE_FILE)
+
+        current_dir = os.path.basename(get_tile_generation_dir(state))
+        for name in os.listdir(TILE_CACHE_DIR):
+            path = os.path.join(TILE_CACHE_DIR, name)
+            if name != current_dir and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        logger.info("Кэш векторных тайлов: новое поколение %s", current_dir)
+    except Exception as e:
+        logger.error("Ошибка очистки кэша тайлов: %s", e)
+
+
+class TileBuilder:
+    """Генерирует Mapbox Vector Tiles из russia_regions и точек вылета через ST_AsMVT"""
+
+    def __init__(self, db_url=DB_URL):
+        self.db_url = db_url
+        self.engine = get_storage(db_url).engine
+
+    def build_tile(self, z, x, y):
+        """Строит тайл в базе данных, возвращает байты MVT"""
+        tile_size = WEB_MERCATOR_WORLD_SIZE / (2 ** z)
+        pixel_size = tile_size / TILE_EXTENT
+
+        with self.engine.connect() as conn:
+            result = conn.execute(text(TILE_SQL), {
+                'z': z,
+                'x': x,
+                'y': y,
+                'extent': TILE_EXTENT,
+                'buffer': TILE_BUFFER,
+                'simplify_tol': pixel_size,
+                'pixel_size': pixel_size
+            })
+            tile = result.scalar()
+
+        return bytes(tile) if tile else b""
+
+    def get_tile(self, z, x, y):
+        """Возвращает тайл из кэша или строит и кэширует его"""
+        # Поколение фиксируется до построения: тайл, построенный во время
+        # инвалидации, попадет в старое поколение
+        cache_file = get_tile_cache_file(z, x, y, get_tile_cache_state())
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    return f.read()
+            except Exception as e:
+                logger.warning("Ошибка чтения тайла из кэша: %s", e)
+
+        tile = self.build_tile(z, x, y)
+
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            # Пишем через временный файл, чтобы параллельные запросы не увидели неполный тайл
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(tile)
+            os.replace(tmp_path, cache_file)
+        except Exception as e:
+            logger.warning("Ошибка сохранения тайла в кэш: %s", e)
+
+        return tile
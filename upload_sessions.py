@@ -0,0 +1,93 @@
+# upload_sessions.py
+
+import os
+import re
+import time
+import uuid
+import shutil
+import logging
+from shapefile_processor import REQUIRED_SHAPEFILE_COMPONENTS, PROJECTION_COMPONENT, SHAPEFILE_COMPONENTS
+from shapefile_processor import check_component_header
+from config import SHAPEFILE_SESSION_TTL
+
+logger = logging.getLogger(__name__)
+
+# Компоненты, которые нужно дождаться перед обработкой (проекция тоже, иначе CRS будет неверной)
+SESSION_REQUIRED_COMPONENTS = REQUIRED_SHAPEFILE_COMPONENTS + (PROJECTION_COMPONENT,)
+
+# Все компоненты сессии сохраняются с одним именем, чтобы GDAL нашел их рядом с .shp
+SESSION_SHAPEFILE_STEM = "boundaries"
+
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadSessionError(ValueError):
+    """Ошибка сессии загрузки (неверный идентификатор или компонент)"""
+
+
+def get_session_dir(base_dir, session_id):
+    """Папка сессии; идентификатор проверяется, чтобы нельзя было выйти за base_dir"""
+    if not SESSION_ID_PATTERN.match(session_id or ""):
+        raise UploadSessionError("Некорректный идентификатор сессии загрузки")
+    return os.path.join(base_dir, session_id)
+
+
+def cleanup_expired_sessions(base_dir, ttl=SHAPEFILE_SESSION_TTL):
+    """Удаляет сессии, в которые давно ничего не загружали"""
+    if not os.path.isdir(base_dir):
+        return
+    now = time.time()
+    for name in os.listdir(base_dir):
+        session_dir = os.path.join(base_dir, name)
+        if os.path.isdir(session_dir) and now - os.path.getmtime(session_dir) > ttl:
+            shutil.rmtree(session_dir, ignore_errors=True)
+            logger.info("🧹 Удалена просроченная сессия загрузки: %s", name)
+
+
+def get_session_components(session_dir):
+    """Расширения уже загруженных компонентов"""
+    if not os.path.isdir(session_dir):
+        return []
+    return sorted(os.path.splitext(name)[1].lower() for name in os.listdir(session_dir))
+
+
+def add_session_component(base_dir, session_id, filename, source_path):
+    """
+    Переносит сохраненный компонент shapefile (source_path) в сессию (новую, если
+    session_id не передан). source_path должен быть на том же диске, что и base_dir.
+    Возвращает (session_id, путь к .shp или None, список недостающих компонентов).
+    """
+    cleanup_expired_sessions(base_dir)
+
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in SHAPEFILE_COMPONENTS:
+        raise UploadSessionError(f"Неподдерживаемый компонент shapefile: {extension}")
+
+    with open(source_path, "rb") as f:
+        header = f.read(100)
+    error = check_component_header(extension, header)
+    if error:
+        raise UploadSessionError(f"Некорректный компонент: {error}")
+
+    if session_id:
+        session_dir = get_session_dir(base_dir, session_id)
+        if not os.path.isdir(session_dir):
+            raise UploadSessionError("Сессия загрузки не найдена или истекла")
+    else:
+        session_id = uuid.uuid4().hex
+        session_dir = get_session_dir(base_dir, session_id)
+        os.makedirs(session_dir)
+
+    os.replace(source_path, os.path.join(session_dir, SESSION_SHAPEFILE_STEM + extension))
+    # Время изменения папки продлевает жизнь сессии
+    os.utime(session_dir)
+
+    received = get_session_components(session_dir)
+    missing = [ext for ext in SESSION_REQUIRED_COMPONENTS if ext not in received]
+    shp_path = None if missing else os.path.join(session_dir, SESSION_SHAPEFILE_STEM + ".shp")
+    return session_id, shp_path, missing
+
+
+def remove_session(base_dir, session_id):
+    """Удаляет сессию после успешной обработки"""
+    shutil.rmtree(get_session_dir(base_dir, session_id), ignore_errors=True)
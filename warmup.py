@@ -0,0 +1,135 @@
+# warmup.py
+
+import time
+import logging
+import threading
+from datetime import datetime
+from storage import get_storage
+from config import DB_URL
+
+logger = logging.getLogger(__name__)
+
+# Состояние прогрева для /ready
+_state = {"status": "pending", "started_at": None, "duration_seconds": None, "steps": {}}
+_state_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def warm_region_index(db_url):
+    """Индекс регионов активной версии границ (для определения регионов вылета)"""
+    from region_index import get_region_index
+    index = get_region_index(get_storage(db_url))
+    return len(index) if index is not None else 0
+
+
+def warm_map_payload(db_url):
+    """Все уровни детализации активной карты в памяти процесса"""
+    from map_cache import get_last_map_info, get_last_map
+    last_info = get_last_map_info()
+    if not last_info:
+        return 0
+    levels = last_info.get("levels") or [None]
+    return sum(1 for level in levels if get_last_map(level) is not None)
+
+
+def warm_metrics(db_url):
+    """
+    Запросы метрик регионов и общей аналитики. Результаты не сохраняются: шаг только
+    открывает соединение пула и прогревает кэш страниц БД. Без region_basic_metrics
+    (метрики еще не рассчитывались) пропускается.
+    """
+    storage = get_storage(db_url)
+    with storage.engine.connect() as conn:
+        if not storage.has_table(conn, "region_basic_metrics"):
+            return 0
+
+    from metrics_calculator import BasicMetricsCalculator
+    from overview_metrics import get_overview_metrics
+    regions = BasicMetricsCalculator(db_url).get_all_regions_metrics()
+    get_overview_metrics(db_url)
+    return len(regions)
+
+
+def warm_ingest_modules(db_url):
+    """
+    Модули загрузки файлов (pandas, geopandas) - первая загрузка не ждет импорта.
+    Выполняется после готовности: эндпоинтам чтения эти модули не нужны.
+    """
+    import flight_data_processor
+    import shapefile_processor
+    return None
+
+
+# Шаги до готовности (/ready отвечает 503, пока они выполняются)
+WARMUP_STEPS = (
+    ("region_index", warm_region_index),
+    ("map_payload", warm_map_payload),
+    ("metrics", warm_metrics),
+)
+# Шаги после готовности: запросы уже принимаются
+BACKGROUND_WARMUP_STEPS = (
+    ("ingest_modules", warm_ingest_modules),
+)
+
+
+def run_warmup_step(name, step, db_url):
+    """Выполняет шаг прогрева и записывает его время (или ошибку) в состояние"""
+    step_started = time.perf_counter()
+    item = {}
+    try:
+        item["items"] = step(db_url)
+    except Exception as e:
+        item["error"] = str(e)
+        logger.warning("⚠️ Прогрев %s не выполнен: %s", name, e)
+    item["seconds"] = round(time.perf_counter() - step_started, 3)
+    with _state_lock:
+        _state["steps"][name] = item
+
+
+def run_warmup(db_url=DB_URL):
+    """
+    Выполняет шаги прогрева по очереди, затем отмечает готовность и выполняет
+    фоновые шаги. Ошибка шага (например, регионы еще не загружены) записывается
+    в состояние и не мешает готовности сервера.
+    """
+    started = time.perf_counter()
+    with _state_lock:
+        _state["status"] = "warming"
+        _state["started_at"] = datetime.now().isoformat(timespec="seconds")
+
+    for name, step in WARMUP_STEPS:
+        run_warmup_step(name, step, db_url)
+
+    duration = time.perf_counter() - started
+    with _state_lock:
+        _state["status"] = "ready"
+        _state["duration_seconds"] = round(duration, 3)
+    _ready.set()
+    logger.info("🔥 Прогрев завершен за %.2f с", duration, extra={"warmup_seconds": round(duration, 3)})
+
+    for name, step in BACKGROUND_WARMUP_STEPS:
+        run_warmup_step(name, step, db_url)
+
+
+def start_warmup(db_url=DB_URL):
+    """Запускает прогрев в фоновом потоке: сервер принимает запросы сразу, /ready - после прогрева"""
+    thread = threading.Thread(target=run_warmup, args=(db_url,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_ready():
+    """Готовность без прогрева (WARMUP_ON_STARTUP=0)"""
+    with _state_lock:
+        _state["status"] = "ready"
+    _ready.set()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def get_warmup_state():
+    """Копия состояния прогрева для /ready"""
+    with _state_lock:
+        return {**_state, "steps": {name: dict(item) for name, item in _state["steps"].items()}}